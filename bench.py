@@ -0,0 +1,431 @@
+"""Benchmark: a synthetic camera farm, the real recorder and server, and simulated viewers.
+
+    python bench.py --cameras 16 --viewers 50 --duration 120 --json run.json
+    python bench.py --cameras 16 --viewers 50 --duration 120 --compare run.json
+
+Every camera is a local ffmpeg ``testsrc2`` source served over HTTP, either
+as MJPEG (recorded by transcoding) or as H.264 in MPEG-TS (recorded in copy
+mode, like an RTSP camera). The recorder (start_dash_streams.py) and the web
+server (serve.py) run unchanged against a separate bench config file, then
+viewer threads fetch the home page, DASH manifests and segments, and MP4
+exports. The report covers recorder CPU per camera, segment interval/age,
+request latency percentiles and disk write throughput.
+
+Runs are repeatable for a given --seed, camera count and duration; --compare
+exits with status 1 when a run is worse than a saved one by more than
+--tolerance. The recorder and server run in a scratch folder (--work, a
+temporary one by default) holding the bench config, recordings, live
+outputs, catalog and status file, so a bench never touches the node's real
+data. Needs ffmpeg and the packages in requirements-dev.txt:
+
+    pip install -r requirements-dev.txt
+"""
+import argparse
+import json
+import os
+import random
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+from datetime import datetime
+from pathlib import Path
+
+import psutil
+
+from shards import list_shards
+
+# Inside the work folder; the recorder and server run with it as their
+# working directory, so their catalog and status file land there too
+BENCH_CONFIG = "bench_config.json"
+STATUS_FILE = "recorder_status.json"
+DASH_DIR = "dashvideos"
+LIVE_DIR = "live"
+
+# Synthetic sources listen on consecutive ports from here
+SOURCE_BASE_PORT = 57000
+
+# Web server port used while benchmarking
+SERVER_PORT = 5099
+
+# Seconds the recorders run before measuring starts (first segments, manifests)
+WARMUP = 20
+
+# Relative weight of each viewer action
+VIEWER_MIX = {"segment": 0.85, "index": 0.1, "download_mp4": 0.05}
+
+# Metrics compared by --compare, and whether higher is worse
+COMPARED = {
+    "cpu_per_camera": True,
+    "segment_age_p99": True,
+    "request_p50": True,
+    "request_p99": True,
+    "request_errors": True,
+    "requests_per_second": False,
+}
+
+def percentile(values, share):
+    """Nearest-rank percentile; None for no values"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(int(share * len(ordered)), len(ordered) - 1)]
+
+def source_command(kind, port, width, height, fps):
+    """ffmpeg serving one synthetic camera to a single HTTP client"""
+    cmd = [
+        "ffmpeg", "-hide_banner", "-loglevel", "error",
+        "-re", "-f", "lavfi", "-i", f"testsrc2=size={width}x{height}:rate={fps}",
+    ]
+    if kind == "mjpeg":
+        cmd += ["-c:v", "mjpeg", "-q:v", "5", "-f", "mpjpeg"]
+    else:
+        cmd += ["-c:v", "libx264", "-preset", "ultrafast", "-tune", "zerolatency",
+                "-g", str(fps * 2), "-f", "mpegts"]
+    return cmd + ["-listen", "1", f"http://127.0.0.1:{port}/{kind}"]
+
+class SourceFarm:
+    """Keeps one synthetic source per camera listening.
+
+    ``-listen 1`` serves a single connection, so a source is relaunched
+    whenever it exits (e.g. after the recorder reconnects).
+    """
+
+    def __init__(self, count, kind, width, height, fps):
+        self.sources = [(kind, SOURCE_BASE_PORT + i) for i in range(count)]
+        self.width, self.height, self.fps = width, height, fps
+        self.processes = {}
+        self.stopping = threading.Event()
+
+    def cameras(self):
+        """Bench cameras for config.json"""
+        return [{
+            "name": f"bench {i}",
+            "guid": f"bench_{i:03d}",
+            "url": f"http://127.0.0.1:{port}/{kind}",
+            "username": "",
+            "password": "",
+            # Set explicitly: an ffprobe would use up the single connection
+            "codec_mode": "transcode" if kind == "mjpeg" else "copy",
+        } for i, (kind, port) in enumerate(self.sources)]
+
+    def _spawn(self, kind, port):
+        self.processes[port] = subprocess.Popen(
+            source_command(kind, port, self.width, self.height, self.fps),
+            stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL)
+
+    def start(self):
+        for kind, port in self.sources:
+            self._spawn(kind, port)
+        threading.Thread(target=self._loop, name="sources", daemon=True).start()
+
+    def _loop(self):
+        while not self.stopping.wait(0.5):
+            for kind, port in self.sources:
+                if self.processes[port].poll() is not None:
+                    self._spawn(kind, port)
+
+    def stop(self):
+        self.stopping.set()
+        for process in self.processes.values():
+            process.terminate()
+        for process in self.processes.values():
+            try:
+                process.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+class Viewer(threading.Thread):
+    """Closed-loop client: pick an action, time it, pause, repeat"""
+
+    def __init__(self, index, base_url, dash_root, guids, think, seed, results, stop):
+        super().__init__(name=f"viewer-{index}", daemon=True)
+        self.base_url = base_url
+        self.dash_root = dash_root
+        self.guids = guids
+        self.think = think
+        self.random = random.Random(seed + index)
+        self.results = results
+        self.stop = stop
+
+    def run(self):
+        actions, weights = zip(*VIEWER_MIX.items())
+        while not self.stop.is_set():
+            action = self.random.choices(actions, weights)[0]
+            guid = self.random.choice(self.guids)
+            url = getattr(self, f"{action}_url")(guid)
+            if url:
+                self.results.append(self.fetch(action, url))
+            self.stop.wait(self.think)
+
+    def index_url(self, guid):
+        return "/"
+
+    def download_mp4_url(self, guid):
+        return f"/download_mp4/{datetime.now():%Y-%m-%d}/{guid}"
+
+    def segment_url(self, guid):
+        """The manifest or one of the newest chunks of the camera's current shard"""
+        date = f"{datetime.now():%Y-%m-%d}"
+        shards = list_shards(self.dash_root / date / guid)
+        if not shards:
+            return None
+        shard = shards[-1]
+        prefix = f"/dashvideos/{date}/{guid}/" + (f"{shard['id']}/" if shard["id"] else "")
+        if self.random.random() < 0.1:
+            return prefix + "manifest.mpd"
+        chunks = sorted(n for n in os.listdir(shard["dir"]) if re.fullmatch(r"chunk-\d+\.m4s", n))
+        if len(chunks) < 2:
+            return prefix + "manifest.mpd"
+        # The newest chunk may still be written; viewers read closed ones
+        return prefix + self.random.choice(chunks[-4:-1])
+
+    def fetch(self, action, path):
+        started = time.perf_counter()
+        size, ok = 0, False
+        try:
+            with urllib.request.urlopen(self.base_url + path, timeout=60) as response:
+                while True:
+                    block = response.read(65536)
+                    if not block:
+                        break
+                    size += len(block)
+            ok = True
+        except Exception:
+            pass
+        return {"action": action, "seconds": time.perf_counter() - started, "bytes": size, "ok": ok}
+
+def read_status(path):
+    try:
+        with open(path) as f:
+            return json.load(f).get("processes", {})
+    except (OSError, ValueError):
+        return {}
+
+def process_cpu_seconds(pid):
+    try:
+        times = psutil.Process(pid).cpu_times()
+        return times.user + times.system
+    except psutil.Error:
+        return None
+
+def tree_cpu_seconds(pid):
+    """CPU seconds of a process and everything it started.
+
+    Exited children the process has waited for are in its children_* times;
+    running ones (the ffmpeg recorders, probes, exports) are added one by one.
+    """
+    try:
+        process = psutil.Process(pid)
+        times = process.cpu_times()
+        total = times.user + times.system + times.children_user + times.children_system
+        descendants = process.children(recursive=True)
+    except psutil.Error:
+        return None
+    for child in descendants:
+        try:
+            times = child.cpu_times()
+        except psutil.Error:
+            # Exited since the listing; its time shows up in its parent's children_*
+            continue
+        total += times.user + times.system
+    return total
+
+class Sampler(threading.Thread):
+    """Samples recorder CPU, segment health and disk writes once per second"""
+
+    def __init__(self, stop, status_file, services):
+        super().__init__(name="sampler", daemon=True)
+        self.stop = stop
+        self.status_file = status_file
+        self.cpu = {}
+        # Recorder (supervision, listeners, ffmpeg ingest) and server (requests,
+        # export ffmpeg), each with its child processes
+        self.services = {name: (pid, tree_cpu_seconds(pid)) for name, pid in services.items()}
+        self.segment_ages = []
+        self.segment_intervals = []
+        self.dropped = {}
+        self.disk_start = psutil.disk_io_counters()
+        self.started = time.time()
+
+    def run(self):
+        while not self.stop.wait(1):
+            for process in read_status(self.status_file).values():
+                if process.get("state") != "running" or not process.get("pid"):
+                    continue
+                cpu = process_cpu_seconds(process["pid"])
+                if cpu is not None:
+                    first = self.cpu.setdefault(process["pid"], [cpu, cpu, len(process["cameras"])])
+                    first[1] = cpu
+                if process.get("last_segment_age") is not None:
+                    self.segment_ages.append(process["last_segment_age"])
+                if process.get("last_segment_interval"):
+                    self.segment_intervals.append(process["last_segment_interval"])
+                for camera in process["cameras"]:
+                    self.dropped[camera] = process.get("drop_frames") or 0
+
+    def summary(self, camera_count):
+        elapsed = time.time() - self.started
+        ingest_seconds = sum(last - first for first, last, _ in self.cpu.values())
+        disk = psutil.disk_io_counters()
+        services = {}
+        for name, (pid, first) in self.services.items():
+            last = tree_cpu_seconds(pid)
+            if first is not None and last is not None:
+                services[name] = (last - first) / elapsed
+        recorder = services.get("recorder")
+        summary = {
+            # Share of one core used by the recorder and its children, per camera
+            "cpu_per_camera": round(recorder / camera_count, 4) if recorder is not None else None,
+            # The same for the ffmpeg ingest processes alone
+            "ingest_cpu_per_camera": round(ingest_seconds / elapsed / camera_count, 4),
+            "segment_interval_p50": percentile(self.segment_intervals, 0.5),
+            "segment_interval_p99": percentile(self.segment_intervals, 0.99),
+            "segment_age_p50": percentile(self.segment_ages, 0.5),
+            "segment_age_p99": percentile(self.segment_ages, 0.99),
+            "dropped_frames": sum(self.dropped.values()),
+            "disk_write_mb_per_second": round((disk.write_bytes - self.disk_start.write_bytes) / elapsed / 1e6, 2),
+        }
+        for name, share in services.items():
+            summary[f"{name}_cpu"] = round(share, 4)
+        return summary
+
+def request_summary(results, elapsed):
+    summary = {"requests_per_second": round(len(results) / elapsed, 2),
+               "request_errors": sum(not r["ok"] for r in results)}
+    ok = [r for r in results if r["ok"]]
+    summary["request_p50"] = percentile([r["seconds"] for r in ok], 0.5)
+    summary["request_p99"] = percentile([r["seconds"] for r in ok], 0.99)
+    summary["served_mb_per_second"] = round(sum(r["bytes"] for r in ok) / elapsed / 1e6, 2)
+    for action in VIEWER_MIX:
+        seconds = [r["seconds"] for r in ok if r["action"] == action]
+        summary[f"{action}_p50"] = percentile(seconds, 0.5)
+        summary[f"{action}_p99"] = percentile(seconds, 0.99)
+    return summary
+
+def compare(report, baseline, tolerance):
+    """Metrics that got worse than the baseline by more than ``tolerance`` (a share)"""
+    regressions = []
+    for key, higher_is_worse in COMPARED.items():
+        new, old = report.get(key), baseline.get(key)
+        if new is None or old is None:
+            continue
+        if higher_is_worse:
+            worse = new > old * (1 + tolerance) and new - old > 1e-3
+        else:
+            worse = new < old * (1 - tolerance)
+        if worse:
+            regressions.append(f"{key}: {old} -> {new}")
+    return regressions
+
+def wait_for_server(base_url, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            urllib.request.urlopen(base_url + "/metrics", timeout=2).close()
+            return True
+        except Exception:
+            time.sleep(0.5)
+    return False
+
+def stop_child(process):
+    process.terminate()
+    try:
+        process.wait(timeout=10)
+    except subprocess.TimeoutExpired:
+        process.kill()
+
+def run(args):
+    farm = SourceFarm(args.cameras, args.source, args.width, args.height, args.fps)
+    cameras = farm.cameras()
+    guids = {c["guid"] for c in cameras}
+    package = Path(__file__).resolve().parent
+    work = Path(args.work).resolve() if args.work else Path(tempfile.mkdtemp(prefix="vms-bench-"))
+    work.mkdir(parents=True, exist_ok=True)
+    with open(work / BENCH_CONFIG, "w") as f:
+        json.dump({"cameras": cameras}, f, indent=4)
+    env = dict(os.environ, VMS_CONFIG=str(work / BENCH_CONFIG), VMS_PORT=str(SERVER_PORT),
+               VMS_LOG_LEVEL="WARNING", VMS_DASH_ROOT=str(work / DASH_DIR), VMS_LIVE_ROOT=str(work / LIVE_DIR))
+    base_url = f"http://127.0.0.1:{SERVER_PORT}"
+
+    farm.start()
+    time.sleep(1)
+    recorder = subprocess.Popen([sys.executable, str(package / "start_dash_streams.py")], env=env, cwd=work)
+    server = subprocess.Popen([sys.executable, str(package / "serve.py")], env=env, cwd=work)
+    stop = threading.Event()
+    try:
+        if not wait_for_server(base_url):
+            raise RuntimeError("web server did not start")
+        print(f"Warming up {args.cameras} {args.source} cameras for {args.warmup}s")
+        time.sleep(args.warmup)
+
+        sampler = Sampler(stop, work / STATUS_FILE, {"recorder": recorder.pid, "server": server.pid})
+        results = []
+        viewers = [Viewer(i, base_url, work / DASH_DIR, sorted(guids), args.think, args.seed, results, stop)
+                   for i in range(args.viewers)]
+        print(f"Measuring with {args.viewers} viewers for {args.duration}s")
+        started = time.time()
+        sampler.start()
+        for viewer in viewers:
+            viewer.start()
+        time.sleep(args.duration)
+        stop.set()
+        elapsed = time.time() - started
+        for viewer in viewers:
+            viewer.join(timeout=60)
+    finally:
+        stop.set()
+        stop_child(server)
+        stop_child(recorder)
+        farm.stop()
+        if args.keep:
+            print(f"Bench data kept in {work}")
+        else:
+            shutil.rmtree(work, ignore_errors=True)
+
+    report = {"cameras": args.cameras, "source": args.source, "viewers": args.viewers,
+              "duration": args.duration, "seed": args.seed}
+    report.update(sampler.summary(args.cameras))
+    report.update(request_summary(results, elapsed))
+    return report
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--cameras", type=int, default=4)
+    parser.add_argument("--source", choices=("mjpeg", "h264"), default="mjpeg",
+                        help="mjpeg exercises transcoding, h264 (MPEG-TS, like RTSP) copy mode")
+    parser.add_argument("--width", type=int, default=1280)
+    parser.add_argument("--height", type=int, default=720)
+    parser.add_argument("--fps", type=int, default=15)
+    parser.add_argument("--viewers", type=int, default=10)
+    parser.add_argument("--think", type=float, default=0.5, help="seconds between a viewer's requests")
+    parser.add_argument("--duration", type=int, default=60, help="measured seconds")
+    parser.add_argument("--warmup", type=int, default=WARMUP)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", help="write the report to this file")
+    parser.add_argument("--compare", help="fail if worse than this saved report")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed regression share")
+    parser.add_argument("--work", help="scratch folder for the recorder and server (default: a temporary one)")
+    parser.add_argument("--keep", action="store_true", help="keep the work folder and its recordings")
+    args = parser.parse_args()
+
+    report = run(args)
+    for key, value in report.items():
+        print(f"{key:28} {value}")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=4)
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(report, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
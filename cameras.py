@@ -0,0 +1,129 @@
+"""Camera list changes made through the API: validation and bulk upserts of config["cameras"]"""
+import re
+import uuid
+
+from ingest import CODEC_MODES, DEFAULT_CODEC_MODE
+
+# Camera fields accepted by the bulk API (besides guid)
+CAMERA_FIELDS = ('name', 'url', 'username', 'password', 'codec_mode', 'profile', 'retention')
+MAX_CAMERA_BATCH = 1000
+
+# Fields that must hold strings; the recorder builds source URLs from them
+STRING_FIELDS = ('name', 'url', 'username', 'password')
+
+# Keys of a camera's "retention" object (see RetentionService)
+RETENTION_FIELDS = ('max_days', 'max_gb')
+
+# GUIDs become folder names, so only these characters are allowed
+GUID_RE = re.compile(r'^[A-Za-z0-9_-]{1,64}$')
+
+class CameraBatchError(ValueError):
+    """A bulk camera request that is rejected as a whole"""
+
+    def __init__(self, errors):
+        super().__init__(f"{len(errors)} invalid entries")
+        self.errors = errors
+
+def public_camera(camera):
+    """A camera as returned by the API; the password never leaves the server"""
+    result = {k: v for k, v in camera.items() if k != 'password'}
+    result['has_password'] = bool(camera.get('password'))
+    return result
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+def retention_errors(retention):
+    """Problems with a camera's retention policy (null clears it)"""
+    if retention is None:
+        return []
+    if not isinstance(retention, dict):
+        return ["retention must be an object"]
+    errors = [f"unknown retention field '{k}'" for k in retention if k not in RETENTION_FIELDS]
+    for key in RETENTION_FIELDS:
+        value = retention.get(key)
+        if value is not None and not (_is_number(value) and value > 0):
+            errors.append(f"retention.{key} must be a positive number")
+    return errors
+
+def camera_entry_errors(entry, profiles, is_new):
+    """Problems with one upsert entry (empty if it is valid)"""
+    errors = [f"unknown field '{k}'" for k in entry if k != 'guid' and k not in CAMERA_FIELDS]
+    if is_new:
+        errors += [f"'{k}' is required" for k in ('name', 'url') if not entry.get(k)]
+    if 'guid' in entry and not GUID_RE.match(str(entry['guid'])):
+        errors.append("guid may only contain letters, digits, '_' and '-'")
+    errors += [f"{k} must be a string" for k in STRING_FIELDS if k in entry and not isinstance(entry[k], str)]
+    if 'profile' in entry and entry['profile'] is not None and not isinstance(entry['profile'], str):
+        errors.append("profile must be a string")
+    elif entry.get('profile') and entry['profile'] not in profiles:
+        errors.append(f"unknown profile '{entry['profile']}'")
+    if 'codec_mode' in entry and entry['codec_mode'] not in CODEC_MODES:
+        errors.append(f"codec_mode must be one of {', '.join(CODEC_MODES)}")
+    if 'retention' in entry:
+        errors += retention_errors(entry['retention'])
+    return errors
+
+def drop_empty_options(camera):
+    """An empty profile or retention means the defaults: leave the key out"""
+    for key in ('profile', 'retention'):
+        if not camera.get(key):
+            camera.pop(key, None)
+
+def apply_camera_batch(config, upsert, delete):
+    """Apply a bulk change to ``config`` in place and summarise it.
+
+    Entries with the guid of an existing camera update only the fields they
+    name; other entries add a camera (with a generated guid if none is
+    given). Any invalid entry rejects the whole batch with CameraBatchError,
+    so nothing is saved.
+    """
+    by_guid = {c['guid']: c for c in config['cameras']}
+    profiles = config.get('profiles', {})
+    delete = set(delete)
+    summary = {'created': [], 'updated': [], 'unchanged': [], 'deleted': [], 'missing': []}
+    errors = []
+    seen = set()
+    for index, entry in enumerate(upsert):
+        if not isinstance(entry, dict):
+            errors.append({'index': index, 'errors': ["must be an object"]})
+            continue
+        guid = entry.get('guid')
+        if guid is not None and not isinstance(guid, str):
+            errors.append({'index': index, 'errors': ["guid must be a string"]})
+            continue
+        existing = by_guid.get(guid)
+        problems = camera_entry_errors(entry, profiles, existing is None)
+        if guid in seen:
+            problems.append("guid appears more than once in the batch")
+        if guid in delete:
+            problems.append("guid is both updated and deleted")
+        if problems:
+            errors.append({'index': index, 'errors': problems})
+            continue
+        if guid:
+            seen.add(guid)
+        fields = {k: v for k, v in entry.items() if k in CAMERA_FIELDS}
+        if existing is None:
+            camera = {'guid': guid or f"cam_{str(uuid.uuid4())[:8]}", 'username': '', 'password': '',
+                      'codec_mode': DEFAULT_CODEC_MODE}
+            camera.update(fields)
+            drop_empty_options(camera)
+            config['cameras'].append(camera)
+            by_guid[camera['guid']] = camera
+            summary['created'].append(camera['guid'])
+            continue
+        updated = dict(existing, **fields)
+        drop_empty_options(updated)
+        if updated == existing:
+            summary['unchanged'].append(guid)
+        else:
+            existing.clear()
+            existing.update(updated)
+            summary['updated'].append(guid)
+    if errors:
+        raise CameraBatchError(errors)
+    for guid in delete:
+        summary['deleted' if guid in by_guid else 'missing'].append(guid)
+    config['cameras'] = [c for c in config['cameras'] if c['guid'] not in delete]
+    return summary
@@ -0,0 +1,195 @@
+"""Persistent recordings index: one row per camera and day"""
+import os
+import re
+import sqlite3
+import time
+from pathlib import Path
+
+from clips import recorded_segments
+from integrity import OK, read_index
+
+CATALOG_DB = "recordings.db"
+
+CHUNK_RE = re.compile(r"chunk-(\d+)\.m4s$")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS recordings (
+    camera_guid TEXT NOT NULL,
+    date TEXT NOT NULL,
+    segment_count INTEGER NOT NULL DEFAULT 0,
+    first_segment_at REAL,
+    last_segment_at REAL,
+    bytes INTEGER NOT NULL DEFAULT 0,
+    updated_at REAL NOT NULL,
+    tier TEXT NOT NULL DEFAULT 'hot',
+    damaged INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (camera_guid, date)
+);
+CREATE INDEX IF NOT EXISTS recordings_by_date ON recordings (date DESC, camera_guid);
+"""
+
+class RecordingCatalog:
+    """SQLite-backed catalog of recorded days.
+
+    The recorder adds segments as they close; readers (the index page and
+    the JSON API) never touch the recordings folder.
+    """
+
+    def __init__(self, db_path=CATALOG_DB, root=None):
+        self.db_path = db_path
+        self.root = Path(root) if root else None
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(SCHEMA)
+            columns = {row["name"] for row in conn.execute("PRAGMA table_info(recordings)")}
+            if "tier" not in columns:
+                conn.execute("ALTER TABLE recordings ADD COLUMN tier TEXT NOT NULL DEFAULT 'hot'")
+            if "damaged" not in columns:
+                conn.execute("ALTER TABLE recordings ADD COLUMN damaged INTEGER NOT NULL DEFAULT 0")
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=10)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def add_segment(self, camera_guid, date, size, mtime, count=1):
+        """Add one closed segment to its camera/day row.
+
+        ``count`` is 0 for a segment whose footage another shard holds too:
+        its bytes are on disk but it adds no recording.
+        """
+        with self._connect() as conn:
+            conn.execute(
+                """
+                INSERT INTO recordings
+                    (camera_guid, date, segment_count, first_segment_at, last_segment_at, bytes, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (camera_guid, date) DO UPDATE SET
+                    segment_count = segment_count + excluded.segment_count,
+                    first_segment_at = MIN(COALESCE(first_segment_at, excluded.first_segment_at), excluded.first_segment_at),
+                    last_segment_at = MAX(COALESCE(last_segment_at, excluded.last_segment_at), excluded.last_segment_at),
+                    bytes = bytes + excluded.bytes,
+                    updated_at = excluded.updated_at
+                """,
+                (camera_guid, date, count, mtime, mtime, size, time.time()),
+            )
+
+    def add_damaged(self, camera_guid, date, count=1):
+        """Count segments the integrity verifier found damaged or missing"""
+        with self._connect() as conn:
+            conn.execute("UPDATE recordings SET damaged = damaged + ?, updated_at = ? WHERE camera_guid = ? AND date = ?",
+                         (count, time.time(), camera_guid, date))
+
+    def on_segment(self, path, overlap=False):
+        """Segment listener for the recorder: path is <root>/<date>/<guid>/.../chunk-N.m4s"""
+        relative = Path(path).relative_to(self.root)
+        date, camera_guid = relative.parts[0], relative.parts[1]
+        stat = os.stat(path)
+        self.add_segment(camera_guid, date, stat.st_size, stat.st_mtime, count=0 if overlap else 1)
+
+    def scan_day(self, camera_guid, date, day_dir):
+        """Replace a camera/day row's counts with a fresh count of its folder.
+
+        The row keeps its tier, so rescanning a day never moves it back to hot.
+
+        Chunks past the point where the next shard takes over are counted
+        in bytes only, like the recorder does for the rotation overlap.
+        """
+        last_kept = {shard["dir"]: segments[-1][0] for shard, segments in recorded_segments(day_dir)}
+        count, size, first, last = 0, 0, None, None
+        for dirpath, _, filenames in os.walk(day_dir):
+            for name in filenames:
+                match = CHUNK_RE.match(name)
+                if not match:
+                    continue
+                stat = os.stat(os.path.join(dirpath, name))
+                if int(match.group(1)) <= last_kept.get(Path(dirpath), float("inf")):
+                    count += 1
+                size += stat.st_size
+                first = stat.st_mtime if first is None else min(first, stat.st_mtime)
+                last = stat.st_mtime if last is None else max(last, stat.st_mtime)
+        damaged = sum(1 for r in read_index(day_dir) if r.status != OK)
+        with self._connect() as conn:
+            conn.execute(
+                """
+                INSERT INTO recordings
+                    (camera_guid, date, segment_count, first_segment_at, last_segment_at, bytes, updated_at, damaged)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (camera_guid, date) DO UPDATE SET
+                    segment_count = excluded.segment_count,
+                    first_segment_at = excluded.first_segment_at,
+                    last_segment_at = excluded.last_segment_at,
+                    bytes = excluded.bytes,
+                    updated_at = excluded.updated_at,
+                    damaged = excluded.damaged
+                """,
+                (camera_guid, date, count, first, last, size, time.time(), damaged),
+            )
+
+    def backfill(self, rescan_dates=()):
+        """Catalog camera/day folders that are not indexed yet.
+
+        Days in ``rescan_dates`` are always recounted; everything else that
+        is already in the catalog is skipped, so this is cheap after the
+        first run.
+        """
+        if not self.root or not self.root.exists():
+            return
+        with self._connect() as conn:
+            known = {(r["camera_guid"], r["date"]) for r in conn.execute(
+                "SELECT camera_guid, date FROM recordings")}
+        for date_dir in self.root.iterdir():
+            if not date_dir.is_dir():
+                continue
+            for camera_dir in date_dir.iterdir():
+                if not camera_dir.is_dir() or camera_dir.name.endswith('_snapshots'):
+                    continue
+                key = (camera_dir.name, date_dir.name)
+                if key not in known or date_dir.name in rescan_dates:
+                    self.scan_day(camera_dir.name, date_dir.name, camera_dir)
+
+    def list_recordings(self, page=1, per_page=50, camera_guid=None):
+        """One page of camera/day rows, newest day first"""
+        query = "SELECT * FROM recordings"
+        params = []
+        if camera_guid:
+            query += " WHERE camera_guid = ?"
+            params.append(camera_guid)
+        query += " ORDER BY date DESC, camera_guid LIMIT ? OFFSET ?"
+        params += [per_page, (page - 1) * per_page]
+        with self._connect() as conn:
+            return [dict(row) for row in conn.execute(query, params)]
+
+    def count_recordings(self, camera_guid=None):
+        """Total number of camera/day rows"""
+        query = "SELECT COUNT(*) FROM recordings"
+        params = []
+        if camera_guid:
+            query += " WHERE camera_guid = ?"
+            params.append(camera_guid)
+        with self._connect() as conn:
+            return conn.execute(query, params).fetchone()[0]
+
+    def list_days(self):
+        """Every camera/day row, oldest day first (used by retention)"""
+        with self._connect() as conn:
+            return [dict(row) for row in conn.execute(
+                "SELECT * FROM recordings ORDER BY date, camera_guid")]
+
+    def delete_day(self, camera_guid, date):
+        """Forget an evicted camera/day"""
+        with self._connect() as conn:
+            conn.execute("DELETE FROM recordings WHERE camera_guid = ? AND date = ?",
+                         (camera_guid, date))
+
+    def set_tier(self, camera_guid, date, tier):
+        """Record which storage root (hot/cold) holds a camera/day"""
+        with self._connect() as conn:
+            conn.execute("UPDATE recordings SET tier = ?, updated_at = ? WHERE camera_guid = ? AND date = ?",
+                         (tier, time.time(), camera_guid, date))
+
+    def set_bytes(self, camera_guid, date, size):
+        """Update a day's size after part of it was evicted"""
+        with self._connect() as conn:
+            conn.execute("UPDATE recordings SET bytes = ? WHERE camera_guid = ? AND date = ?",
+                         (size, camera_guid, date))
@@ -0,0 +1,177 @@
+"""Map wall-clock ranges to recorded chunks for time-range clip exports"""
+import os
+import subprocess
+from pathlib import Path
+
+from fmp4 import read_prft
+from integrity import MISSING, OK, read_index, shard_segments
+from mpd import availability_start, read_segment_timeline, read_timescale
+from shards import list_shards
+from supervisor import ROTATION_LEAD
+
+def chunk_path(source_dir, number):
+    return Path(source_dir) / f"chunk-{number:05d}.m4s"
+
+def wall_clock_anchor(source_dir, manifest_text, segments, shard_start=None):
+    """Return the Unix time at media time 0 of a recorded shard.
+
+    Prefers the producer reference time (prft) ffmpeg embeds with -write_prft,
+    then the manifest's availabilityStartTime, then the shard's start time
+    from the day index, and finally the first chunk's modification time
+    (written when the chunk closed).
+    """
+    timescale = read_timescale(manifest_text)
+    for number, _, _ in segments[:3]:
+        path = chunk_path(source_dir, number)
+        if path.exists():
+            prft = read_prft(path)
+            if prft:
+                unix_time, media_time = prft
+                return unix_time - media_time / timescale
+    start = availability_start(manifest_text)
+    if start:
+        return start
+    if shard_start:
+        return shard_start
+    number, seg_start, duration = segments[0]
+    return os.stat(chunk_path(source_dir, number)).st_mtime - (seg_start + duration)
+
+def shard_anchor(shard):
+    """Unix time at media time 0 of a shard from list_shards, or None if it has no segments"""
+    manifest_text = (shard["dir"] / "manifest.mpd").read_text()
+    segments = read_segment_timeline(manifest_text)
+    if not segments:
+        return None
+    return wall_clock_anchor(shard["dir"], manifest_text, segments, shard["start"])
+
+def locate(day_dir, timestamp):
+    """(shard id, seconds into the shard) at which ``timestamp`` was recorded, or None"""
+    for shard in reversed(list_shards(day_dir)):
+        if shard["start"] and shard["start"] > timestamp:
+            continue
+        anchor = shard_anchor(shard)
+        if anchor is not None and anchor <= timestamp:
+            return shard["id"], timestamp - anchor
+    return None
+
+def _manifest_segments(shard):
+    """[(number, wall start, duration)] of every segment a shard's manifest lists"""
+    manifest_text = (shard["dir"] / "manifest.mpd").read_text()
+    segments = read_segment_timeline(manifest_text)
+    if not segments:
+        return []
+    anchor = wall_clock_anchor(shard["dir"], manifest_text, segments, shard["start"])
+    return [(number, anchor + seg_start, duration) for number, seg_start, duration in segments]
+
+def recorded_segments(day_dir, start_time=None, end_time=None):
+    """List (shard, [(number, wall start, duration)]) of a camera/day in order.
+
+    At every rotation the next shard's recorder starts ROTATION_LEAD seconds
+    early and the old one keeps going until its successor has written a
+    chunk, so consecutive shards overlap. Each shard is cut where the next
+    one's first segment begins, so no footage is listed twice.
+
+    Verified days are answered from the integrity index alone, leaving out
+    damaged segments. Otherwise the shard manifests are read, keeping the
+    segments whose chunk exists. With a range, only the shards that can
+    overlap it are read.
+    """
+    shard_list = list_shards(day_dir)
+    indexed = shard_segments(read_index(day_dir), shard_list)
+    timelines = {}
+
+    def timeline(i):
+        if i not in timelines:
+            if indexed is not None:
+                # A missing segment's start is only a guess
+                timelines[i] = [(r.number, r.start, r.duration) for r in indexed[i][1] if r.status != MISSING]
+            else:
+                timelines[i] = _manifest_segments(shard_list[i])
+        return timelines[i]
+
+    result = []
+    for i, shard in enumerate(shard_list):
+        next_start = shard_list[i + 1]["start"] if i + 1 < len(shard_list) else None
+        if start_time is not None and next_start and next_start <= start_time:
+            continue
+        if end_time is not None and shard["start"] and shard["start"] - ROTATION_LEAD >= end_time:
+            break
+        segments = timeline(i)
+        following = timeline(i + 1) if next_start is not None else []
+        if following:
+            segments = [s for s in segments if s[1] < following[0][1]]
+        if start_time is not None:
+            segments = [s for s in segments if s[1] + s[2] > start_time and s[1] < end_time]
+        if indexed is not None:
+            good = {r.number for r in indexed[i][1] if r.status == OK}
+            segments = [s for s in segments if s[0] in good]
+        else:
+            segments = [s for s in segments if chunk_path(shard["dir"], s[0]).exists()]
+        if segments:
+            result.append((shard, segments))
+    return result
+
+def find_clip_segments(day_dir, start_time, end_time):
+    """List (shard_dir, [chunk paths]) covering [start_time, end_time] (Unix seconds).
+
+    See recorded_segments; only the manifests of shards overlapping the
+    range and at most a few segment headers are read, never the chunks.
+    """
+    return [(shard["dir"], [chunk_path(shard["dir"], number) for number, _, _ in segments])
+            for shard, segments in recorded_segments(day_dir, start_time, end_time)]
+
+def stream_clip(init_path, chunk_paths, block_size=1024 * 1024):
+    """Yield init.m4s followed by the chunks: a playable fragmented MP4"""
+    for path in [init_path, *chunk_paths]:
+        with open(path, "rb") as f:
+            while True:
+                block = f.read(block_size)
+                if not block:
+                    break
+                yield block
+
+def write_piece_list(list_path, groups):
+    """Write an ffconcat list with one ``concat:init|chunk|...`` piece per shard"""
+    with open(list_path, "w") as f:
+        f.write("ffconcat version 1.0\n")
+        for shard_dir, chunks in groups:
+            piece = "concat:" + "|".join(p.resolve().as_posix() for p in [shard_dir / "init.m4s", *chunks])
+            escaped = piece.replace("'", "'\\''")
+            f.write(f"file '{escaped}'\n")
+
+def stream_multi_shard_clip(groups, list_path, block_size=1024 * 1024):
+    """Join chunks from several shards with ffmpeg and yield a fragmented MP4.
+
+    Each shard restarts its timestamps and has its own init segment, so the
+    pieces cannot simply be concatenated; ffmpeg's concat demuxer rebases the
+    timestamps while stream-copying. Only the selected chunks are read.
+    """
+    write_piece_list(list_path, groups)
+    cmd = [
+        "ffmpeg",
+        "-hide_banner",
+        "-loglevel", "error",
+        "-protocol_whitelist", "file,concat,pipe",
+        "-f", "concat",
+        "-safe", "0",
+        "-i", str(list_path),
+        "-c", "copy",
+        "-movflags", "frag_keyframe+empty_moov+default_base_moof",
+        "-f", "mp4",
+        "pipe:1",
+    ]
+    process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stdin=subprocess.DEVNULL)
+    try:
+        while True:
+            block = process.stdout.read(block_size)
+            if not block:
+                break
+            yield block
+    finally:
+        if process.poll() is None:
+            process.kill()
+        process.wait()
+        try:
+            os.unlink(list_path)
+        except OSError:
+            pass
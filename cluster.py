@@ -0,0 +1,356 @@
+"""Recorder-node mode: several machines share the cameras of one config.json.
+
+Every node runs start_dash_streams.py (and serve.py) with its own recording
+disk and these environment variables:
+
+    VMS_CLUSTER_DB  shared SQLite file (nodes, camera leases, shard catalog)
+    VMS_NODE_ID     unique node name
+    VMS_NODE_URL    base URL of the node's web server, e.g. http://10.0.0.5:5000
+    VMS_DASH_ROOT   the node's recordings folder (see ingest.py)
+    VMS_LIVE_ROOT   the node's live view and thumbnail folder
+
+Cameras are assigned by consistent hashing of their guid over the nodes
+with a fresh heartbeat; a node records a camera only while it holds its
+lease. When a node dies its heartbeat and leases expire and the next node
+on the ring takes the camera over; when a node joins, the cameras that hash
+to it are released by their old node and picked up on the next sync.
+
+Each node reports its shards to the shared catalog; a front-end (serve.py
+with VMS_CLUSTER_DB but no VMS_NODE_ID) lists recordings from it and
+redirects playback, exports and live requests to the node holding the data.
+
+    python cluster.py local --nodes 3
+
+runs a front-end and three nodes as local processes for testing.
+
+The shared database uses SQLite's rollback journal, not WAL: WAL needs
+shared memory, which only works between processes of one host. Across
+machines the file must sit on a network filesystem whose byte-range locks
+work (NFSv4 with lockd, or SMB with oplocks disabled for the file); SQLite
+on a share with broken locking can corrupt the database. If no such share
+is available, keep every node on one host.
+"""
+import bisect
+import hashlib
+import os
+import sqlite3
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+CLUSTER_DB = os.environ.get("VMS_CLUSTER_DB")
+NODE_ID = os.environ.get("VMS_NODE_ID")
+NODE_URL = os.environ.get("VMS_NODE_URL")
+
+# A lease is renewed on every sync (every few seconds); a node that stops
+# renewing loses its cameras after this long
+LEASE_SECONDS = 60
+
+# A node stops recording a camera whose last renewed lease has less than
+# this left, so a failed renewal never overlaps with the next owner
+LEASE_MARGIN = 15
+
+# Nodes without a heartbeat for this long drop out of the hash ring
+NODE_TTL = LEASE_SECONDS
+
+# Points per node on the hash ring; more points spread cameras more evenly
+VNODES = 64
+
+# Seconds between checks that this node's catalogued shards still exist
+PRUNE_INTERVAL = 600
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS nodes (
+    node_id TEXT PRIMARY KEY,
+    url TEXT NOT NULL,
+    heartbeat_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS leases (
+    camera_guid TEXT PRIMARY KEY,
+    node_id TEXT NOT NULL,
+    expires_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS shards (
+    camera_guid TEXT NOT NULL,
+    date TEXT NOT NULL,
+    shard TEXT NOT NULL,
+    node_id TEXT NOT NULL,
+    segment_count INTEGER NOT NULL DEFAULT 0,
+    first_segment_at REAL,
+    last_segment_at REAL,
+    bytes INTEGER NOT NULL DEFAULT 0,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (camera_guid, date, shard, node_id)
+);
+CREATE INDEX IF NOT EXISTS shards_by_date ON shards (date DESC, camera_guid);
+"""
+
+def _hash(key):
+    return int.from_bytes(hashlib.md5(key.encode()).digest()[:8], "big")
+
+class HashRing:
+    """Consistent hash ring: adding or removing a node only moves its share of keys"""
+
+    def __init__(self, nodes, vnodes=VNODES):
+        points = sorted((_hash(f"{node}#{i}"), node) for node in nodes for i in range(vnodes))
+        self.hashes = [h for h, _ in points]
+        self.nodes = [n for _, n in points]
+
+    def owner(self, key):
+        if not self.nodes:
+            return None
+        index = bisect.bisect(self.hashes, _hash(key)) % len(self.hashes)
+        return self.nodes[index]
+
+class ClusterCatalog:
+    """Read side of the shared database: recordings listing and data location"""
+
+    def __init__(self, db_path=CLUSTER_DB):
+        self.db_path = db_path
+        with self._connect() as conn:
+            # Also turns a database created in WAL mode back to the rollback journal
+            conn.execute("PRAGMA journal_mode=DELETE")
+            conn.executescript(SCHEMA)
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=10)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def live_nodes(self, now=None):
+        """{node_id: url} of nodes with a fresh heartbeat"""
+        now = now or time.time()
+        with self._connect() as conn:
+            return {row["node_id"]: row["url"] for row in conn.execute(
+                "SELECT node_id, url FROM nodes WHERE heartbeat_at > ?", (now - NODE_TTL,))}
+
+    def node_url(self, node_id):
+        with self._connect() as conn:
+            row = conn.execute("SELECT url FROM nodes WHERE node_id = ?", (node_id,)).fetchone()
+        return row["url"] if row else None
+
+    def locate(self, camera_guid, date, shard=None, at=None):
+        """Node id holding a camera/day's data; None if unknown.
+
+        With ``shard`` the node holding that shard, with ``at`` (Unix time)
+        the one that was recording then, otherwise the latest shard's node.
+        """
+        query = "SELECT node_id FROM shards WHERE camera_guid = ? AND date = ?"
+        params = [camera_guid, date]
+        if shard:
+            query += " AND shard = ?"
+            params.append(shard)
+        if at is not None:
+            query += " AND first_segment_at <= ?"
+            params.append(at)
+            query += " ORDER BY first_segment_at DESC LIMIT 1"
+        else:
+            query += " ORDER BY shard DESC, last_segment_at DESC LIMIT 1"
+        with self._connect() as conn:
+            row = conn.execute(query, params).fetchone()
+        return row["node_id"] if row else None
+
+    def lease_holder(self, camera_guid, now=None):
+        """Node currently recording a camera, or None"""
+        now = now or time.time()
+        with self._connect() as conn:
+            row = conn.execute("SELECT node_id FROM leases WHERE camera_guid = ? AND expires_at > ?",
+                               (camera_guid, now)).fetchone()
+        return row["node_id"] if row else None
+
+    def list_recordings(self, page=1, per_page=50, camera_guid=None):
+        """One page of camera/day rows across all nodes, like RecordingCatalog's"""
+        query = """
+            SELECT camera_guid, date, SUM(segment_count) AS segment_count,
+                   MIN(first_segment_at) AS first_segment_at, MAX(last_segment_at) AS last_segment_at,
+                   SUM(bytes) AS bytes, MAX(updated_at) AS updated_at, 'hot' AS tier,
+                   GROUP_CONCAT(DISTINCT node_id) AS nodes
+            FROM shards
+        """
+        params = []
+        if camera_guid:
+            query += " WHERE camera_guid = ?"
+            params.append(camera_guid)
+        query += " GROUP BY camera_guid, date ORDER BY date DESC, camera_guid LIMIT ? OFFSET ?"
+        params += [per_page, (page - 1) * per_page]
+        with self._connect() as conn:
+            return [dict(row) for row in conn.execute(query, params)]
+
+    def count_recordings(self, camera_guid=None):
+        query = "SELECT COUNT(*) FROM (SELECT 1 FROM shards"
+        params = []
+        if camera_guid:
+            query += " WHERE camera_guid = ?"
+            params.append(camera_guid)
+        query += " GROUP BY camera_guid, date)"
+        with self._connect() as conn:
+            return conn.execute(query, params).fetchone()[0]
+
+class ClusterNode(ClusterCatalog):
+    """Write side for one recorder node: heartbeat, leases and shard reports"""
+
+    def __init__(self, db_path, node_id, url, root):
+        super().__init__(db_path)
+        self.node_id = node_id
+        self.url = url
+        self.root = Path(root)
+        self.last_prune = 0
+        # camera guid -> expiry of the lease this node last renewed
+        self.leases = {}
+
+    def heartbeat(self, now):
+        with self._connect() as conn:
+            conn.execute(
+                """
+                INSERT INTO nodes (node_id, url, heartbeat_at) VALUES (?, ?, ?)
+                ON CONFLICT (node_id) DO UPDATE SET url = excluded.url, heartbeat_at = excluded.heartbeat_at
+                """,
+                (self.node_id, self.url, now),
+            )
+
+    def claim(self, cameras, now=None):
+        """The cameras this node should record now.
+
+        Renews the heartbeat, takes (or renews) the lease of every camera the
+        ring assigns here unless another node still holds it, and releases
+        leases of cameras that now hash elsewhere so their new owner can
+        start them.
+        """
+        now = now or time.time()
+        self.heartbeat(now)
+        ring = HashRing(self.live_nodes(now))
+        owned = []
+        with self._connect() as conn:
+            for camera in cameras:
+                guid = camera["guid"]
+                if ring.owner(guid) == self.node_id:
+                    claimed = conn.execute(
+                        """
+                        INSERT INTO leases (camera_guid, node_id, expires_at) VALUES (?, ?, ?)
+                        ON CONFLICT (camera_guid) DO UPDATE SET
+                            node_id = excluded.node_id, expires_at = excluded.expires_at
+                        WHERE leases.node_id = excluded.node_id OR leases.expires_at < ?
+                        """,
+                        (guid, self.node_id, now + LEASE_SECONDS, now),
+                    ).rowcount
+                    if claimed:
+                        owned.append(camera)
+                else:
+                    conn.execute("DELETE FROM leases WHERE camera_guid = ? AND node_id = ?",
+                                 (guid, self.node_id))
+            # Cameras removed from the config
+            guids = [c["guid"] for c in cameras]
+            conn.execute(f"DELETE FROM leases WHERE node_id = ? AND camera_guid NOT IN "
+                         f"({','.join('?' * len(guids))})", [self.node_id] + guids)
+        # Committed: these are the leases this node holds now
+        self.leases = {camera["guid"]: now + LEASE_SECONDS for camera in owned}
+        return owned
+
+    def held(self, cameras, now=None):
+        """The cameras whose lease, as last renewed, still has LEASE_MARGIN left.
+
+        Used when claim() fails: the other cameras may pass to another node
+        before this one can renew, so they must stop recording here.
+        """
+        now = now or time.time()
+        return [c for c in cameras if self.leases.get(c["guid"], 0) - now > LEASE_MARGIN]
+
+    def release_all(self):
+        """Give up every lease and leave the ring (clean shutdown)"""
+        self.leases = {}
+        with self._connect() as conn:
+            conn.execute("DELETE FROM leases WHERE node_id = ?", (self.node_id,))
+            conn.execute("DELETE FROM nodes WHERE node_id = ?", (self.node_id,))
+
+    def on_segment(self, path, overlap=False):
+        """Segment listener: path is <root>/<date>/<guid>/[<shard>/]chunk-N.m4s
+
+        Rotation overlap (see ChunkWatcher) adds bytes but not segments.
+        """
+        relative = Path(path).relative_to(self.root)
+        date, camera_guid = relative.parts[0], relative.parts[1]
+        shard = relative.parts[2] if len(relative.parts) > 3 else ""
+        stat = os.stat(path)
+        with self._connect() as conn:
+            conn.execute(
+                """
+                INSERT INTO shards
+                    (camera_guid, date, shard, node_id, segment_count, first_segment_at,
+                     last_segment_at, bytes, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (camera_guid, date, shard, node_id) DO UPDATE SET
+                    segment_count = segment_count + excluded.segment_count,
+                    last_segment_at = MAX(last_segment_at, excluded.last_segment_at),
+                    bytes = bytes + excluded.bytes,
+                    updated_at = excluded.updated_at
+                """,
+                (camera_guid, date, shard, self.node_id, 0 if overlap else 1, stat.st_mtime, stat.st_mtime,
+                 stat.st_size, time.time()),
+            )
+
+    def prune(self, roots, now=None):
+        """Forget this node's shards that retention removed from every storage root"""
+        now = now or time.time()
+        if now - self.last_prune < PRUNE_INTERVAL:
+            return
+        self.last_prune = now
+        with self._connect() as conn:
+            rows = conn.execute("SELECT camera_guid, date, shard FROM shards WHERE node_id = ?",
+                                (self.node_id,)).fetchall()
+            for row in rows:
+                relative = Path(row["date"]) / row["camera_guid"] / row["shard"]
+                if not any((Path(root) / relative).exists() for root in roots):
+                    conn.execute(
+                        "DELETE FROM shards WHERE camera_guid = ? AND date = ? AND shard = ? AND node_id = ?",
+                        (row["camera_guid"], row["date"], row["shard"], self.node_id))
+
+def run_local(count, base_port=5100, front_port=5000):
+    """Run a front-end and ``count`` recorder nodes as local processes.
+
+    Each node gets its own folder under cluster-local/ (its recordings, live
+    outputs, exports, catalog and status file); all share config.json and
+    the cluster database. Stop a node's processes to watch its cameras fail
+    over.
+    """
+    package = Path(__file__).resolve().parent
+    work = Path("cluster-local").resolve()
+    work.mkdir(exist_ok=True)
+    env = dict(os.environ,
+               VMS_CLUSTER_DB=str(work / "cluster.db"),
+               VMS_CONFIG=str(Path(os.environ.get("VMS_CONFIG", "config.json")).resolve()))
+    processes = []
+    front_env = dict(env, VMS_PORT=str(front_port), VMS_DASH_ROOT=str(work / "front" / "dashvideos"),
+                     VMS_LIVE_ROOT=str(work / "front" / "live"))
+    front_env.pop("VMS_NODE_ID", None)
+    processes.append(subprocess.Popen([sys.executable, str(package / "serve.py")], env=front_env, cwd=work))
+    for i in range(count):
+        node_id, port = f"node-{i + 1}", base_port + i
+        node_dir = work / node_id
+        node_dir.mkdir(exist_ok=True)
+        node_env = dict(env, VMS_NODE_ID=node_id, VMS_NODE_URL=f"http://127.0.0.1:{port}",
+                        VMS_PORT=str(port), VMS_DASH_ROOT=str(node_dir / "dashvideos"),
+                        VMS_LIVE_ROOT=str(node_dir / "live"))
+        recorder = subprocess.Popen([sys.executable, str(package / "start_dash_streams.py")],
+                                    env=node_env, cwd=node_dir)
+        server = subprocess.Popen([sys.executable, str(package / "serve.py")], env=node_env, cwd=node_dir)
+        processes += [recorder, server]
+        print(f"{node_id}: recorder pid {recorder.pid}, server http://127.0.0.1:{port} (pid {server.pid})")
+    print(f"Front-end: http://127.0.0.1:{front_port}")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.wait()
+
+if __name__ == "__main__":
+    if len(sys.argv) >= 2 and sys.argv[1] == "local":
+        nodes = int(sys.argv[sys.argv.index("--nodes") + 1]) if "--nodes" in sys.argv else 3
+        run_local(nodes)
+    else:
+        print("usage: python cluster.py local [--nodes N]")
@@ -0,0 +1,102 @@
+"""Cached camera configuration backed by config.json"""
+import copy
+import json
+import os
+import stat
+import tempfile
+import threading
+
+from locks import FileLock
+
+# VMS_CONFIG points the server and recorder at another file (e.g. bench.py's)
+CONFIG_FILE = os.environ.get("VMS_CONFIG", "config.json")
+
+class ConfigStore:
+    """Keeps config.json in memory and reloads it only when the file changes.
+
+    Change detection uses the file's mtime, inode and size, so a request costs
+    one stat() instead of an open and a JSON parse. Saves go to a temporary
+    file that is atomically renamed over config.json, so readers never see a
+    half-written file. Writers take an OS lock on config.json.lock as well
+    as the store's thread lock, so saves from the web server and the
+    recorder (or any other process) are ordered too.
+    """
+
+    def __init__(self, path=CONFIG_FILE):
+        self.path = path
+        self.lock = threading.RLock()
+        self.file_lock_path = f"{path}.lock"
+        self.signature = None
+        self.config = {"cameras": []}
+        self.cameras_by_guid = {}
+
+    def _signature(self):
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return (stat.st_mtime_ns, stat.st_ino, stat.st_size)
+
+    def _set(self, config, signature):
+        config.setdefault("cameras", [])
+        self.config = config
+        self.cameras_by_guid = {c["guid"]: c for c in config["cameras"]}
+        self.signature = signature
+
+    def load(self):
+        """Return the current configuration; treat it as read-only"""
+        signature = self._signature()
+        if signature == self.signature:
+            return self.config
+        with self.lock:
+            if signature != self.signature:
+                if signature is None:
+                    self._set({"cameras": []}, None)
+                else:
+                    with open(self.path, "r") as f:
+                        self._set(json.load(f), signature)
+            return self.config
+
+    def get_camera(self, guid):
+        """Look up a camera by GUID"""
+        self.load()
+        return self.cameras_by_guid.get(guid)
+
+    def _write(self, config):
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, tmp_path = tempfile.mkstemp(prefix=".config-", suffix=".json", dir=directory)
+        try:
+            # mkstemp creates the file as 0600; keep the mode config.json had
+            try:
+                mode = stat.S_IMODE(os.stat(self.path).st_mode)
+            except FileNotFoundError:
+                mode = 0o644
+            os.chmod(tmp_path, mode)
+            with os.fdopen(fd, "w") as f:
+                json.dump(config, f, indent=4)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        self._set(config, self._signature())
+
+    def save(self, config):
+        """Atomically replace config.json"""
+        with self.lock, FileLock(self.file_lock_path):
+            self._write(config)
+
+    def update(self, mutate):
+        """Apply ``mutate`` to a copy of the configuration and save it.
+
+        The read-modify-write happens under the store's thread lock and the
+        config file lock, so concurrent edits from request threads or other
+        processes cannot overwrite each other. Returns whatever ``mutate``
+        returns.
+        """
+        with self.lock, FileLock(self.file_lock_path):
+            config = copy.deepcopy(self.load())
+            result = mutate(config)
+            self._write(config)
+            return result
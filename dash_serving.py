@@ -0,0 +1,189 @@
+"""Cache- and Range-aware delivery of DASH manifests and segments"""
+import os
+import re
+import time
+
+from flask import Response, abort, send_file
+from werkzeug.security import safe_join
+
+from integrity import damaged_numbers
+from mpd import keep_lowest_video, mark_gaps, merge_renditions
+
+# Completed segments never change, so browsers and proxies may keep them
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+
+# A segment untouched for this long is complete even without a successor
+# (e.g. the last chunk of a recorder that has since stopped)
+FINISHED_AGE = 30
+
+# Optional zero-copy offload to a front-end proxy. Set VMS_SENDFILE_HEADER to
+# "X-Accel-Redirect" (nginx) or "X-Sendfile" (Apache/lighttpd); for nginx,
+# VMS_SENDFILE_PREFIX is the internal location mapped onto the recordings root.
+SENDFILE_HEADER = os.environ.get("VMS_SENDFILE_HEADER")
+SENDFILE_PREFIX = os.environ.get("VMS_SENDFILE_PREFIX", "/protected-dashvideos/")
+
+# nginx location mapped onto the cold storage root; without it, cold-tier
+# files are sent by the app even when X-Accel-Redirect is on
+COLD_SENDFILE_PREFIX = os.environ.get("VMS_SENDFILE_COLD_PREFIX")
+
+# Live segments are requested while ffmpeg is still writing them: wait this
+# long for a segment to appear, and stop following one that stops growing
+LIVE_SEGMENT_WAIT = 5
+LIVE_IDLE_TIMEOUT = 10
+LIVE_POLL_INTERVAL = 0.05
+
+# Lower ABR renditions are written below the manifest's folder
+RENDITIONS_DIR = "renditions"
+
+# chunk-00001.m4s, chunk-1-00001.m4s (renditions), chunk-stream0-00001.m4s
+CHUNK_RE = re.compile(r"^(.*chunk-(?:[^.]*-)?)(\d+)\.m4s$")
+
+MIMETYPES = {
+    ".mpd": "application/dash+xml",
+    ".m4s": "video/iso.segment",
+    ".mp4": "video/mp4",
+    ".jpg": "image/jpeg",
+    ".vtt": "text/vtt",
+}
+
+def is_finished_segment(path, stat):
+    """A chunk is finished once the recorder has moved on to the next one"""
+    match = CHUNK_RE.match(os.path.basename(path))
+    if not match:
+        # init.m4s and other media files are written once
+        return True
+    if time.time() - stat.st_mtime > FINISHED_AGE:
+        return True
+    prefix, number = match.groups()
+    successor = f"{prefix}{int(number) + 1:0{len(number)}d}.m4s"
+    return os.path.exists(os.path.join(os.path.dirname(path), successor))
+
+def cache_control_for(path, stat):
+    """Cache policy: immutable for finished segments, revalidate for manifests"""
+    if path.endswith((".mpd", ".vtt", ".jpg")):
+        # Manifests and thumbnail tracks grow every segment and a sprite
+        # sheet replaces its staged tiles; clients revalidate with the ETag
+        return "no-cache"
+    if path.endswith(".m4s") and not is_finished_segment(path, stat):
+        return "no-store"
+    return f"public, max-age={IMMUTABLE_MAX_AGE}, immutable"
+
+def send_manifest(path, lowest=False):
+    """Send a manifest with the ladder's lower renditions merged in, if it has any.
+
+    Segments the integrity index marks as damaged or missing are cut out
+    (see mpd.mark_gaps). Returns None for a manifest that needs none of
+    this (and no filtering asked for), so the caller can send the file
+    as-is. ``lowest`` keeps only the lowest video rendition, for grid views.
+    """
+    renditions_path = os.path.join(os.path.dirname(path), RENDITIONS_DIR, os.path.basename(path))
+    has_renditions = os.path.exists(renditions_path)
+    # One stat of the day's index per request; it is parsed only when it changed
+    damaged = damaged_numbers(os.path.dirname(path))
+    if not has_renditions and not lowest and not damaged:
+        return None
+    try:
+        with open(path) as f:
+            text = f.read()
+        if has_renditions:
+            with open(renditions_path) as f:
+                text = merge_renditions(text, f.read(), prefix=f"{RENDITIONS_DIR}/")
+    except OSError:
+        abort(404)
+    if damaged:
+        text = mark_gaps(text, damaged)
+    if lowest:
+        text = keep_lowest_video(text)
+    return Response(text, mimetype=MIMETYPES[".mpd"], headers={"Cache-Control": "no-cache"})
+
+def send_dash_file(root, filename, cache_control=None, offload=True, lowest=False,
+                   sendfile_prefix=SENDFILE_PREFIX):
+    """Send a file below ``root`` with ETag, Range and Cache-Control handling.
+
+    The body is handed to the WSGI server as a file (wsgi.file_wrapper, i.e.
+    sendfile under gunicorn) or offloaded to the proxy via X-Accel-Redirect /
+    X-Sendfile, so bytes are not copied through Python. ``sendfile_prefix``
+    is the nginx location of ``root``; with None nginx cannot reach it.
+    """
+    path = safe_join(str(root), filename)
+    if path is None:
+        abort(404)
+    try:
+        stat = os.stat(path)
+    except OSError:
+        abort(404)
+    if not os.path.isfile(path):
+        abort(404)
+    if path.endswith(".mpd"):
+        response = send_manifest(path, lowest)
+        if response is not None:
+            return response
+
+    mimetype = MIMETYPES.get(os.path.splitext(path)[1])
+    cache_control = cache_control or cache_control_for(path, stat)
+
+    accel = SENDFILE_HEADER and SENDFILE_HEADER.lower() == "x-accel-redirect"
+    if not offload or not SENDFILE_HEADER or (accel and sendfile_prefix is None):
+        response = send_file(path, mimetype=mimetype, conditional=True, etag=True)
+    elif accel:
+        # nginx serves the body and handles Range/ETag itself
+        response = Response(mimetype=mimetype)
+        response.headers[SENDFILE_HEADER] = sendfile_prefix + filename.replace(os.sep, "/")
+    else:
+        response = Response(mimetype=mimetype)
+        response.headers[SENDFILE_HEADER] = path
+    response.headers["Cache-Control"] = cache_control
+    response.headers["Accept-Ranges"] = "bytes"
+    return response
+
+def follow_growing_segment(path, block_size=256 * 1024):
+    """Yield a segment's bytes as ffmpeg writes them.
+
+    The dash muxer writes an in-progress segment to ``<name>.tmp`` and
+    renames it when the segment is complete. The file is reopened at the
+    current offset on every read rather than held open, so the rename also
+    works on Windows.
+    """
+    temp_path = path + ".tmp"
+    offset = 0
+    last_data_at = time.time()
+    while True:
+        finished = os.path.exists(path)
+        data = b""
+        try:
+            with open(path if finished else temp_path, "rb") as f:
+                f.seek(offset)
+                data = f.read(block_size)
+        except OSError:
+            pass
+        if data:
+            offset += len(data)
+            last_data_at = time.time()
+            yield data
+            continue
+        if finished or time.time() - last_data_at > LIVE_IDLE_TIMEOUT:
+            return
+        time.sleep(LIVE_POLL_INTERVAL)
+
+def send_live_file(live_dir, filename, lowest=False):
+    """Send a file of a live DASH generation, streaming segments still being written.
+
+    Live segment numbers restart with every recorder run, so nothing here is
+    cacheable. A segment that is still being written is sent with chunked
+    transfer encoding as it grows, which is what lets low-latency DASH
+    players start on a segment before it is complete.
+    """
+    path = safe_join(str(live_dir), filename)
+    if path is None:
+        abort(404)
+    if not CHUNK_RE.match(os.path.basename(path)):
+        return send_dash_file(live_dir, filename, cache_control="no-cache", offload=False, lowest=lowest)
+    deadline = time.time() + LIVE_SEGMENT_WAIT
+    while not os.path.exists(path) and not os.path.exists(path + ".tmp"):
+        if time.time() >= deadline:
+            abort(404)
+        time.sleep(LIVE_POLL_INTERVAL)
+    if os.path.exists(path):
+        return send_dash_file(live_dir, filename, cache_control="no-store", offload=False)
+    return Response(follow_growing_segment(path), mimetype=MIMETYPES[".m4s"],
+                    headers={"Cache-Control": "no-store", "X-Accel-Buffering": "no"})
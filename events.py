@@ -0,0 +1,257 @@
+"""In-process event bus behind the /events Server-Sent Events stream.
+
+Subscribers wait on one shared condition; a single watcher thread per web
+process turns changes in the recorder status file, the recordings catalog
+and the camera config into events, so any number of open dashboards cost
+one producer instead of one polling loop each.
+
+An open stream holds a server thread, so the number of streams is capped.
+Past the cap a page is told to poll ``since()`` (/api/events) instead.
+"""
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+
+log = logging.getLogger(__name__)
+
+# Events kept for subscribers that fall behind or reconnect with Last-Event-ID
+HISTORY_SIZE = 1024
+
+# Seconds between the watcher's checks of the status file, catalog and config
+WATCH_INTERVAL = 2
+
+# Seconds without events after which a keep-alive comment is sent
+KEEPALIVE_INTERVAL = 15
+
+# The watcher exits after this long without subscribers
+IDLE_TIMEOUT = 30
+
+# Newest recordings rows compared on each check to spot new camera/days
+RECENT_RECORDINGS = 50
+
+# Seconds between requests of a page that polls instead of streaming; well
+# under IDLE_TIMEOUT so polling pages keep the watcher running
+POLL_INTERVAL = 5
+
+def format_event(event_id, kind, data):
+    """One SSE message; events without an id do not move the client's Last-Event-ID"""
+    head = f"id: {event_id}\n" if event_id is not None else ""
+    return f"{head}event: {kind}\ndata: {json.dumps(data)}\n\n"
+
+class EventBus:
+    """Numbered events in a bounded history, shared by every subscriber"""
+
+    def __init__(self, history_size=HISTORY_SIZE, max_streams=None):
+        self.condition = threading.Condition()
+        self.history = deque(maxlen=history_size)
+        self.last_id = 0
+        self.subscribers = 0
+        self.last_subscriber_at = 0
+        # Open long-lived streams, at most max_streams (None: no limit)
+        self.max_streams = max_streams
+        self.streams = 0
+
+    def publish(self, kind, data):
+        with self.condition:
+            self.last_id += 1
+            self.history.append((self.last_id, kind, data))
+            self.condition.notify_all()
+
+    def open_stream(self):
+        """Reserve a slot for a long-lived stream; False when max_streams are open"""
+        with self.condition:
+            if self.max_streams is not None and self.streams >= self.max_streams:
+                return False
+            self.streams += 1
+            return True
+
+    def close_stream(self):
+        with self.condition:
+            self.streams -= 1
+
+    def since(self, after=None, kinds=None):
+        """(last id, [(id, kind, data)], lost) of events published after ``after``, without waiting.
+
+        ``lost`` is true when events after ``after`` already left the history.
+        Without ``after`` there are no events, only the id to poll from.
+        """
+        with self.condition:
+            last_id = self.last_id
+            if after is None:
+                return last_id, [], False
+            events = [e for e in self.history if e[0] > after and (kinds is None or e[1] in kinds)]
+            oldest = self.history[0][0] if self.history else last_id + 1
+        # Events after ``after`` fell out of the history, or ids restarted with the server
+        lost = oldest > after + 1 or after > last_id
+        return last_id, events, lost
+
+    def listen(self, after=None, kinds=None, timeout=KEEPALIVE_INTERVAL):
+        """Iterator of (id, kind, data) published after ``after`` (default: now).
+
+        Yields None when ``timeout`` passes without a matching event, so the
+        caller can send a keep-alive, and ("resync") once if events were
+        lost because the subscriber fell further behind than the history.
+        """
+        with self.condition:
+            last_id = self.last_id if after is None else after
+        return self._listen(last_id, kinds, timeout)
+
+    def _listen(self, last_id, kinds, timeout):
+        with self.condition:
+            self.subscribers += 1
+        try:
+            while True:
+                with self.condition:
+                    if not self.history or self.history[-1][0] <= last_id:
+                        self.condition.wait(timeout)
+                    events = [e for e in self.history if e[0] > last_id]
+                    lost = bool(events) and events[0][0] > last_id + 1
+                if lost:
+                    yield (events[0][0] - 1, "resync", {})
+                matched = False
+                for event in events:
+                    last_id = event[0]
+                    if kinds is None or event[1] in kinds:
+                        matched = True
+                        yield event
+                if not matched:
+                    yield None
+        finally:
+            with self.condition:
+                self.subscribers -= 1
+                self.last_subscriber_at = time.time()
+
+    def stream(self, after=None, kinds=None, initial=()):
+        """SSE text for a /events response, starting with the ``initial`` (kind, data) pairs.
+
+        When max_streams are already open the response is a single ``poll``
+        event telling the page to poll instead.
+        """
+        events = self.listen(after, kinds)
+
+        def generate():
+            # Counted once the server starts sending, so an abandoned request holds no slot
+            if not self.open_stream():
+                events.close()
+                yield format_event(None, "poll", {"interval": POLL_INTERVAL})
+                return
+            try:
+                yield "retry: 3000\n\n"
+                for kind, data in initial:
+                    if kinds is None or kind in kinds:
+                        yield format_event(None, kind, data)
+                for event in events:
+                    yield ": keep-alive\n\n" if event is None else format_event(*event)
+            finally:
+                events.close()
+                self.close_stream()
+
+        return generate()
+
+class RecorderWatcher:
+    """The bus's single producer.
+
+    Publishes ``camera`` (recorder state changed), ``segment`` (a camera
+    wrote a new segment), ``recording`` (a new camera/day appeared) and
+    ``config`` (cameras added, removed or renamed). It runs only while
+    someone is subscribed.
+    """
+
+    def __init__(self, bus, status_file, catalog, config_store, interval=WATCH_INTERVAL):
+        self.bus = bus
+        self.status_file = status_file
+        self.catalog = catalog
+        self.config_store = config_store
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.thread = None
+        self.status_mtime = None
+        self.cameras = {}
+        self.recordings = None
+        self.config = None
+
+    def ensure_running(self):
+        """Start the watcher for a new subscriber (and keep it from idling out meanwhile)"""
+        with self.bus.condition:
+            self.bus.last_subscriber_at = time.time()
+        with self.lock:
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self._run, name="events", daemon=True)
+                self.thread.start()
+
+    def _idle(self):
+        with self.bus.condition:
+            return self.bus.subscribers == 0 and time.time() - self.bus.last_subscriber_at > IDLE_TIMEOUT
+
+    def _run(self):
+        while True:
+            with self.lock:
+                if self._idle():
+                    self.thread = None
+                    return
+            try:
+                self.check()
+            except Exception:
+                log.exception("event watcher check failed")
+            time.sleep(self.interval)
+
+    def check(self):
+        self.check_status()
+        self.check_recordings()
+        self.check_config()
+
+    def check_status(self):
+        """Diff the recorder status file (parsed only when it changed)"""
+        try:
+            mtime = os.stat(self.status_file).st_mtime_ns
+            if mtime == self.status_mtime:
+                return
+            with open(self.status_file) as f:
+                status = json.load(f)
+        except (OSError, ValueError):
+            return
+        self.status_mtime = mtime
+        seen = set()
+        for process in status.get("processes", {}).values():
+            age = process.get("last_segment_age")
+            last_segment_at = round(status["updated_at"] - age) if age is not None else None
+            for guid in process.get("cameras", []):
+                seen.add(guid)
+                state = {"camera": guid, "state": process.get("state"),
+                         "restarts": process.get("restarts"), "last_exit": process.get("last_exit")}
+                previous = self.cameras.get(guid, {})
+                if {k: previous.get(k) for k in state} != state:
+                    self.bus.publish("camera", state)
+                # Status times are rounded, so only a step of over a second is a new segment
+                if last_segment_at and last_segment_at > (previous.get("last_segment_at") or 0) + 1:
+                    self.bus.publish("segment", {"camera": guid, "at": last_segment_at})
+                self.cameras[guid] = dict(state, last_segment_at=last_segment_at)
+        for guid in set(self.cameras) - seen:
+            del self.cameras[guid]
+            self.bus.publish("camera", {"camera": guid, "state": "stopped"})
+
+    def snapshot(self):
+        """Current camera states, sent to every new subscriber"""
+        return [("camera", {k: v for k, v in state.items() if k != "last_segment_at"})
+                for state in list(self.cameras.values())]
+
+    def check_recordings(self):
+        """Publish camera/days that were not among the newest rows last time"""
+        rows = self.catalog.list_recordings(1, RECENT_RECORDINGS)
+        keys = {(r["camera_guid"], r["date"]) for r in rows}
+        if self.recordings is not None:
+            for row in rows:
+                if (row["camera_guid"], row["date"]) not in self.recordings:
+                    self.bus.publish("recording", {"camera": row["camera_guid"], "date": row["date"]})
+        self.recordings = keys
+
+    def check_config(self):
+        """Publish the camera list when config.json changed (one stat per check)"""
+        config = self.config_store.load()
+        cameras = [{"guid": c["guid"], "name": c["name"]} for c in config["cameras"]]
+        if self.config is not None and cameras != self.config:
+            self.bus.publish("config", {"cameras": cameras})
+        self.config = cameras
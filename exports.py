@@ -0,0 +1,315 @@
+"""Background MP4 export jobs with progress reporting and result caching.
+
+Job state lives next to the output in the cache folder (<job_id>.json), and
+the process running a job holds an OS lock on <job_id>.lock, so every web
+worker sees the same jobs and a job runs once however many workers are
+asked for it. Slot locks cap the exports running at once across processes.
+"""
+import hashlib
+import json
+import logging
+import os
+import re
+import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from clips import chunk_path, recorded_segments, write_piece_list
+from integrity import INDEX_FILE, locate_shard, read_index
+from locks import FileLock
+from mpd import manifest_duration
+from shards import list_shards
+
+log = logging.getLogger(__name__)
+
+# <camera_guid>_<date>_<fingerprint>
+JOB_ID_RE = re.compile(r"^[\w-]+_\d{4}-\d{2}-\d{2}_[0-9a-f]+$")
+
+# Finished/failed jobs are forgotten after this many seconds (cached files stay)
+JOB_TTL = 3600
+
+# Seconds between checks for a free export slot while every slot is taken
+SLOT_POLL = 1
+
+def fingerprint_recording(shard_list):
+    """Fingerprint a recorded day by its shard manifests and newest segment.
+
+    A manifest is rewritten whenever a segment is added, so its size/mtime
+    changes with the recording; the last chunk's size/mtime catches a chunk
+    that was rewritten without a manifest change, and the integrity index
+    segments flagged since.
+    """
+    digest = hashlib.sha1()
+    for shard in shard_list:
+        stat = (shard["dir"] / "manifest.mpd").stat()
+        digest.update(f"{shard['id']}:{stat.st_size}:{stat.st_mtime_ns};".encode())
+    index_path = locate_shard(shard_list[-1]["dir"])[0] / INDEX_FILE
+    if index_path.exists():
+        stat = index_path.stat()
+        digest.update(f"{INDEX_FILE}:{stat.st_size}:{stat.st_mtime_ns};".encode())
+    chunks = sorted(shard_list[-1]["dir"].glob("chunk-*.m4s"))
+    if chunks:
+        stat = chunks[-1].stat()
+        digest.update(f"{chunks[-1].name}:{stat.st_size}:{stat.st_mtime_ns}".encode())
+    return digest.hexdigest()[:16]
+
+class ExportJob:
+    """One DASH -> MP4 export"""
+
+    def __init__(self, job_id, camera_guid, date, source_dir, output_path, fetch_back=None):
+        self.id = job_id
+        self.camera_guid = camera_guid
+        self.date = date
+        self.source_dir = Path(source_dir)
+        self.output_path = Path(output_path)
+        # Brings a cold-tier day back to the recording disk before it is read
+        self.fetch_back = fetch_back
+        self.status = "queued"
+        self.progress = 0.0
+        self.error = None
+        self.created_at = time.time()
+        self.finished_at = None
+
+    @property
+    def download_name(self):
+        return f"{self.camera_guid}_{self.date}.mp4"
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "camera_guid": self.camera_guid,
+            "date": self.date,
+            "status": self.status,
+            "progress": round(self.progress, 3),
+            "error": self.error,
+            "created_at": self.created_at,
+            "finished_at": self.finished_at,
+        }
+
+    @classmethod
+    def from_state(cls, state, root, output_path):
+        """A job as another process saved it"""
+        job = cls(state["id"], state["camera_guid"], state["date"],
+                  Path(root) / state["date"] / state["camera_guid"], output_path)
+        job.status = state["status"]
+        job.progress = state["progress"]
+        job.error = state["error"]
+        job.created_at = state["created_at"]
+        job.finished_at = state["finished_at"]
+        return job
+
+class ExportManager:
+    """Runs exports on a bounded worker pool and caches their results.
+
+    Job IDs are derived from the recording's fingerprint, so asking for the
+    same unchanged day twice returns the same job (or the cached file)
+    instead of remuxing it again. ``jobs`` holds the jobs this process runs;
+    the others are read from their state files.
+    """
+
+    def __init__(self, root, cache_dir, max_workers=2):
+        self.root = Path(root)
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.max_workers = max_workers
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="export")
+        self.jobs = {}
+        self.lock = threading.Lock()
+        self.listeners = []
+
+    def _state_path(self, job_id):
+        return self.cache_dir / f"{job_id}.json"
+
+    def _lock_path(self, job_id):
+        return self.cache_dir / f"{job_id}.lock"
+
+    def _save(self, job):
+        """Publish a job's state to the other web processes (atomic rewrite)"""
+        path = self._state_path(job.id)
+        tmp_path = path.with_name(f".{path.name}.{threading.get_ident()}.tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(job.to_dict(), f)
+        os.replace(tmp_path, path)
+
+    def _load(self, job_id):
+        """A job run by any process, from its state file; None if there is none"""
+        try:
+            with open(self._state_path(job_id)) as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return None
+        job = ExportJob.from_state(state, self.root, self.cache_dir / f"{job_id}.mp4")
+        if job.status in ("queued", "running") and not FileLock(self._lock_path(job_id)).is_held():
+            # The process running it exited without finishing
+            job.status = "failed"
+            job.error = "export interrupted"
+        return job
+
+    def _prune(self, now):
+        for job_id, job in list(self.jobs.items()):
+            if job.finished_at and now - job.finished_at > JOB_TTL:
+                del self.jobs[job_id]
+
+    def submit(self, camera_guid, date, source_dir=None, fetch_back=None):
+        """Queue an export of one camera/day, reusing a cached or running job.
+
+        For a day on the cold tier, ``source_dir`` is its cold folder and
+        ``fetch_back()`` copies it back to the recording disk (blocking); the
+        job runs that first and then exports from the recording disk.
+        """
+        source_dir = Path(source_dir) if source_dir else self.root / date / camera_guid
+        shard_list = list_shards(source_dir)
+        if not shard_list:
+            raise FileNotFoundError(f"No manifest for {camera_guid} on {date}")
+        job_id = f"{camera_guid}_{date}_{fingerprint_recording(shard_list)}"
+        output_path = self.cache_dir / f"{job_id}.mp4"
+        with self.lock:
+            self._prune(time.time())
+            job = self.jobs.get(job_id)
+            if job and job.status != "failed":
+                return job
+            job = ExportJob(job_id, camera_guid, date, source_dir, output_path, fetch_back)
+            job_lock = FileLock(self._lock_path(job_id))
+            if not job_lock.acquire(blocking=False):
+                # Another web process is running this export
+                return self._load(job_id) or job
+            if output_path.exists():
+                job_lock.release()
+                job.status = "done"
+                job.progress = 1.0
+                job.finished_at = time.time()
+                return job
+            self.jobs[job_id] = job
+            self._save(job)
+        self.executor.submit(self._run, job, job_lock)
+        return job
+
+    def get(self, job_id):
+        """Look up a job, whichever web process runs or ran it"""
+        with self.lock:
+            job = self.jobs.get(job_id)
+        if job is not None or not JOB_ID_RE.match(job_id):
+            return job
+        output_path = self.cache_dir / f"{job_id}.mp4"
+        if output_path.exists():
+            camera_guid, date, _ = job_id.rsplit("_", 2)
+            job = ExportJob(job_id, camera_guid, date, self.root / date / camera_guid, output_path)
+            job.status = "done"
+            job.progress = 1.0
+            return job
+        return self._load(job_id)
+
+    def _notify(self, job):
+        self._save(job)
+        for listener in self.listeners:
+            try:
+                listener(job)
+            except Exception:
+                log.exception("export listener failed", extra={"job": job.id})
+
+    def _remove_stale(self, job):
+        """Delete older cached exports of the same camera/day, with their state files"""
+        prefix = f"{job.camera_guid}_{job.date}_"
+        for path in self.cache_dir.glob(f"{prefix}*.mp4"):
+            if path != job.output_path and not path.name.endswith(".part.mp4"):
+                try:
+                    path.unlink()
+                    self._state_path(path.stem).unlink(missing_ok=True)
+                    # Superseded: nothing asks for this job id again
+                    self._lock_path(path.stem).unlink(missing_ok=True)
+                except OSError:
+                    pass
+
+    def _slot(self):
+        """Wait for one of the max_workers export slots shared by every web process"""
+        while True:
+            for n in range(self.max_workers):
+                slot = FileLock(self.cache_dir / f".slot-{n}.lock")
+                if slot.acquire(blocking=False):
+                    return slot
+            time.sleep(SLOT_POLL)
+
+    def _run(self, job, job_lock):
+        """Run a job once a slot is free; the job lock is held until it ends"""
+        try:
+            slot = self._slot()
+            try:
+                self._export(job)
+            finally:
+                slot.release()
+        finally:
+            job_lock.release()
+
+    def _export(self, job):
+        """Remux the day's DASH shards to one MP4, tracking ffmpeg -progress"""
+        tmp_path = job.output_path.with_suffix(".part.mp4")
+        list_path = job.output_path.with_suffix(".txt")
+        job.status = "running"
+        self._notify(job)
+        try:
+            if job.fetch_back:
+                job.fetch_back()
+                job.source_dir = self.root / job.date / job.camera_guid
+            shard_list = list_shards(job.source_dir)
+            if len(shard_list) == 1 and not read_index(job.source_dir):
+                manifest = shard_list[0]["dir"] / "manifest.mpd"
+                total = manifest_duration(manifest.read_text()) or 0
+                input_args = ["-i", str(manifest)]
+            else:
+                # Shards overlap at every rotation and verified days may have
+                # damaged segments: join just the chunks recorded_segments keeps
+                timelines = recorded_segments(job.source_dir)
+                total = sum(duration for _, segments in timelines for _, _, duration in segments)
+                write_piece_list(list_path, [
+                    (shard["dir"], [chunk_path(shard["dir"], number) for number, _, _ in segments])
+                    for shard, segments in timelines])
+                input_args = ["-protocol_whitelist", "file,concat", "-f", "concat", "-safe", "0",
+                              "-i", str(list_path)]
+            cmd = [
+                "ffmpeg",
+                "-hide_banner",
+                "-nostats",
+                "-progress", "pipe:1",
+                "-y",
+                *input_args,
+                "-c", "copy",  # Copy streams without re-encoding
+                "-movflags", "+faststart",  # Enable fast start for web playback
+                "-f", "mp4",
+                str(tmp_path),
+            ]
+            process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                       stdin=subprocess.DEVNULL, text=True)
+            stderr_lines = []
+            stderr_reader = threading.Thread(
+                target=lambda: stderr_lines.extend(process.stderr), daemon=True)
+            stderr_reader.start()
+            for line in process.stdout:
+                key, _, value = line.strip().partition("=")
+                if key == "out_time_us" and total and value.isdigit():
+                    job.progress = min(int(value) / 1e6 / total, 0.99)
+                    self._notify(job)
+            process.wait()
+            stderr_reader.join()
+            if process.returncode != 0:
+                raise RuntimeError("".join(stderr_lines[-5:]).strip() or f"ffmpeg exited with {process.returncode}")
+            os.replace(tmp_path, job.output_path)
+            self._remove_stale(job)
+            job.progress = 1.0
+            job.status = "done"
+        except Exception as e:
+            log.warning("export failed", extra={"job": job.id, "error": str(e)})
+            job.status = "failed"
+            job.error = str(e)
+            try:
+                tmp_path.unlink()
+            except OSError:
+                pass
+        finally:
+            try:
+                list_path.unlink()
+            except OSError:
+                pass
+            job.finished_at = time.time()
+            self._notify(job)
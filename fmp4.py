@@ -0,0 +1,133 @@
+"""Minimal ISO BMFF (fragmented MP4) box reading for recorder segments"""
+import struct
+
+# Seconds between the NTP epoch (1900) and the Unix epoch (1970)
+NTP_UNIX_OFFSET = 2208988800
+
+def iter_boxes(data, offset=0, end=None):
+    """Yield (type, start, header_size, size) for each top-level box in ``data``.
+
+    Stops at the first box that would run past the end of the buffer, so a
+    partial read of a file yields every complete box header it contains.
+    """
+    end = len(data) if end is None else end
+    while offset + 8 <= end:
+        size, box_type = struct.unpack_from(">I4s", data, offset)
+        header = 8
+        if size == 1:
+            if offset + 16 > end:
+                return
+            size = struct.unpack_from(">Q", data, offset + 8)[0]
+            header = 16
+        elif size == 0:
+            size = end - offset
+        if size < header:
+            return
+        yield box_type.decode("latin-1"), offset, header, size
+        offset += size
+
+def parse_prft(data, start, header):
+    """Decode a ProducerReferenceTimeBox into (unix_time, media_time)"""
+    body = start + header
+    version = data[body]
+    ntp_seconds, ntp_fraction = struct.unpack_from(">II", data, body + 8)
+    if version == 0:
+        media_time = struct.unpack_from(">I", data, body + 16)[0]
+    else:
+        media_time = struct.unpack_from(">Q", data, body + 16)[0]
+    unix_time = ntp_seconds - NTP_UNIX_OFFSET + ntp_fraction / 2 ** 32
+    return unix_time, media_time
+
+def read_prft(path, limit=4096):
+    """Read the wall-clock anchor ffmpeg writes with -write_prft, if present.
+
+    Returns (unix_time, media_time) where media_time is in the track timescale,
+    or None when the segment has no prft box in its first ``limit`` bytes.
+    """
+    with open(path, "rb") as f:
+        data = f.read(limit)
+    for box_type, start, header, size in iter_boxes(data):
+        if box_type == "prft" and start + size <= len(data):
+            return parse_prft(data, start, header)
+        if box_type == "mdat":
+            break
+    return None
+
+def child_boxes(data, start, header, size):
+    """Boxes nested in the box at ``start``"""
+    return iter_boxes(data, start + header, min(start + size, len(data)))
+
+def find_box(data, start, header, size, path):
+    """First box along ``path`` (e.g. ["mdia", "mdhd"]) inside a box, as (start, header, size)"""
+    for box_type, child, child_header, child_size in child_boxes(data, start, header, size):
+        if box_type == path[0]:
+            if len(path) == 1:
+                return child, child_header, child_size
+            return find_box(data, child, child_header, child_size, path[1:])
+    return None
+
+def read_init_tracks(path):
+    """{track_id: (timescale, handler, default_sample_duration)} from an init segment"""
+    with open(path, "rb") as f:
+        data = f.read()
+    tracks, defaults = {}, {}
+    for box_type, start, header, size in iter_boxes(data):
+        if box_type != "moov":
+            continue
+        for child_type, child, child_header, child_size in child_boxes(data, start, header, size):
+            if child_type == "trak":
+                tkhd = find_box(data, child, child_header, child_size, ["tkhd"])
+                mdhd = find_box(data, child, child_header, child_size, ["mdia", "mdhd"])
+                hdlr = find_box(data, child, child_header, child_size, ["mdia", "hdlr"])
+                if not (tkhd and mdhd and hdlr):
+                    continue
+                body = tkhd[0] + tkhd[1]
+                track_id = struct.unpack_from(">I", data, body + (20 if data[body] == 1 else 12))[0]
+                body = mdhd[0] + mdhd[1]
+                timescale = struct.unpack_from(">I", data, body + (20 if data[body] == 1 else 12))[0]
+                handler = data[hdlr[0] + hdlr[1] + 8:hdlr[0] + hdlr[1] + 12].decode("latin-1")
+                tracks[track_id] = (timescale, handler)
+            elif child_type == "mvex":
+                for trex_type, trex, trex_header, _ in child_boxes(data, child, child_header, child_size):
+                    if trex_type == "trex":
+                        track_id, _, duration = struct.unpack_from(">III", data, trex + trex_header + 4)
+                        defaults[track_id] = duration
+    return {track_id: (timescale, handler, defaults.get(track_id, 0))
+            for track_id, (timescale, handler) in tracks.items()}
+
+def parse_traf(data, start, header, size, default_duration=0):
+    """(track_id, base media time, total sample duration, total sample size or None) of a track fragment"""
+    track_id, base_time, duration, sample_size, known_sizes = None, None, 0, 0, True
+    default_size = None
+    for box_type, child, child_header, _ in child_boxes(data, start, header, size):
+        body = child + child_header
+        flags = struct.unpack_from(">I", data, body)[0] & 0xFFFFFF
+        if box_type == "tfhd":
+            track_id = struct.unpack_from(">I", data, body + 4)[0]
+            offset = body + 8
+            if flags & 0x01:
+                offset += 8
+            if flags & 0x02:
+                offset += 4
+            if flags & 0x08:
+                default_duration = struct.unpack_from(">I", data, offset)[0]
+                offset += 4
+            if flags & 0x10:
+                default_size = struct.unpack_from(">I", data, offset)[0]
+        elif box_type == "tfdt":
+            base_time = struct.unpack_from(">Q" if data[body] == 1 else ">I", data, body + 4)[0]
+        elif box_type == "trun":
+            count = struct.unpack_from(">I", data, body + 4)[0]
+            offset = body + 8 + (4 if flags & 0x01 else 0) + (4 if flags & 0x04 else 0)
+            fields = [bit for bit in (0x100, 0x200, 0x400, 0x800) if flags & bit]
+            for _ in range(count):
+                values = dict(zip(fields, struct.unpack_from(f">{len(fields)}I", data, offset)))
+                offset += 4 * len(fields)
+                duration += values.get(0x100, default_duration)
+                if 0x200 in values:
+                    sample_size += values[0x200]
+                elif default_size is not None:
+                    sample_size += default_size
+                else:
+                    known_sizes = False
+    return track_id, base_time, duration, sample_size if known_sizes else None
@@ -0,0 +1,549 @@
+"""Camera ingest: open each unique source once and fan it out to every output"""
+import logging
+import os
+import subprocess
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from urllib.parse import urlparse
+
+from shards import SHARD_SECONDS, get_shard_dir, next_boundary, valid_shard_seconds
+from supervisor import ProcessSupervisor
+
+log = logging.getLogger(__name__)
+
+# Root folders for recordings and for the rolling live/thumbnail outputs;
+# VMS_DASH_ROOT and VMS_LIVE_ROOT point each recorder node at its own disk
+DASH_ROOT = Path(os.environ.get("VMS_DASH_ROOT", "E:/bala/version1/dashvideos"))
+LIVE_ROOT = Path(os.environ.get("VMS_LIVE_ROOT", "E:/bala/version1/live"))
+
+# Seconds between thumbnail refreshes
+THUMBNAIL_INTERVAL = 5
+
+# Motion samples for motion.py: MOTION_FPS grayscale frames per second of
+# MOTION_WIDTH x MOTION_HEIGHT, cut into one raw file per MOTION_SLOT_SECONDS
+# of wall-clock time under <live>/<guid>/motion/<recorder start>/
+MOTION_DIR = "motion"
+MOTION_FPS = 2
+MOTION_WIDTH = 64
+MOTION_HEIGHT = 36
+MOTION_SLOT_SECONDS = 4
+MOTION_FILE_NAME = "%Y%m%d-%H%M%S"
+
+# Per-camera codec_mode values in config.json
+CODEC_MODES = ("transcode", "copy", "auto")
+DEFAULT_CODEC_MODE = "auto"
+
+# Source video codecs that can go straight into DASH without re-encoding
+COPY_CODECS = {"h264", "hevc"}
+
+# Seconds to wait for ffprobe before falling back to transcoding
+PROBE_TIMEOUT = 15
+
+# Seconds before a source whose probe failed is probed again; it is
+# transcoded until a probe succeeds
+PROBE_RETRY = 60
+
+# ffprobe runs at once; probes run off the recorder loop, so a batch of new
+# 'auto' cameras cannot hold up health checks of the running ones
+PROBE_WORKERS = 4
+
+# Lower ABR renditions are written to this subfolder of each manifest folder
+RENDITIONS_DIR = "renditions"
+
+# New sources are started at most this many per second (after a burst of
+# START_BURST), so provisioning a site does not launch every encoder at once;
+# config.json "recorder": {"start_rate": ...} overrides the rate
+START_RATE = 1.0
+START_BURST = 4
+
+def get_camera_url(camera):
+    """Get camera URL with authentication if needed"""
+    url = camera['url']
+    if camera.get('username') and camera.get('password'):
+        parsed = urlparse(url)
+        auth = f"{camera['username']}:{camera['password']}"
+        return f"{parsed.scheme}://{auth}@{parsed.netloc}{parsed.path}"
+    return url
+
+def get_dash_output_dir(camera_guid, started_at):
+    """Get the recording shard directory for a recorder started at ``started_at``"""
+    return get_shard_dir(DASH_ROOT, camera_guid, started_at)
+
+def get_live_output_dir(camera_guid):
+    """Get the directory holding the camera's live generations and thumbnail"""
+    output_dir = LIVE_ROOT / camera_guid
+    output_dir.mkdir(parents=True, exist_ok=True)
+    return output_dir
+
+def get_live_generation_dir(camera_guid, started_at):
+    """Get the folder of one recorder run's rolling live manifest.
+
+    During a rotation handoff two recorders run side by side; each writes its
+    own live generation so their segment numbers never collide. Generations
+    left empty by recorders that exited (remove_at_exit) are pruned here.
+    """
+    live_dir = get_live_output_dir(camera_guid)
+    for old in live_dir.iterdir():
+        if old.is_dir():
+            try:
+                old.rmdir()
+            except OSError:
+                pass
+    output_dir = live_dir / str(int(started_at))
+    output_dir.mkdir(parents=True, exist_ok=True)
+    return output_dir
+
+def get_motion_output_dir(camera_guid, started_at):
+    """Get the folder one recorder run writes its motion samples to.
+
+    Like live generations, each run has its own folder, so the two recorders
+    of a rotation handoff never write to the same sample file.
+    """
+    output_dir = get_live_output_dir(camera_guid) / MOTION_DIR / str(int(started_at))
+    output_dir.mkdir(parents=True, exist_ok=True)
+    return output_dir
+
+def current_live_dir(camera_guid):
+    """Newest live generation of a camera that has a manifest, or None"""
+    live_dir = LIVE_ROOT / camera_guid
+    if not live_dir.exists():
+        return None
+    generations = sorted((d for d in live_dir.iterdir() if d.is_dir() and d.name.isdigit()),
+                         key=lambda d: int(d.name), reverse=True)
+    for generation in generations:
+        if (generation / "live.mpd").exists():
+            return generation
+    return None
+
+def probe_video_codec(source_url):
+    """Return the codec name of the source's first video stream, or None"""
+    cmd = [
+        "ffprobe",
+        "-v", "error",
+        "-select_streams", "v:0",
+        "-show_entries", "stream=codec_name",
+        "-of", "csv=p=0",
+        source_url,
+    ]
+    try:
+        result = subprocess.run(cmd, capture_output=True, text=True, timeout=PROBE_TIMEOUT)
+    except (subprocess.TimeoutExpired, OSError) as e:
+        log.warning("could not probe source", extra={"source": urlparse(source_url).netloc, "error": str(e)})
+        return None
+    codec = result.stdout.strip().splitlines()
+    if result.returncode != 0 or not codec:
+        error = result.stderr.strip().splitlines()
+        log.warning("could not probe source", extra={"source": urlparse(source_url).netloc,
+                                                     "error": error[-1] if error else f"exit code {result.returncode}"})
+        return None
+    return codec[0]
+
+def resolve_codec_mode(camera, probe=probe_video_codec):
+    """Resolve a camera's codec_mode to either 'copy' or 'transcode'"""
+    mode = camera.get('codec_mode', DEFAULT_CODEC_MODE)
+    if mode not in CODEC_MODES:
+        log.warning("unknown codec_mode, transcoding", extra={"camera": camera['guid'], "codec_mode": mode})
+        return "transcode"
+    if mode == "auto":
+        codec = probe(get_camera_url(camera))
+        return "copy" if codec in COPY_CODECS else "transcode"
+    return mode
+
+def resolve_ladder(camera, profiles):
+    """A camera's rendition ladder as ((height, bitrate), ...), highest first.
+
+    ``camera["profile"]`` names an entry of ``config["profiles"]``, a list of
+    renditions such as ``{"height": 480, "bitrate": "600k"}``. Cameras
+    without a profile record a single rendition as before.
+    """
+    name = camera.get('profile')
+    if not name:
+        return ()
+    renditions = profiles.get(name)
+    if not renditions:
+        log.warning("unknown profile, recording a single rendition", extra={"camera": camera['guid'], "profile": name})
+        return ()
+    ladder = sorted(((int(r['height']), str(r['bitrate'])) for r in renditions), reverse=True)
+    return tuple(ladder)
+
+def group_cameras_by_source(cameras, probe=probe_video_codec, profiles=None):
+    """Group cameras by (source URL, codec mode, ladder) so each source is only opened once"""
+    groups = {}
+    for camera in cameras:
+        key = (get_camera_url(camera), resolve_codec_mode(camera, probe),
+               resolve_ladder(camera, profiles or {}))
+        groups.setdefault(key, []).append(camera)
+    return groups
+
+def _input_args(source_url, codec_mode, decode_all=False):
+    """Input options for a source; HTTP (MJPEG) sources get browser-like headers"""
+    args = []
+    if codec_mode == "copy" and not decode_all:
+        # Video is remuxed untouched, so the decoder only feeds the thumbnail
+        # and motion outputs and can skip everything but keyframes
+        args += ["-skip_frame", "nokey"]
+    parsed = urlparse(source_url)
+    if parsed.scheme not in ("http", "https"):
+        return args + ["-i", source_url]
+    origin = f"{parsed.scheme}://{parsed.hostname}" + (f":{parsed.port}" if parsed.port else "")
+    headers = (
+        "User-Agent: Mozilla/5.0\r\n"
+        "Accept: */*\r\n"
+        "Connection: keep-alive\r\n"
+        f"Referer: {origin}/\r\n"
+        f"Origin: {origin}\r\n"
+    )
+    return args + ["-headers", headers, "-i", source_url]
+
+def _video_codec_args(codec_mode):
+    """Video encoder options for the recording and live outputs"""
+    if codec_mode == "copy":
+        return ["-c:v", "copy"]
+    return [
+        "-c:v", "libx264",
+        "-preset", "fast",
+        "-crf", "22",
+        "-b:v", "2M",
+        "-maxrate", "2M",
+        "-bufsize", "1M",
+        "-g", "48",
+        "-keyint_min", "48",
+    ]
+
+def _ladder_args(codec_mode, ladder):
+    """Map and encoder options for a rendition ladder, decoded once.
+
+    Output streams are ordered v:0 (main rendition), the source audio, then
+    the lower renditions as v:1, v:2, ... In transcode mode the first rung is
+    the main rendition; in copy mode the untouched source stands in for it
+    and only the lower rungs are encoded. Keyframes are forced at the same
+    interval in every rendition so players can switch at segment boundaries.
+    """
+    scaled = ladder if codec_mode == "transcode" else ladder[1:]
+    graph = f"[0:v]split={len(scaled)}" + "".join(f"[s{i}]" for i in range(len(scaled)))
+    graph += "".join(f";[s{i}]scale=-2:{height}[v{i}]" for i, (height, _) in enumerate(scaled))
+    labels = [f"[v{i}]" for i in range(len(scaled))]
+    if codec_mode == "transcode":
+        main, lower = labels[0], labels[1:]
+    else:
+        main, lower = "0:v", labels
+    args = ["-filter_complex", graph, "-map", main, "-map", "0:a?"]
+    for label in lower:
+        args += ["-map", label]
+    args += [
+        "-c:v", "libx264",
+        "-preset", "fast",
+        "-crf", "22",
+        "-g", "48",
+        "-keyint_min", "48",
+        "-sc_threshold", "0",
+    ]
+    if codec_mode == "copy":
+        args += ["-c:v:0", "copy"]
+    for index, (_, bitrate) in enumerate(ladder):
+        if codec_mode == "copy" and index == 0:
+            continue
+        args += [f"-b:v:{index}", bitrate, f"-maxrate:v:{index}", bitrate, f"-bufsize:v:{index}", bitrate]
+    return args
+
+def _tee_slave(options, path):
+    """Format one tee muxer output as [key=value:...]path"""
+    opts = ":".join(f"{key}='{value}'" if ":" in str(value) else f"{key}={value}"
+                    for key, value in options.items())
+    return f"[{opts}]{Path(path).as_posix()}"
+
+def _with_renditions(slave, options, path, lower_count):
+    """Split a DASH tee output into the main rendition and a ladder of lower ones.
+
+    The main manifest keeps the main video (v:0) and the audio under the
+    usual segment names; the lower renditions go to a second manifest in
+    RENDITIONS_DIR, which the server merges into the main one for players.
+    """
+    if not lower_count:
+        return [slave(options, path)]
+    renditions_dir = Path(path).parent / RENDITIONS_DIR
+    renditions_dir.mkdir(parents=True, exist_ok=True)
+    lower_streams = ",".join(f"v:{i}" for i in range(1, lower_count + 1))
+    renditions = dict(options,
+                      select=lower_streams,
+                      adaptation_sets="id=0,streams=v",
+                      init_seg_name="init-$RepresentationID$.m4s",
+                      media_seg_name="chunk-$RepresentationID$-$Number%05d$.m4s")
+    return [slave(dict(options, select="v:0,a"), path),
+            slave(renditions, renditions_dir / Path(path).name)]
+
+def _recording_slave(output_dir, lower_count=0):
+    """Tee outputs writing one shard of the DASH recording"""
+    return _with_renditions(_tee_slave, {
+        "f": "dash",
+        "seg_duration": 4,
+        "frag_duration": 4,
+        "init_seg_name": "init.m4s",
+        "media_seg_name": "chunk-$Number%05d$.m4s",
+        "use_timeline": 1,
+        "use_template": 1,
+        "ldash": 1,
+        "streaming": 1,
+        "remove_at_exit": 0,
+        "write_prft": 1,
+        "target_latency": 3,
+        "ignore_io_errors": 1,
+        "window_size": 0,
+        "extra_window_size": 0,
+        "dash_segment_type": "mp4",
+        "dash_playlist_type": "event",
+        "index_correction": 0,
+    }, output_dir / "manifest.mpd", lower_count)
+
+def _live_slave(live_dir, lower_count=0):
+    """Tee outputs writing a short sliding-window DASH manifest for live viewing"""
+    return _with_renditions(_tee_slave, {
+        "f": "dash",
+        "seg_duration": 4,
+        "frag_duration": 1,
+        "init_seg_name": "init.m4s",
+        "media_seg_name": "chunk-$Number%05d$.m4s",
+        "use_template": 1,
+        "use_timeline": 0,
+        "ldash": 1,
+        "streaming": 1,
+        "target_latency": 3,
+        "window_size": 6,
+        "extra_window_size": 2,
+        "remove_at_exit": 1,
+        "ignore_io_errors": 1,
+    }, live_dir / "live.mpd", lower_count)
+
+def _thumbnail_slave(live_dir):
+    """Tee output continuously overwriting the camera thumbnail"""
+    return _tee_slave({"f": "image2", "update": 1}, live_dir / "thumb.jpg")
+
+def _motion_slave(motion_dir):
+    """Tee output cutting raw motion samples into one file per slot"""
+    return _tee_slave({
+        "f": "segment",
+        "segment_format": "rawvideo",
+        "segment_time": MOTION_SLOT_SECONDS,
+        "segment_atclocktime": 1,
+        "strftime": 1,
+    }, motion_dir / f"{MOTION_FILE_NAME}.gray")
+
+def build_ingest_command(source_url, cameras, codec_mode="transcode", started_at=None, ladder=()):
+    """Build one ffmpeg command that decodes a source once and feeds every camera output.
+
+    The source is encoded a single time (or remuxed as-is in ``copy`` mode);
+    the tee muxer then writes the same packets to each camera's recording and
+    live manifests. Two cheap outputs scale the decoded frames down to a
+    periodically refreshed thumbnail and to the tiny grayscale samples motion
+    scoring reads. With a rendition ``ladder`` the decoded frames are split
+    and scaled once per rung, giving ABR representations.
+    """
+    started_at = started_at or time.time()
+    if codec_mode == "copy" and len(ladder) < 2:
+        # The source itself is the only rendition
+        ladder = ()
+    lower_count = max(len(ladder) - 1, 0)
+    dash_outputs = []
+    thumbnail_outputs = []
+    motion_outputs = []
+    for camera in cameras:
+        output_dir = get_dash_output_dir(camera['guid'], started_at)
+        live_dir = get_live_output_dir(camera['guid'])
+        dash_outputs += _recording_slave(output_dir, lower_count)
+        dash_outputs += _live_slave(get_live_generation_dir(camera['guid'], started_at), lower_count)
+        thumbnail_outputs.append(_thumbnail_slave(live_dir))
+        motion_outputs.append(_motion_slave(get_motion_output_dir(camera['guid'], started_at)))
+
+    if ladder:
+        video_args = _ladder_args(codec_mode, ladder)
+    else:
+        video_args = ["-map", "0:v", "-map", "0:a?", *_video_codec_args(codec_mode)]
+    return [
+        "ffmpeg",
+        "-hide_banner",
+        # Machine-readable fps/speed for the supervisor's health report
+        "-nostats",
+        "-progress", "pipe:1",
+        *_input_args(source_url, codec_mode, decode_all=bool(lower_count)),
+        # Recording + live view: encode once, mux many times
+        *video_args,
+        "-c:a", "aac",
+        "-b:a", "128k",
+        "-flags", "+global_header",
+        "-f", "tee",
+        "|".join(dash_outputs),
+        # Thumbnails: reuse the decoded frames, no second decode
+        "-map", "0:v",
+        "-vf", f"fps=1/{THUMBNAIL_INTERVAL},scale=320:-2",
+        "-c:v", "mjpeg",
+        "-q:v", "5",
+        "-f", "tee",
+        "|".join(thumbnail_outputs),
+        # Motion samples, from the same decoded frames
+        "-map", "0:v",
+        "-vf", f"fps={MOTION_FPS},scale={MOTION_WIDTH}:{MOTION_HEIGHT},format=gray",
+        "-c:v", "rawvideo",
+        "-f", "tee",
+        "|".join(motion_outputs),
+    ]
+
+class IngestManager:
+    """Owns one supervised ffmpeg process per unique camera source"""
+
+    def __init__(self, status_file=None, segment_listeners=(), rollover_seconds=SHARD_SECONDS):
+        self.supervisor = ProcessSupervisor(status_file=status_file,
+                                            segment_listeners=segment_listeners)
+        # Length of a recording shard; recorders hand over to a new shard at
+        # every multiple of this since midnight, so midnight starts a new day
+        self.rollover_seconds = rollover_seconds
+        # (source url, codec mode, ladder) -> tuple of camera guids it feeds
+        self.sources = {}
+        # source url -> probed video codec, so 'auto' cameras are probed once
+        self.probed_codecs = {}
+        # source url -> monotonic time of its last failed probe
+        self.probe_failed_at = {}
+        # source url -> Future of a probe still running
+        self.probing = {}
+        self.probe_executor = ThreadPoolExecutor(max_workers=PROBE_WORKERS, thread_name_prefix="probe")
+        # Sources waiting for a start slot, in the order they were configured
+        self.pending = {}
+        self.start_rate = START_RATE
+        self.start_tokens = START_BURST
+        self.tokens_at = time.monotonic()
+
+    def probe(self, source_url):
+        """Probed video codec of a source, or None while it is not known.
+
+        Never blocks: an unknown source is probed on the probe pool and the
+        answer is picked up by a later call. A failed probe is not cached:
+        the source is transcoded for now and probed again PROBE_RETRY
+        seconds later, so a camera that was offline at startup switches to
+        copy once it answers.
+        """
+        self.collect_probes()
+        if source_url in self.probed_codecs:
+            return self.probed_codecs[source_url]
+        failed_at = self.probe_failed_at.get(source_url)
+        if source_url not in self.probing and (failed_at is None or time.monotonic() - failed_at >= PROBE_RETRY):
+            self.probing[source_url] = self.probe_executor.submit(probe_video_codec, source_url)
+        return None
+
+    def collect_probes(self):
+        """Record the answers of finished probes"""
+        for source_url, future in list(self.probing.items()):
+            if not future.done():
+                continue
+            del self.probing[source_url]
+            try:
+                codec = future.result()
+            except Exception:
+                log.exception("codec probe failed", extra={"source": urlparse(source_url).netloc})
+                codec = None
+            source = urlparse(source_url).netloc
+            if codec is None:
+                self.probe_failed_at[source_url] = time.monotonic()
+                log.warning("codec probe failed, transcoding until it succeeds",
+                            extra={"source": source, "retry_in": PROBE_RETRY})
+                continue
+            self.probed_codecs[source_url] = codec
+            self.probe_failed_at.pop(source_url, None)
+            log.info("probed source codec", extra={"source": source, "codec": codec,
+                                                   "codec_mode": "copy" if codec in COPY_CODECS else "transcode"})
+
+    def awaiting_probe(self, camera):
+        """True for an 'auto' camera whose first probe has not answered yet"""
+        if camera.get('codec_mode', DEFAULT_CODEC_MODE) != "auto":
+            return False
+        source_url = get_camera_url(camera)
+        if source_url in self.probed_codecs or source_url in self.probe_failed_at:
+            return False
+        self.probe(source_url)
+        return source_url in self.probing
+
+    @staticmethod
+    def process_name(guids):
+        """Supervisor name for the process feeding these cameras"""
+        return "+".join(guids)
+
+    def start_source(self, key, cameras):
+        """Start the supervised ingest process for a single source"""
+        source_url, codec_mode, ladder = key
+        guids = tuple(c['guid'] for c in cameras)
+        names = ", ".join(f"{c['name']} ({c['guid']})" for c in cameras)
+        log.info("starting ingest", extra={"source": urlparse(source_url).netloc, "codec_mode": codec_mode,
+                                           "renditions": len(ladder) or 1, "cameras": names})
+        self.sources[key] = guids
+        return self.supervisor.add(
+            self.process_name(guids),
+            build_command=lambda started_at: build_ingest_command(source_url, cameras, codec_mode, started_at, ladder),
+            output_dirs=lambda started_at: [get_dash_output_dir(guid, started_at) for guid in guids],
+            labels=guids,
+            # Hand over to a new shard (and manifest) at every rollover boundary
+            next_rotation=lambda period_start: next_boundary(period_start, self.rollover_seconds),
+        )
+
+    def stop_source(self, key):
+        """Stop the ingest process for a single source"""
+        guids = self.sources.pop(key)
+        log.info("stopping ingest", extra={"cameras": ",".join(guids)})
+        self.supervisor.remove(self.process_name(guids))
+
+    def set_rollover(self, seconds):
+        """Change the shard length; running recorders pick it up at their next rollover"""
+        seconds = seconds or SHARD_SECONDS
+        if not valid_shard_seconds(seconds):
+            log.warning("rollover_seconds must divide 86400", extra={"requested": seconds, "kept": self.rollover_seconds})
+            return
+        self.rollover_seconds = seconds
+
+    def set_start_rate(self, rate):
+        """Change how many new sources may start per second"""
+        self.start_rate = rate if rate and rate > 0 else START_RATE
+
+    def sync(self, cameras, profiles=None):
+        """Bring running ingest processes in line with the configured cameras.
+
+        Sources that disappeared are stopped and a source whose set of cameras
+        changed is restarted with the new outputs; sources whose URL, codec
+        mode, ladder and cameras are unchanged keep running. New sources are
+        queued and started at the start rate.
+
+        A camera that is not recording yet and still waits for its first
+        codec probe is left out until a later sync, rather than started in
+        transcode mode and restarted once the probe answers.
+        """
+        recording = {guid for guids in self.sources.values() for guid in guids}
+        cameras = [c for c in cameras if c['guid'] in recording or not self.awaiting_probe(c)]
+        groups = group_cameras_by_source(cameras, probe=self.probe, profiles=profiles)
+        for key in list(self.sources):
+            wanted = groups.get(key)
+            if wanted is None or tuple(c['guid'] for c in wanted) != self.sources[key]:
+                self.stop_source(key)
+        self.pending = {key: group for key, group in groups.items() if key not in self.sources}
+        self.start_pending()
+
+    def start_pending(self):
+        """Start queued sources while start tokens are available"""
+        now = time.monotonic()
+        self.start_tokens = min(self.start_tokens + (now - self.tokens_at) * self.start_rate, START_BURST)
+        self.tokens_at = now
+        while self.pending and self.start_tokens >= 1:
+            key = next(iter(self.pending))
+            self.start_source(key, self.pending.pop(key))
+            self.start_tokens -= 1
+        if self.pending:
+            log.debug("sources waiting to start", extra={"queued": len(self.pending)})
+
+    def poll(self):
+        """Start queued sources, restart exited or stalled ones and refresh the status file"""
+        self.start_pending()
+        self.supervisor.poll()
+
+    def stop_all(self):
+        """Stop every ingest process"""
+        self.pending = {}
+        self.probe_executor.shutdown(wait=False, cancel_futures=True)
+        for key in list(self.sources):
+            self.stop_source(key)
+        log.info("all streams stopped")
@@ -0,0 +1,332 @@
+"""Per-segment integrity index: verified duration, size and checksum of every chunk.
+
+A background listener parses each segment's moof/mdat box headers as soon
+as it closes and appends one fixed-size record to the camera/day's
+segments.idx. Playback, clips and exports read that index instead of
+probing files. Damaged or missing segments are flagged when they are
+written, not when someone needs the footage.
+"""
+import logging
+import os
+import queue
+import re
+import struct
+import sys
+import threading
+import zlib
+from collections import namedtuple
+from pathlib import Path
+
+from fmp4 import child_boxes, iter_boxes, parse_prft, parse_traf, read_init_tracks
+
+log = logging.getLogger(__name__)
+
+INDEX_FILE = "segments.idx"
+
+# shard (HHMMSS as an int, -1 for a pre-shard day), number, start (Unix),
+# duration (s), size (bytes), CRC-32, status; 32 bytes per segment
+RECORD = struct.Struct("<iIdfIIB3x")
+
+OK = 0
+TRUNCATED = 1  # a box runs past the end of the file
+CORRUPT = 2  # unparsable boxes or no media fragment
+MISSING = 3  # the recorder skipped the number or the file is gone
+
+STATUS_NAMES = {OK: "ok", TRUNCATED: "truncated", CORRUPT: "corrupt", MISSING: "missing"}
+
+# A jump between consecutive segments longer than this is reported as a gap
+GAP_TOLERANCE = 2.0
+
+# Closed segments waiting to be verified
+QUEUE_SIZE = 1000
+
+CHUNK_RE = re.compile(r"^chunk-(\d+)\.m4s$")
+
+Segment = namedtuple("Segment", "shard number start duration size crc status")
+
+def shard_key(shard):
+    return int(shard) if shard else -1
+
+def shard_name(key):
+    return f"{key:06d}" if key >= 0 else ""
+
+def video_track(init_path):
+    """(track_id, timescale, default sample duration) of the init segment's video track"""
+    tracks = read_init_tracks(init_path)
+    for track_id, (timescale, handler, default_duration) in sorted(tracks.items()):
+        if handler == "vide":
+            return track_id, timescale, default_duration
+    if tracks:
+        track_id, (timescale, _, default_duration) = min(tracks.items())
+        return track_id, timescale, default_duration
+    return None
+
+def verify_segment(path, track):
+    """(start, duration, size, crc, status) of one chunk from its box headers.
+
+    ``track`` is video_track() of the shard's init segment. Sample sizes
+    declared in each trun must fit the following mdat.
+    """
+    track_id, timescale, default_duration = track
+    try:
+        with open(path, "rb") as f:
+            data = f.read()
+            stat = os.fstat(f.fileno())
+    except OSError:
+        return 0.0, 0.0, 0, 0, MISSING
+    status, ticks, base_time, prft, expected = OK, 0, None, None, None
+    fragments = 0
+    try:
+        for box_type, start, header, size in iter_boxes(data):
+            if start + size > len(data):
+                status = TRUNCATED
+                break
+            if box_type == "prft" and prft is None:
+                prft = parse_prft(data, start, header)
+            elif box_type == "moof":
+                expected = 0
+                for child_type, child, child_header, child_size in child_boxes(data, start, header, size):
+                    if child_type != "traf":
+                        continue
+                    traf_id, traf_base, traf_ticks, traf_bytes = parse_traf(
+                        data, child, child_header, child_size, default_duration)
+                    if traf_id == track_id:
+                        ticks += traf_ticks
+                        if base_time is None:
+                            base_time = traf_base
+                    expected = None if expected is None or traf_bytes is None else expected + traf_bytes
+            elif box_type == "mdat":
+                if expected is not None and expected > size - header:
+                    status = CORRUPT
+                    break
+                fragments += 1
+                expected = None
+    except struct.error:
+        status = CORRUPT
+    if status == OK and not fragments:
+        status = CORRUPT
+    duration = ticks / timescale if timescale else 0.0
+    if prft and base_time is not None:
+        unix_time, media_time = prft
+        start_time = unix_time - (media_time - base_time) / timescale
+    else:
+        # A chunk's mtime is set when it closes
+        start_time = stat.st_mtime - duration
+    return start_time, duration, len(data), zlib.crc32(data), status
+
+_cache = {}
+_cache_lock = threading.Lock()
+
+def read_index(day_dir):
+    """Records of a camera/day, the newest per (shard, number), in order.
+
+    Parsed again only when the file's size or mtime changed, so readers
+    can call this per request.
+    """
+    path = Path(day_dir) / INDEX_FILE
+    try:
+        stat = path.stat()
+    except OSError:
+        return []
+    key = (stat.st_size, stat.st_mtime_ns)
+    with _cache_lock:
+        cached = _cache.get(path)
+        if cached and cached[0] == key:
+            return cached[1]
+    data = path.read_bytes()
+    latest = {}
+    for offset in range(0, len(data) - RECORD.size + 1, RECORD.size):
+        record = Segment(*RECORD.unpack_from(data, offset))
+        latest[record.shard, record.number] = record
+    records = [latest[k] for k in sorted(latest)]
+    with _cache_lock:
+        _cache[path] = (key, records)
+    return records
+
+def append_records(day_dir, records):
+    with open(Path(day_dir) / INDEX_FILE, "ab") as f:
+        f.write(b"".join(RECORD.pack(*record) for record in records))
+
+def write_index(day_dir, records):
+    """Replace a camera/day's index (atomic rewrite)"""
+    day_dir = Path(day_dir)
+    tmp_path = day_dir / f".{INDEX_FILE}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(b"".join(RECORD.pack(*record) for record in records))
+    os.replace(tmp_path, day_dir / INDEX_FILE)
+
+def locate_shard(source_dir):
+    """(day folder, shard key) of a recording folder holding a manifest"""
+    source_dir = Path(source_dir)
+    if (source_dir / INDEX_FILE).exists():
+        return source_dir, -1
+    if source_dir.name.isdigit():
+        return source_dir.parent, shard_key(source_dir.name)
+    return source_dir, -1
+
+def damaged_numbers(source_dir):
+    """Segment numbers of a shard folder that must not be played"""
+    day_dir, shard = locate_shard(source_dir)
+    return {r.number for r in read_index(day_dir) if r.shard == shard and r.status != OK}
+
+def shard_segments(records, shard_list):
+    """[(shard, [records])] for the shards of list_shards(), or None if any shard is not indexed"""
+    by_shard = {}
+    for record in records:
+        by_shard.setdefault(record.shard, []).append(record)
+    result = []
+    for shard in shard_list:
+        shard_records = by_shard.get(shard_key(shard["id"]))
+        if not shard_records:
+            return None
+        result.append((shard, shard_records))
+    return result
+
+def gaps(records):
+    """[(start, end, reason)] of damaged segments and holes in the recording"""
+    found = []
+    previous_end = None
+    for record in sorted(records, key=lambda r: (r.start, r.shard, r.number)):
+        if record.status != OK:
+            found.append((record.start, record.start + record.duration, STATUS_NAMES[record.status]))
+            continue
+        if previous_end is not None and record.start - previous_end > GAP_TOLERANCE:
+            found.append((previous_end, record.start, "gap"))
+        previous_end = record.start + record.duration
+    return found
+
+def summarize(records):
+    """Counts per status plus the gaps, for the API and the CLI"""
+    counts = {name: 0 for name in STATUS_NAMES.values()}
+    for record in records:
+        counts[STATUS_NAMES[record.status]] += 1
+    return {
+        "segments": len(records),
+        "duration": round(sum(r.duration for r in records if r.status == OK), 3),
+        "bytes": sum(r.size for r in records),
+        "status": counts,
+        "damaged": len(records) - counts["ok"],
+        "gaps": [{"start": round(start, 3), "end": round(end, 3), "reason": reason}
+                 for start, end, reason in gaps(records)],
+    }
+
+class IntegrityVerifier:
+    """Segment listener that verifies closed segments in a background thread.
+
+    Numbers the recorder skipped (or that were dropped while the queue was
+    full) are filled in when the next segment of the shard arrives.
+    ``on_damaged(camera_guid, date, record)`` is called for every bad one.
+    """
+
+    def __init__(self, root, on_damaged=None):
+        self.root = Path(root)
+        self.on_damaged = on_damaged
+        self.queue = queue.Queue(maxsize=QUEUE_SIZE)
+        self.tracks = {}
+        # (day folder, shard) -> newest record written
+        self.last = {}
+
+    def start(self):
+        threading.Thread(target=self._loop, name="integrity", daemon=True).start()
+
+    def stop(self):
+        self.queue.put(None)
+
+    def on_segment(self, path, overlap=False):
+        try:
+            self.queue.put_nowait(Path(path))
+        except queue.Full:
+            log.warning("integrity verifier is behind, segment left for the next one",
+                        extra={"path": str(path)})
+
+    def _loop(self):
+        while True:
+            path = self.queue.get()
+            if path is None:
+                return
+            try:
+                self.verify_path(path)
+            except Exception:
+                log.exception("segment verification failed", extra={"path": str(path)})
+
+    def _track(self, shard_dir):
+        track = self.tracks.get(shard_dir)
+        if track is None:
+            track = video_track(shard_dir / "init.m4s")
+            if track is None:
+                raise ValueError(f"no track in {shard_dir / 'init.m4s'}")
+            # A restarted recorder always starts a new shard, so the init never changes
+            self.tracks[shard_dir] = track
+        return track
+
+    def verify_path(self, path):
+        """Verify a chunk and any earlier numbers of its shard not yet in the index"""
+        relative = path.relative_to(self.root)
+        match = CHUNK_RE.match(path.name)
+        if not match or len(relative.parts) not in (3, 4):
+            # Lower renditions and snapshot links are not indexed
+            return
+        date, camera_guid = relative.parts[0], relative.parts[1]
+        day_dir = self.root / date / camera_guid
+        shard = shard_key(relative.parts[2] if len(relative.parts) == 4 else "")
+        number = int(match.group(1))
+        last = self.last.get((day_dir, shard))
+        if last is None:
+            last = max((r for r in read_index(day_dir) if r.shard == shard), key=lambda r: r.number, default=None)
+        if number <= (last.number if last else 0):
+            return
+        track = self._track(path.parent)
+        records = []
+        previous = last
+        for n in range((last.number if last else 0) + 1, number + 1):
+            start, duration, size, crc, status = verify_segment(path.parent / f"chunk-{n:05d}.m4s", track)
+            if status == MISSING and previous:
+                start = previous.start + previous.duration
+            previous = Segment(shard, n, start, duration, size, crc, status)
+            records.append(previous)
+        append_records(day_dir, records)
+        self.last[(day_dir, shard)] = previous
+        for record in records:
+            if record.status != OK:
+                log.warning("damaged segment", extra={
+                    "camera": camera_guid, "date": date, "shard": shard_name(shard),
+                    "number": record.number, "status": STATUS_NAMES[record.status]})
+                if self.on_damaged:
+                    self.on_damaged(camera_guid, date, record)
+
+def rebuild_day(day_dir):
+    """Verify every chunk of a camera/day from scratch and rewrite its index"""
+    from shards import list_shards
+
+    records = []
+    for shard in list_shards(day_dir):
+        numbers = sorted(int(m.group(1)) for m in map(CHUNK_RE.match, os.listdir(shard["dir"])) if m)
+        if not numbers:
+            continue
+        track = video_track(shard["dir"] / "init.m4s")
+        previous = None
+        for n in range(1, numbers[-1] + 1):
+            start, duration, size, crc, status = verify_segment(shard["dir"] / f"chunk-{n:05d}.m4s", track)
+            if status == MISSING and previous:
+                start = previous.start + previous.duration
+            previous = Segment(shard_key(shard["id"]), n, start, duration, size, crc, status)
+            records.append(previous)
+    write_index(day_dir, records)
+    return records
+
+if __name__ == "__main__":
+    import json
+
+    from ingest import DASH_ROOT
+    from logs import configure_logging
+
+    configure_logging()
+    if len(sys.argv) < 2:
+        print("usage: python integrity.py <date> [camera_guid]")
+        sys.exit(2)
+    date_dir = DASH_ROOT / sys.argv[1]
+    cameras = [date_dir / sys.argv[2]] if len(sys.argv) > 2 else sorted(
+        d for d in date_dir.iterdir() if d.is_dir() and not d.name.endswith("_snapshots"))
+    for camera_dir in cameras:
+        summary = summarize(rebuild_day(camera_dir))
+        print(json.dumps({"camera": camera_dir.name, **summary}))
@@ -0,0 +1,72 @@
+"""Exclusive locks shared between processes (web workers, recorder, CLI tools)"""
+import os
+import time
+
+if os.name == "nt":
+    import msvcrt
+else:
+    import fcntl
+
+# Seconds between attempts while waiting for a lock held elsewhere (Windows)
+LOCK_POLL = 0.05
+
+class FileLock:
+    """An OS lock on a lock file (flock on POSIX, msvcrt.locking on Windows).
+
+    The operating system drops the lock when its holder exits, so a crashed
+    process never leaves a stale lock behind. The lock file itself stays.
+    Each instance is one lock: two instances on the same path exclude each
+    other even within a process.
+    """
+
+    def __init__(self, path):
+        self.path = os.fspath(path)
+        self.fd = None
+
+    def acquire(self, blocking=True):
+        """Take the lock; without ``blocking`` return False at once if it is held"""
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            while True:
+                try:
+                    if os.name == "nt":
+                        msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+                    else:
+                        fcntl.flock(fd, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+                    break
+                except OSError:
+                    if not blocking:
+                        os.close(fd)
+                        return False
+                    time.sleep(LOCK_POLL)
+        except BaseException:
+            os.close(fd)
+            raise
+        self.fd = fd
+        return True
+
+    def release(self):
+        if self.fd is None:
+            return
+        if os.name == "nt":
+            os.lseek(self.fd, 0, os.SEEK_SET)
+            msvcrt.locking(self.fd, msvcrt.LK_UNLCK, 1)
+        os.close(self.fd)
+        self.fd = None
+
+    def is_held(self):
+        """Whether anyone (this instance included) holds the lock right now"""
+        if self.fd is not None:
+            return True
+        probe = FileLock(self.path)
+        if probe.acquire(blocking=False):
+            probe.release()
+            return False
+        return True
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
@@ -0,0 +1,54 @@
+"""Structured logging for the server and the recorder.
+
+Each line is one event with key/value fields: ``logfmt`` (the default) or one
+JSON object per line with VMS_LOG_FORMAT=json. Fields are passed with
+``extra``, e.g. ``log.info("recorder restarted", extra={"camera": guid})``.
+"""
+import json
+import logging
+import os
+import sys
+import time
+
+LOG_FORMAT = os.environ.get("VMS_LOG_FORMAT", "logfmt")
+LOG_LEVEL = os.environ.get("VMS_LOG_LEVEL", "INFO")
+
+# LogRecord attributes that are not user fields
+_RESERVED = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+def _fields(record):
+    fields = {
+        "ts": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(record.created)) + f".{int(record.msecs):03d}",
+        "level": record.levelname.lower(),
+        "logger": record.name,
+        "msg": record.getMessage(),
+    }
+    fields.update({k: v for k, v in vars(record).items() if k not in _RESERVED})
+    if record.exc_info:
+        fields["error"] = logging.Formatter().formatException(record.exc_info)
+    return fields
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        return json.dumps(_fields(record), default=str)
+
+class LogfmtFormatter(logging.Formatter):
+    def format(self, record):
+        parts = []
+        for key, value in _fields(record).items():
+            value = str(value)
+            if not value or any(c in value for c in ' "=\n'):
+                value = json.dumps(value)
+            parts.append(f"{key}={value}")
+        return " ".join(parts)
+
+def configure_logging(fmt=LOG_FORMAT, level=LOG_LEVEL):
+    """Install the structured handler on the root logger (once per process)"""
+    root = logging.getLogger()
+    if any(getattr(h, "_vms", False) for h in root.handlers):
+        return
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(JsonFormatter() if fmt == "json" else LogfmtFormatter())
+    handler._vms = True
+    root.addHandler(handler)
+    root.setLevel(level)
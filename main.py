@@ -6,9 +6,9 @@ import os
 from pathlib import Path
 
 def run_flask_server():
-    """Run the Flask server"""
-    print("Starting Flask server...")
-    server_process = subprocess.Popen([sys.executable, "server.py"])
+    """Run the web server (production mode, see serve.py)"""
+    print("Starting web server...")
+    server_process = subprocess.Popen([sys.executable, "serve.py"])
     return server_process
 
 def run_dash_streams():
@@ -0,0 +1,156 @@
+"""Minimal Prometheus text-format metrics: counters, gauges and histograms.
+
+Kept dependency-free; each process (web worker or recorder) has its own
+registry. Recorder numbers reach the web server's /metrics through the
+recorder status file.
+"""
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+
+# Default latency buckets in seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+def _label_text(names, values):
+    if not names:
+        return ""
+    pairs = ",".join(f'{n}="{str(v).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"'
+                     for n, v in zip(names, values))
+    return "{" + pairs + "}"
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help_text = help_text
+        self.labels = tuple(labels)
+        self.lock = threading.Lock()
+        self.values = {}
+
+    def _key(self, labels):
+        return tuple(labels.get(name, "") for name in self.labels)
+
+    def header(self):
+        return [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.kind}"]
+
+    def render(self):
+        with self.lock:
+            lines = self.header()
+            for key, value in sorted(self.values.items()):
+                lines.append(f"{self.name}{_label_text(self.labels, key)} {value}")
+        return lines
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        with self.lock:
+            self.values[self._key(labels)] = value
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self.lock:
+            counts, total = self.values.get(key, ([0] * (len(self.buckets) + 1), 0.0))
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            self.values[key] = (counts, total + value)
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def render(self):
+        with self.lock:
+            lines = self.header()
+            for key, (counts, total) in sorted(self.values.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets + (float("inf"),), counts):
+                    cumulative += count
+                    le = "+Inf" if bound == float("inf") else repr(bound)
+                    lines.append(f"{self.name}_bucket{_label_text(self.labels + ('le',), key + (le,))} {cumulative}")
+                lines.append(f"{self.name}_sum{_label_text(self.labels, key)} {total}")
+                lines.append(f"{self.name}_count{_label_text(self.labels, key)} {cumulative}")
+        return lines
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, *args, **kwargs):
+        return self.register(Counter(*args, **kwargs))
+
+    def gauge(self, *args, **kwargs):
+        return self.register(Gauge(*args, **kwargs))
+
+    def histogram(self, *args, **kwargs):
+        return self.register(Histogram(*args, **kwargs))
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines += metric.render()
+        return "\n".join(lines) + "\n"
+
+REGISTRY = Registry()
+
+# Per-process fields of the recorder status file exported as gauges
+RECORDER_FIELDS = {
+    "fps": "Frames per second reported by ffmpeg",
+    "speed": "Encoding speed relative to real time",
+    "bitrate_kbps": "Output bitrate reported by ffmpeg in kbit/s",
+    "drop_frames": "Frames dropped by ffmpeg since the recorder started",
+    "dup_frames": "Frames duplicated by ffmpeg since the recorder started",
+    "restarts": "Recorder restarts since the recorder service started",
+    "uptime": "Seconds since the recorder process started",
+    "last_segment_age": "Seconds since the newest segment was written",
+    "last_segment_interval": "Seconds between the last two segments (segment write latency)",
+}
+
+def render_recorder_status(status):
+    """Prometheus lines for the recorder status file written by the supervisor"""
+    lines = []
+    processes = status.get("processes", {})
+    for field, help_text in RECORDER_FIELDS.items():
+        name = f"vms_recorder_{field}"
+        lines += [f"# HELP {name} {help_text}", f"# TYPE {name} gauge"]
+        for process in processes.values():
+            value = process.get(field)
+            if value is None:
+                continue
+            for camera in process.get("cameras", []):
+                lines.append(f"{name}{_label_text(('camera',), (camera,))} {value}")
+    lines += ["# HELP vms_recorder_up Whether the recorder process is running",
+              "# TYPE vms_recorder_up gauge"]
+    for process in processes.values():
+        for camera in process.get("cameras", []):
+            lines.append(f'vms_recorder_up{_label_text(("camera",), (camera,))} '
+                         f'{1 if process.get("state") == "running" else 0}')
+    if "updated_at" in status:
+        lines += ["# HELP vms_recorder_status_age_seconds Age of the recorder status file",
+                  "# TYPE vms_recorder_status_age_seconds gauge",
+                  f"vms_recorder_status_age_seconds {time.time() - status['updated_at']:.1f}"]
+    return "\n".join(lines) + "\n"
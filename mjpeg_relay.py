@@ -0,0 +1,168 @@
+"""Shared MJPEG relay: one upstream connection per camera, fanned out to any number of viewers"""
+import logging
+import threading
+import time
+import urllib.request
+from collections import deque
+
+log = logging.getLogger(__name__)
+
+# Frames kept per camera; viewers always jump to the newest one
+RING_SIZE = 4
+
+# Upstream connections with no viewers are closed after this many seconds
+IDLE_TIMEOUT = 30
+
+# Seconds between reconnect attempts to an unreachable camera
+RECONNECT_DELAY = 5
+
+# Seconds a viewer waits for a new frame before the response is closed
+FRAME_TIMEOUT = 15
+
+# A frame larger than this means the byte stream is not JPEG; resynchronise
+MAX_FRAME_BYTES = 8 * 1024 * 1024
+
+READ_SIZE = 64 * 1024
+
+BOUNDARY = "frame"
+
+SOI = b"\xff\xd8"
+EOI = b"\xff\xd9"
+
+def split_jpeg_frames(buffer):
+    """Cut complete JPEG images (SOI..EOI) out of a byte buffer.
+
+    Returns (frames, rest) where ``rest`` is the incomplete tail to keep for
+    the next read. Multipart headers and boundaries between images are
+    skipped, so this works whatever boundary string the camera uses.
+    """
+    frames = []
+    while True:
+        start = buffer.find(SOI)
+        if start < 0:
+            # Keep a trailing 0xff in case it is the first half of an SOI
+            return frames, buffer[-1:]
+        end = buffer.find(EOI, start + 2)
+        if end < 0:
+            return frames, buffer[start:]
+        frames.append(bytes(buffer[start:end + 2]))
+        buffer = buffer[end + 2:]
+
+def open_camera(camera, timeout=10):
+    """Open a camera's MJPEG URL, answering Basic or Digest auth challenges"""
+    handlers = []
+    if camera.get('username') and camera.get('password'):
+        passwords = urllib.request.HTTPPasswordMgrWithDefaultRealm()
+        passwords.add_password(None, camera['url'], camera['username'], camera['password'])
+        handlers += [urllib.request.HTTPBasicAuthHandler(passwords),
+                     urllib.request.HTTPDigestAuthHandler(passwords)]
+    opener = urllib.request.build_opener(*handlers)
+    request = urllib.request.Request(camera['url'], headers={"User-Agent": "Mozilla/5.0"})
+    return opener.open(request, timeout=timeout)
+
+class MjpegRelay:
+    """Reads one camera's MJPEG stream and broadcasts its frames.
+
+    Frames go into a small ring buffer guarded by a condition variable.
+    Every viewer waits for a sequence number newer than the last one it
+    sent and then takes the newest frame, so a slow viewer skips frames
+    instead of queueing them, and memory does not grow with the number of
+    viewers.
+    """
+
+    def __init__(self, camera, idle_timeout=IDLE_TIMEOUT):
+        self.camera = camera
+        self.idle_timeout = idle_timeout
+        self.frames = deque(maxlen=RING_SIZE)
+        self.sequence = 0
+        self.condition = threading.Condition()
+        self.viewers = 0
+        self.last_viewer_at = time.time()
+        self.thread = None
+
+    def _ensure_running(self):
+        if self.thread is None or not self.thread.is_alive():
+            self.thread = threading.Thread(target=self._run, name=f"mjpeg-{self.camera['guid']}",
+                                           daemon=True)
+            self.thread.start()
+
+    def _idle(self):
+        with self.condition:
+            return self.viewers == 0 and time.time() - self.last_viewer_at > self.idle_timeout
+
+    def _run(self):
+        """Upstream loop: reconnect while anyone is watching, exit once idle"""
+        while not self._idle():
+            try:
+                with open_camera(self.camera) as upstream:
+                    self._read(upstream)
+            except Exception as e:
+                log.warning("mjpeg relay lost its camera", extra={"camera": self.camera['guid'], "error": str(e)})
+                time.sleep(RECONNECT_DELAY)
+        log.info("mjpeg relay closed, no viewers", extra={"camera": self.camera['guid']})
+
+    def _read(self, upstream):
+        buffer = b""
+        while not self._idle():
+            data = upstream.read1(READ_SIZE) if hasattr(upstream, "read1") else upstream.read(READ_SIZE)
+            if not data:
+                raise ConnectionError("stream ended")
+            frames, buffer = split_jpeg_frames(buffer + data)
+            if len(buffer) > MAX_FRAME_BYTES:
+                buffer = b""
+            if frames:
+                with self.condition:
+                    for frame in frames:
+                        self.sequence += 1
+                        self.frames.append(frame)
+                    self.condition.notify_all()
+
+    def stream(self):
+        """multipart/x-mixed-replace body for one viewer"""
+        with self.condition:
+            self.viewers += 1
+        self._ensure_running()
+        last_sequence = 0
+        try:
+            while True:
+                with self.condition:
+                    if not self.condition.wait_for(lambda: self.sequence > last_sequence, FRAME_TIMEOUT):
+                        return
+                    last_sequence = self.sequence
+                    frame = self.frames[-1]
+                yield (f"--{BOUNDARY}\r\nContent-Type: image/jpeg\r\n"
+                       f"Content-Length: {len(frame)}\r\n\r\n").encode() + frame + b"\r\n"
+        finally:
+            with self.condition:
+                self.viewers -= 1
+                self.last_viewer_at = time.time()
+
+class MjpegRelayRegistry:
+    """One relay per camera guid, created on first view"""
+
+    def __init__(self, max_viewers=None):
+        self.relays = {}
+        self.lock = threading.Lock()
+        # Open viewer responses across all cameras, at most max_viewers (None: no limit)
+        self.max_viewers = max_viewers
+        self.viewers = 0
+
+    def open_viewer(self):
+        """Reserve a slot for one viewer; False when max_viewers are watching"""
+        with self.lock:
+            if self.max_viewers is not None and self.viewers >= self.max_viewers:
+                return False
+            self.viewers += 1
+            return True
+
+    def close_viewer(self):
+        with self.lock:
+            self.viewers -= 1
+
+    def get(self, camera):
+        with self.lock:
+            relay = self.relays.get(camera['guid'])
+            if relay is None or relay.camera != camera:
+                relay = MjpegRelay(dict(camera))
+                self.relays[camera['guid']] = relay
+            return relay
@@ -0,0 +1,203 @@
+"""Per-slot motion scores from downscaled frame differences, stored as one small array per day"""
+import logging
+import queue
+import threading
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import numpy as np
+
+from ingest import (MOTION_DIR, MOTION_FILE_NAME, MOTION_FPS, MOTION_HEIGHT, MOTION_SLOT_SECONDS,
+                    MOTION_WIDTH)
+
+log = logging.getLogger(__name__)
+
+# Frames per second the recorder samples, and their size (grayscale); see
+# build_ingest_command
+SAMPLE_FPS = MOTION_FPS
+FRAME_WIDTH = MOTION_WIDTH
+FRAME_HEIGHT = MOTION_HEIGHT
+
+# A pixel changed when its gray level moved by more than this between samples
+PIXEL_THRESHOLD = 25
+
+# The day is divided into slots of this many seconds (one per sample file)
+SLOT_SECONDS = MOTION_SLOT_SECONDS
+SLOTS_PER_DAY = 86400 // SLOT_SECONDS
+
+# motion.u8 holds one byte per slot: 0-254 is the share of changed pixels
+# scaled to 254, NO_DATA marks slots without a recording
+MOTION_FILE = "motion.u8"
+NO_DATA = 255
+
+# Score from which a slot counts as an event
+EVENT_THRESHOLD = 5
+
+QUEUE_SIZE = 1000
+
+# A sample file not written to for this many seconds is complete (the
+# recorder appends a frame every 1 / SAMPLE_FPS seconds while it runs)
+WRITER_IDLE = 2
+
+def read_frames(path):
+    """A raw sample file as an (n, height, width) uint8 array"""
+    data = Path(path).read_bytes()
+    frame_size = FRAME_WIDTH * FRAME_HEIGHT
+    count = len(data) // frame_size
+    return np.frombuffer(data[:count * frame_size], np.uint8).reshape(count, FRAME_HEIGHT, FRAME_WIDTH)
+
+def motion_score(frames):
+    """Largest share of changed pixels between consecutive samples, scaled to 0-254"""
+    if len(frames) < 2:
+        return 0
+    diffs = np.abs(np.diff(frames.astype(np.int16), axis=0)) > PIXEL_THRESHOLD
+    changed = diffs.reshape(len(diffs), -1).mean(axis=1).max()
+    return int(round(changed * 254))
+
+def slot_of(timestamp):
+    """Slot of the day a Unix time falls in (local time)"""
+    current = datetime.fromtimestamp(timestamp)
+    seconds = current.hour * 3600 + current.minute * 60 + current.second
+    return seconds // SLOT_SECONDS
+
+def read_scores(day_dir):
+    """The day's scores as a uint8 array of SLOTS_PER_DAY, NO_DATA where unknown"""
+    path = Path(day_dir) / MOTION_FILE
+    if not path.exists():
+        return np.full(SLOTS_PER_DAY, NO_DATA, np.uint8)
+    return np.fromfile(path, np.uint8, count=SLOTS_PER_DAY)
+
+def write_score(day_dir, slot, score):
+    """Set one slot in place; the file is created filled with NO_DATA"""
+    path = Path(day_dir) / MOTION_FILE
+    if not path.exists():
+        np.full(SLOTS_PER_DAY, NO_DATA, np.uint8).tofile(path)
+    with open(path, "r+b") as f:
+        f.seek(slot)
+        f.write(bytes([min(score, NO_DATA - 1)]))
+
+def slot_time(date, slot):
+    """Unix time at which a slot of ``date`` (local time) starts"""
+    return (datetime.strptime(date, "%Y-%m-%d") + timedelta(seconds=slot * SLOT_SECONDS)).timestamp()
+
+def _slot_in_day(date, timestamp):
+    """Slot of ``timestamp`` clamped to ``date`` (0 before it, SLOTS_PER_DAY after it)"""
+    day = datetime.fromtimestamp(timestamp).strftime("%Y-%m-%d")
+    if day < date:
+        return 0
+    if day > date:
+        return SLOTS_PER_DAY
+    return slot_of(timestamp)
+
+def bucket_scores(scores, bucket):
+    """Maximum score per group of ``bucket`` slots, None where nothing was recorded"""
+    padding = (-len(scores)) % bucket
+    padded = np.concatenate([scores, np.full(padding, NO_DATA, np.uint8)]).reshape(-1, bucket)
+    maxima = np.where(padded == NO_DATA, -1, padded.astype(np.int16)).max(axis=1)
+    return [int(v) if v >= 0 else None for v in maxima]
+
+def _active(scores, threshold):
+    return (scores >= threshold) & (scores != NO_DATA)
+
+def next_event(scores, date, after, threshold=EVENT_THRESHOLD):
+    """Unix time of the first active slot after the one containing ``after``, or None"""
+    start_slot = _slot_in_day(date, after) + 1
+    candidates = np.nonzero(_active(scores[start_slot:], threshold))[0]
+    if not len(candidates):
+        return None
+    return slot_time(date, start_slot + int(candidates[0]))
+
+def active_spans(scores, date, start_time, end_time, threshold=EVENT_THRESHOLD, padding=1):
+    """Merge active slots within [start_time, end_time] into (start, end) Unix ranges.
+
+    ``padding`` slots are added on both sides of every event so clips start
+    a little before the motion and do not cut off its end.
+    """
+    first = _slot_in_day(date, start_time)
+    last = min(_slot_in_day(date, end_time) + 1, SLOTS_PER_DAY)
+    spans = []
+    for index in np.nonzero(_active(scores[first:last], threshold))[0]:
+        slot_start = max(first + int(index) - padding, first)
+        slot_end = min(first + int(index) + 1 + padding, last)
+        if spans and slot_start <= spans[-1][1]:
+            spans[-1][1] = max(spans[-1][1], slot_end)
+        else:
+            spans.append([slot_start, slot_end])
+    return [(max(slot_time(date, s), start_time), min(slot_time(date, e), end_time))
+            for s, e in spans]
+
+class MotionIndexer:
+    """Scores the motion samples the recorders write, in a background thread.
+
+    The ingest command already writes every camera's decoded frames at
+    SAMPLE_FPS as a tiny grayscale image, one file per slot, so nothing is
+    decoded twice. Each closed segment wakes the indexer for its camera:
+    finished sample files are differenced with NumPy, stored as one byte in
+    the camera/day's motion.u8 and deleted.
+    """
+
+    def __init__(self, root, live_root):
+        self.root = Path(root)
+        self.live_root = Path(live_root)
+        self.queue = queue.Queue(maxsize=QUEUE_SIZE)
+        # Sample folder -> its newest frame, compared with the next file's first;
+        # in copy mode only keyframes are decoded, often one or two per slot
+        self.last_frames = {}
+
+    def start(self):
+        threading.Thread(target=self._loop, name="motion", daemon=True).start()
+
+    def stop(self):
+        self.queue.put(None)
+
+    def on_segment(self, path, overlap=False):
+        camera_guid = Path(path).relative_to(self.root).parts[1]
+        try:
+            self.queue.put_nowait(camera_guid)
+        except queue.Full:
+            log.warning("motion indexer is behind, skipping segment", extra={"path": str(path)})
+
+    def _loop(self):
+        while True:
+            camera_guid = self.queue.get()
+            if camera_guid is None:
+                return
+            try:
+                self.index_camera(camera_guid)
+            except Exception:
+                log.exception("motion indexing failed", extra={"camera": camera_guid})
+
+    def index_camera(self, camera_guid, now=None):
+        """Score every finished sample file of a camera; drop folders of runs that ended"""
+        now = now or time.time()
+        motion_dir = self.live_root / camera_guid / MOTION_DIR
+        if not motion_dir.exists():
+            return
+        runs = sorted((d for d in motion_dir.iterdir() if d.is_dir() and d.name.isdigit()),
+                      key=lambda d: int(d.name))
+        for run_dir in runs:
+            files = sorted(run_dir.glob("*.gray"))
+            for path in files:
+                if path == files[-1] and now - path.stat().st_mtime < WRITER_IDLE:
+                    # Still being written
+                    break
+                self.index_file(camera_guid, run_dir, path)
+            if run_dir != runs[-1] and not any(run_dir.iterdir()):
+                run_dir.rmdir()
+                self.last_frames.pop(run_dir, None)
+
+    def index_file(self, camera_guid, run_dir, path):
+        """Score one sample file into the slot it was recorded in, then delete it"""
+        frames = read_frames(path)
+        previous = self.last_frames.get(run_dir)
+        if len(frames):
+            self.last_frames[run_dir] = frames[-1]
+            if previous is not None:
+                frames = np.concatenate([previous[None], frames])
+            # Files are named after the local time they start at, on a slot boundary
+            started_at = datetime.strptime(path.stem, MOTION_FILE_NAME)
+            day_dir = self.root / started_at.strftime("%Y-%m-%d") / camera_guid
+            if day_dir.exists():
+                write_score(day_dir, slot_of(started_at.timestamp()), motion_score(frames))
+        path.unlink()
@@ -0,0 +1,211 @@
+"""Small helpers for reading the DASH manifests written by the recorder"""
+import copy
+import re
+from datetime import datetime
+import xml.etree.ElementTree as ET
+
+NS = {"mpd": "urn:mpeg:dash:schema:mpd:2011"}
+
+ET.register_namespace("", NS["mpd"])
+ET.register_namespace("xsi", "http://www.w3.org/2001/XMLSchema-instance")
+ET.register_namespace("xlink", "http://www.w3.org/1999/xlink")
+
+DURATION_RE = re.compile(
+    r"P(?:(?P<days>\d+(?:\.\d+)?)D)?"
+    r"(?:T(?:(?P<hours>\d+(?:\.\d+)?)H)?(?:(?P<minutes>\d+(?:\.\d+)?)M)?(?:(?P<seconds>\d+(?:\.\d+)?)S)?)?$"
+)
+
+def parse_duration(value):
+    """Convert an ISO 8601 duration such as PT5M29.2S to seconds"""
+    match = DURATION_RE.match(value or "")
+    if not match:
+        return None
+    parts = {k: float(v) for k, v in match.groupdict().items() if v}
+    return (parts.get("days", 0) * 86400 + parts.get("hours", 0) * 3600
+            + parts.get("minutes", 0) * 60 + parts.get("seconds", 0))
+
+def availability_start(manifest_text):
+    """Wall-clock (Unix) start of a live manifest, if it declares one"""
+    root = ET.fromstring(manifest_text)
+    value = root.get("availabilityStartTime")
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(value.replace("Z", "+00:00")).timestamp()
+    except ValueError:
+        return None
+
+def read_timescale(manifest_text):
+    """Timescale of the first SegmentTemplate (media time units per second)"""
+    template = ET.fromstring(manifest_text).find(".//mpd:SegmentTemplate", NS)
+    return int(template.get("timescale", "1")) if template is not None else 1
+
+def read_segment_timeline(manifest_text):
+    """List (number, start, duration) in seconds for the first representation.
+
+    Expands the SegmentTimeline ``<S t d r>`` entries, so segment N's media
+    time is known without opening any chunk.
+    """
+    root = ET.fromstring(manifest_text)
+    template = root.find(".//mpd:SegmentTemplate", NS)
+    if template is None:
+        return []
+    timescale = int(template.get("timescale", "1"))
+    number = int(template.get("startNumber", "1"))
+    segments = []
+    t = 0
+    for s in template.iterfind("mpd:SegmentTimeline/mpd:S", NS):
+        if s.get("t") is not None:
+            t = int(s.get("t"))
+        d = int(s.get("d"))
+        for _ in range(int(s.get("r", "0")) + 1):
+            segments.append((number, t / timescale, d / timescale))
+            number += 1
+            t += d
+    return segments
+
+def manifest_duration(manifest_text):
+    """Total presentation duration in seconds, from the header or the timeline"""
+    root = ET.fromstring(manifest_text)
+    duration = parse_duration(root.get("mediaPresentationDuration"))
+    if duration:
+        return duration
+    segments = read_segment_timeline(manifest_text)
+    if not segments:
+        return None
+    _, start, length = segments[-1]
+    return start + length
+
+def _video_adaptation_sets(root):
+    for adaptation_set in root.iter(f"{{{NS['mpd']}}}AdaptationSet"):
+        content_type = adaptation_set.get("contentType") or adaptation_set.get("mimeType", "")
+        if content_type.startswith("video"):
+            yield adaptation_set
+
+def merge_renditions(manifest_text, renditions_text, prefix="renditions/"):
+    """Add the ladder's lower renditions to the main manifest's video AdaptationSet.
+
+    The recorder writes the top rendition (with audio) and the lower ones as
+    two manifests from the same encoder, so their timelines line up. Each
+    copied Representation keeps its own SegmentTemplate, pointed at
+    ``prefix`` and with its original id baked into the segment names.
+    """
+    root = ET.fromstring(manifest_text)
+    target = next(_video_adaptation_sets(root), None)
+    if target is None:
+        return manifest_text
+    target.set("bitstreamSwitching", "false")
+    for attribute in ("maxWidth", "maxHeight", "width", "height", "par", "sar"):
+        target.attrib.pop(attribute, None)
+    for representation in ET.fromstring(renditions_text).iter(f"{{{NS['mpd']}}}Representation"):
+        original_id = representation.get("id")
+        for template in representation.iter(f"{{{NS['mpd']}}}SegmentTemplate"):
+            for attribute in ("initialization", "media"):
+                value = template.get(attribute)
+                if value:
+                    value = value.replace("$RepresentationID$", original_id)
+                    template.set(attribute, prefix + value.replace("\\", "/").rsplit("/", 1)[-1])
+        representation.set("id", f"r{original_id}")
+        target.append(representation)
+    return ET.tostring(root, encoding="unicode", xml_declaration=True)
+
+def keep_lowest_video(manifest_text):
+    """Drop every video Representation but the smallest one (grid views).
+
+    Height decides rather than bandwidth, which a stream-copied main
+    rendition does not always declare.
+    """
+    root = ET.fromstring(manifest_text)
+    for adaptation_set in _video_adaptation_sets(root):
+        representations = adaptation_set.findall("mpd:Representation", NS)
+        if len(representations) < 2:
+            continue
+        lowest = min(representations, key=lambda r: (int(r.get("height") or 1 << 30),
+                                                     int(r.get("bandwidth") or 0)))
+        for representation in representations:
+            if representation is not lowest:
+                adaptation_set.remove(representation)
+    return ET.tostring(root, encoding="unicode", xml_declaration=True)
+
+def _timeline_entries(template):
+    """(number, t, d) in media time units for every segment of a SegmentTemplate"""
+    number = int(template.get("startNumber", "1"))
+    entries = []
+    t = 0
+    for s in template.iterfind("mpd:SegmentTimeline/mpd:S", NS):
+        if s.get("t") is not None:
+            t = int(s.get("t"))
+        d = int(s.get("d"))
+        for _ in range(int(s.get("r", "0")) + 1):
+            entries.append((number, t, d))
+            number += 1
+            t += d
+    return entries
+
+def _set_timeline(template, entries):
+    """Rewrite a SegmentTemplate to exactly ``entries``, with repeats folded into r"""
+    timeline = template.find("mpd:SegmentTimeline", NS)
+    for s in list(timeline):
+        timeline.remove(s)
+    previous = None
+    for number, t, d in entries:
+        if previous is not None and previous.get("d") == str(d):
+            previous.set("r", str(int(previous.get("r", "0")) + 1))
+            continue
+        attributes = {"d": str(d)} if previous is not None else {"t": str(t), "d": str(d)}
+        previous = ET.SubElement(timeline, f"{{{NS['mpd']}}}S", attributes)
+    template.set("startNumber", str(entries[0][0]))
+    template.set("presentationTimeOffset", str(entries[0][1]))
+
+def mark_gaps(manifest_text, bad_numbers):
+    """Split each Period around segments that must not be requested.
+
+    A $Number$ timeline cannot skip a segment: removing its <S> renumbers
+    everything after it. Each run of good segments becomes its own Period
+    instead, starting at its original media time, so the player jumps the
+    hole and the rest of the timeline keeps its wall-clock position.
+    """
+    bad = set(bad_numbers)
+    root = ET.fromstring(manifest_text)
+    changed = False
+    for period in root.findall("mpd:Period", NS):
+        templates = [t for t in period.iter(f"{{{NS['mpd']}}}SegmentTemplate")
+                     if t.find("mpd:SegmentTimeline", NS) is not None]
+        if not templates:
+            continue
+        timelines = [_timeline_entries(t) for t in templates]
+        runs, run = [], []
+        for number, _, _ in timelines[0]:
+            if number in bad:
+                if run:
+                    runs.append(run)
+                run = []
+            else:
+                run.append(number)
+        if run:
+            runs.append(run)
+        if not runs or len(runs[0]) == len(timelines[0]):
+            continue
+        changed = True
+        position = list(root).index(period)
+        root.remove(period)
+        period_start = parse_duration(period.get("start")) or 0
+        for i, run in enumerate(runs):
+            piece = copy.deepcopy(period)
+            piece.set("id", f"{period.get('id', '0')}-{i}")
+            piece.attrib.pop("duration", None)
+            piece_templates = [t for t in piece.iter(f"{{{NS['mpd']}}}SegmentTemplate")
+                               if t.find("mpd:SegmentTimeline", NS) is not None]
+            for template, entries in zip(piece_templates, timelines):
+                selected = [e for e in entries if run[0] <= e[0] <= run[-1]]
+                if selected:
+                    _set_timeline(template, selected)
+            template = templates[0]
+            first_time = timelines[0][run[0] - timelines[0][0][0]][1]
+            offset = int(template.get("presentationTimeOffset", "0"))
+            start = period_start + (first_time - offset) / int(template.get("timescale", "1"))
+            piece.set("start", f"PT{start:.3f}S")
+            root.insert(position + i, piece)
+    if not changed:
+        return manifest_text
+    return ET.tostring(root, encoding="unicode", xml_declaration=True)
@@ -0,0 +1,200 @@
+"""Retention and tiered storage: evict or move old recording days automatically"""
+import logging
+import shutil
+import threading
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+from snapshots import list_snapshots, snapshot_shards
+
+log = logging.getLogger(__name__)
+
+# Seconds between retention passes
+RETENTION_INTERVAL = 300
+
+# Days fetched back from cold storage stay on the recording disk this long
+FETCHED_BACK_HOLD = 24 * 3600
+
+GB = 1024 ** 3
+
+def referenced_segments(root, camera_guid, date):
+    """Segment paths (relative to the camera/day folder) that reference-mode
+    snapshots still point at.
+
+    Link-mode snapshots own hard links to their segments, so the originals
+    can be deleted; reference-mode snapshots read from the live folder.
+    """
+    keep = set()
+    for snapshot in list_snapshots(root, camera_guid, date):
+        if snapshot.get("mode") != "reference":
+            continue
+        for shard in snapshot_shards(snapshot):
+            prefix = f"{shard['id']}/" if shard["id"] else ""
+            keep.add(f"{prefix}init.m4s")
+            keep.update(f"{prefix}chunk-{n:05d}.m4s" for n in
+                        range(shard["first_segment"], shard["last_segment"] + 1))
+    return keep
+
+class RetentionService:
+    """Applies retention policies from config.json in a background thread.
+
+    Per camera (``camera["retention"]``): ``max_days`` and ``max_gb``.
+    Globally (``config["storage"]``): ``high_water_percent`` /
+    ``low_water_percent`` disk usage marks for the recordings root, and an
+    optional ``cold_root`` plus ``cold_after_days`` to move old days to
+    slower storage instead of keeping them on the recording disk.
+
+    The oldest days go first, today's folder is never touched and segments
+    referenced by snapshots are kept.
+    """
+
+    def __init__(self, root, config_store, catalog, interval=RETENTION_INTERVAL):
+        self.root = Path(root)
+        self.config_store = config_store
+        self.catalog = catalog
+        self.interval = interval
+        self.stop_event = threading.Event()
+
+    def start(self):
+        threading.Thread(target=self._loop, name="retention", daemon=True).start()
+
+    def stop(self):
+        self.stop_event.set()
+
+    def _loop(self):
+        while True:
+            try:
+                self.run_once()
+            except Exception:
+                log.exception("retention pass failed")
+            if self.stop_event.wait(self.interval):
+                return
+
+    def evict_day(self, row):
+        """Delete a camera/day, keeping segments that snapshots reference.
+
+        Returns (bytes removed from the catalog, bytes freed on disk). A file
+        a link-mode snapshot also links to frees nothing when it is deleted.
+        """
+        camera_guid, date = row["camera_guid"], row["date"]
+        day_root = self._tier_root(row)
+        day_dir = day_root / date / camera_guid
+        keep = referenced_segments(self.root, camera_guid, date)
+        removed = freed = 0
+        if day_dir.exists():
+            for path in sorted(day_dir.rglob("*"), reverse=True):
+                if path.relative_to(day_dir).as_posix() in keep:
+                    continue
+                if path.is_file():
+                    stat = path.stat()
+                    removed += stat.st_size
+                    if stat.st_nlink == 1:
+                        freed += stat.st_size
+                    path.unlink()
+                elif path.is_dir():
+                    self._remove_if_empty(path)
+            if not keep:
+                shutil.rmtree(day_dir, ignore_errors=True)
+            self._remove_if_empty(day_root / date)
+        if keep:
+            self.catalog.set_bytes(camera_guid, date, max(row["bytes"] - removed, 0))
+        else:
+            self.catalog.delete_day(camera_guid, date)
+            removed = row["bytes"]
+        log.info("retention evicted day", extra={"camera": camera_guid, "date": date, "freed_gb": round(freed / GB, 2)})
+        return removed, freed
+
+    def move_to_cold(self, row, cold_root):
+        """Move a camera/day to the cold storage root"""
+        camera_guid, date = row["camera_guid"], row["date"]
+        if referenced_segments(self.root, camera_guid, date):
+            # Reference-mode snapshots read from the hot folder
+            return 0
+        source = self.root / date / camera_guid
+        if not source.exists():
+            return 0
+        target = cold_root / date / camera_guid
+        target.parent.mkdir(parents=True, exist_ok=True)
+        shutil.move(str(source), str(target))
+        self._remove_if_empty(self.root / date)
+        self.catalog.set_tier(camera_guid, date, "cold")
+        log.info("retention moved day to cold storage", extra={"camera": camera_guid, "date": date})
+        return row["bytes"]
+
+    def _tier_root(self, row):
+        if row.get("tier") == "cold":
+            cold_root = self.config_store.load().get("storage", {}).get("cold_root")
+            if cold_root:
+                return Path(cold_root)
+        return self.root
+
+    @staticmethod
+    def _remove_if_empty(date_dir):
+        try:
+            date_dir.rmdir()
+        except OSError:
+            pass
+
+    def run_once(self):
+        """One retention pass over the catalog"""
+        config = self.config_store.load()
+        storage = config.get("storage", {})
+        # A hand-edited config.json may hold anything here; ignore what is not a policy
+        policies = {c["guid"]: c["retention"] for c in config["cameras"] if isinstance(c.get("retention"), dict)}
+        today = datetime.now().strftime("%Y-%m-%d")
+        rows = [r for r in self.catalog.list_days() if r["date"] < today]
+        evicted = set()
+
+        # Per-camera age and size limits
+        totals = {}
+        for row in self.catalog.list_days():
+            totals[row["camera_guid"]] = totals.get(row["camera_guid"], 0) + row["bytes"]
+        for row in rows:
+            policy = policies.get(row["camera_guid"], {})
+            max_days = policy.get("max_days")
+            max_gb = policy.get("max_gb")
+            too_old = max_days and row["date"] < (datetime.now() - timedelta(days=max_days)).strftime("%Y-%m-%d")
+            too_big = max_gb and totals[row["camera_guid"]] > max_gb * GB
+            if too_old or too_big:
+                totals[row["camera_guid"]] -= self.evict_day(row)[0]
+                evicted.add((row["camera_guid"], row["date"]))
+
+        # Move cold days off the recording disk
+        cold_root = storage.get("cold_root")
+        cold_after_days = storage.get("cold_after_days")
+        if cold_root and cold_after_days:
+            cutoff = (datetime.now() - timedelta(days=cold_after_days)).strftime("%Y-%m-%d")
+            for row in rows:
+                key = (row["camera_guid"], row["date"])
+                recently_fetched = time.time() - row["updated_at"] < FETCHED_BACK_HOLD
+                if key not in evicted and row["tier"] == "hot" and row["date"] < cutoff and not recently_fetched:
+                    self.move_to_cold(row, Path(cold_root))
+
+        # Global high-water mark on the recording disk: evict oldest hot days
+        high_water = storage.get("high_water_percent")
+        if high_water and self.root.exists():
+            low_water = storage.get("low_water_percent", high_water - 5)
+            usage = shutil.disk_usage(self.root)
+            used = usage.used
+            if used / usage.total * 100 > high_water:
+                for row in self.catalog.list_days():
+                    if used / usage.total * 100 <= low_water:
+                        break
+                    if row["date"] >= today or row["tier"] != "hot":
+                        continue
+                    used -= self.evict_day(row)[1]
+
+def fetch_back(root, cold_root, camera_guid, date, catalog=None):
+    """Copy a cold camera/day back to the recording disk for playback"""
+    source = Path(cold_root) / date / camera_guid
+    target = Path(root) / date / camera_guid
+    if not source.exists() or target.exists():
+        return
+    partial = target.with_name(f".{camera_guid}.fetching")
+    shutil.copytree(source, partial, dirs_exist_ok=True)
+    partial.rename(target)
+    shutil.rmtree(source, ignore_errors=True)
+    if catalog:
+        catalog.set_tier(camera_guid, date, "hot")
+    log.info("fetched day back from cold storage", extra={"camera": camera_guid, "date": date})
@@ -0,0 +1,42 @@
+"""Production launcher for the web server (multi-threaded waitress, no debugger)"""
+import logging
+import os
+
+from waitress import serve
+
+from logs import configure_logging
+from server import MAX_EVENT_STREAMS, MAX_MJPEG_VIEWERS, app
+
+HOST = os.environ.get("VMS_HOST", "0.0.0.0")
+PORT = int(os.environ.get("VMS_PORT", "5000"))
+
+# Threads for ordinary requests; segment serving and page loads share these
+REQUEST_THREADS = 16
+
+# Worker threads in total: every open /events or export progress stream holds
+# one for as long as the page is open, up to MAX_EVENT_STREAMS of them, and
+# every MJPEG viewer one while it watches, up to MAX_MJPEG_VIEWERS
+THREADS = int(os.environ.get("VMS_THREADS", str(REQUEST_THREADS + MAX_EVENT_STREAMS + MAX_MJPEG_VIEWERS)))
+
+# Bytes waitress buffers for a slow client before the response blocks. Kept
+# to a few frames so an MJPEG viewer that falls behind stalls its generator
+# and skips frames, instead of the server queueing 16 MB (the default) per viewer
+OUTBUF_HIGH_WATERMARK = 512 * 1024
+
+# Open connections accepted before new ones queue in the OS backlog
+CONNECTION_LIMIT = int(os.environ.get("VMS_CONNECTION_LIMIT", "500"))
+
+if __name__ == "__main__":
+    configure_logging()
+    logging.getLogger("serve").info("serving", extra={"url": f"http://{HOST}:{PORT}", "threads": THREADS,
+                                                     "max_event_streams": MAX_EVENT_STREAMS,
+                                                     "max_mjpeg_viewers": MAX_MJPEG_VIEWERS})
+    serve(
+        app,
+        host=HOST,
+        port=PORT,
+        threads=THREADS,
+        connection_limit=CONNECTION_LIMIT,
+        channel_timeout=120,
+        outbuf_high_watermark=OUTBUF_HIGH_WATERMARK,
+    )
@@ -1,18 +1,38 @@
-from flask import Flask, Response, render_template, send_from_directory, request, redirect, url_for, send_file
+from flask import Flask, Response, g, render_template, request, redirect, url_for, send_file, jsonify
 from flask_cors import CORS
 import os
 import json
+import logging
 from pathlib import Path
-from urllib.parse import urlparse
 from datetime import datetime
 import uuid
-import subprocess
 import threading
-import shutil
+import time
 import re
 import requests
+from werkzeug.security import safe_join
+
+from cameras import MAX_CAMERA_BATCH, CameraBatchError, apply_camera_batch, public_camera
+from catalog import RecordingCatalog
+from config_store import ConfigStore, CONFIG_FILE
+from cluster import CLUSTER_DB, NODE_ID, ClusterCatalog
+from clips import find_clip_segments, locate, shard_anchor, stream_clip, stream_multi_shard_clip
+from dash_serving import COLD_SENDFILE_PREFIX, send_dash_file, send_live_file
+from events import KEEPALIVE_INTERVAL, POLL_INTERVAL, EventBus, RecorderWatcher
+from exports import ExportManager
+from mjpeg_relay import BOUNDARY, MjpegRelayRegistry
+import integrity
+import motion
+import snapshots
+from retention import fetch_back
+from snapshots import list_snapshots
+from ingest import current_live_dir, DEFAULT_CODEC_MODE, DASH_ROOT, LIVE_ROOT, THUMBNAIL_INTERVAL
+from logs import configure_logging
+from metrics import REGISTRY, render_recorder_status
+from shards import list_shards
 
 app = Flask(__name__)
+log = logging.getLogger("server")
 # Configure CORS to allow all origins
 CORS(app, resources={r"/*": {
     "origins": "*",
@@ -35,203 +55,267 @@ def add_security_headers(response):
     response.headers['Cross-Origin-Opener-Policy'] = 'same-origin'
     return response
 
-# Directory where DASH videos are stored
-DASH_VIDEOS_DIR = Path("dashvideos")
-CONFIG_FILE = "config.json"
+# Request latency (until the handler returns; streamed bodies keep going) and
+# bytes sent, per Flask endpoint
+request_duration = REGISTRY.histogram("vms_request_duration_seconds", "Time spent in the request handler", ("route",))
+response_bytes = REGISTRY.counter("vms_response_bytes_total", "Response body bytes sent", ("route",))
+request_count = REGISTRY.counter("vms_requests_total", "Requests handled", ("route", "status"))
+catalog_duration = REGISTRY.histogram("vms_catalog_query_seconds", "Recordings catalog query time", ("query",))
 
-def load_config():
-    """Load camera configuration from JSON file"""
-    if os.path.exists(CONFIG_FILE):
-        with open(CONFIG_FILE, 'r') as f:
-            return json.load(f)
-    return {"cameras": []}
+# Per-camera ffmpeg health written by start_dash_streams.py, exported on /metrics
+RECORDER_STATUS_FILE = "recorder_status.json"
 
-def save_config(config):
-    """Save camera configuration to JSON file"""
-    with open(CONFIG_FILE, 'w') as f:
-        json.dump(config, f, indent=4)
-
-def get_camera_url(camera):
-    """Get camera URL with authentication if needed"""
-    url = camera['url']
-    if camera.get('username') and camera.get('password'):
-        parsed = urlparse(url)
-        auth = f"{camera['username']}:{camera['password']}"
-        return f"{parsed.scheme}://{auth}@{parsed.netloc}{parsed.path}"
-    return url
-
-def get_dash_output_dir(camera_guid):
-    """Get the output directory for DASH files"""
-    # Get current date
-    date_str = datetime.now().strftime("%Y-%m-%d")
-    output_dir = Path("E:/bala/version1/dashvideos") / date_str / camera_guid
-    
-    # Create directory if it doesn't exist
-    output_dir.mkdir(parents=True, exist_ok=True)
-    
-    # Check if we need to create a new date folder
-    current_time = datetime.now()
-    if current_time.hour == 0 and current_time.minute < 5:  # Check if it's just after midnight
-        # Create new date folder
-        new_date_str = current_time.strftime("%Y-%m-%d")
-        new_output_dir = Path("E:/bala/version1/dashvideos") / new_date_str / camera_guid
-        new_output_dir.mkdir(parents=True, exist_ok=True)
-        return new_output_dir
-    
-    return output_dir
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
 
-def start_dash_stream(camera):
-    """Start DASH streaming for a camera"""
-    output_dir = get_dash_output_dir(camera['guid'])
-    output_path = output_dir / "manifest.mpd"
-    
-    # Add headers for MJPEG stream
-    headers = {
-        'User-Agent': 'Mozilla/5.0',
-        'Accept': '*/*',
-        'Connection': 'keep-alive',
-        'Referer': 'http://192.168.1.19:56000/',
-        'Origin': 'http://192.168.1.19:56000'
-    }
-    
-    cmd = [
-        "ffmpeg",
-        "-headers", f"User-Agent: Mozilla/5.0\r\nAccept: */*\r\nConnection: keep-alive\r\nReferer: http://192.168.1.19:56000/\r\nOrigin: http://192.168.1.19:56000\r\n",
-        "-i", camera["url"],
-        "-c:v", "libx264",
-        "-preset", "fast",
-        "-crf", "22",
-        "-b:v", "2M",
-        "-maxrate", "2M",
-        "-bufsize", "1M",
-        "-g", "48",
-        "-keyint_min", "48",
-        "-c:a", "aac",
-        "-b:a", "128k",
-        "-f", "dash",
-        "-seg_duration", "4",
-        "-frag_duration", "4",
-        "-init_seg_name", f"{output_dir}/init.m4s",
-        "-media_seg_name", f"{output_dir}/chunk-$Number%05d$.m4s",
-        "-use_timeline", "1",
-        "-use_template", "1",
-        "-ldash", "1",
-        "-streaming", "1",
-        "-remove_at_exit", "0",
-        "-write_prft", "1",
-        "-target_latency", "3",
-        "-ignore_io_errors", "1",
-        "-flags", "+global_header",
-        "-window_size", "0",
-        "-extra_window_size", "0",
-        "-dash_segment_type", "mp4",
-        "-dash_playlist_type", "event",
-        "-index_correction", "0",
-        str(output_path)
-    ]
-    
-    print(f"Starting stream for {camera['name']} ({camera['guid']}) -> {output_path}")
-    process = subprocess.Popen(cmd)
-    return process
+def _count_bytes(body, route):
+    """Pass a streamed body through, counting its bytes as they are sent"""
+    try:
+        for chunk in body:
+            response_bytes.inc(len(chunk), route=route)
+            yield chunk
+    finally:
+        close = getattr(body, "close", None)
+        if close:
+            close()
+
+@app.after_request
+def record_request_metrics(response):
+    route = request.endpoint or "unmatched"
+    started = g.get("request_started")
+    if started is not None:
+        request_duration.observe(time.perf_counter() - started, route=route)
+    request_count.inc(route=route, status=response.status_code)
+    if response.content_length is not None:
+        response_bytes.inc(response.content_length, route=route)
+    elif response.is_streamed and not response.direct_passthrough:
+        response.response = _count_bytes(response.response, route)
+    return response
+
+# Camera configuration, cached in memory and reloaded when config.json changes
+config_store = ConfigStore(CONFIG_FILE)
+
+# Recordings index maintained by the recorder
+catalog = RecordingCatalog(root=DASH_ROOT)
+
+# Multi-node mode (see cluster.py): recordings are listed from the shared
+# catalog and requests for data held by another node are redirected there
+cluster = ClusterCatalog(CLUSTER_DB) if CLUSTER_DB else None
+recordings_catalog = cluster or catalog
+RECORDINGS_PER_PAGE = 50
+
+# Exports running at once, across every web process sharing EXPORTS_DIR;
+# they run on their own worker pool so request threads stay free for pages
+# and segment serving
+MAX_CONCURRENT_EXPORTS = int(os.environ.get("VMS_MAX_EXPORTS", "2"))
+EXPORTS_DIR = DASH_ROOT.parent / "exports"
+export_manager = ExportManager(DASH_ROOT, EXPORTS_DIR, max_workers=MAX_CONCURRENT_EXPORTS)
+
+# Seconds between rereads of an export's state file by its progress stream
+EXPORT_STATE_POLL = 1
+
+# Open MJPEG viewers per web process; each holds a server thread for as long
+# as it watches (see serve.py), further viewers get a 503
+MAX_MJPEG_VIEWERS = int(os.environ.get("VMS_MAX_MJPEG_VIEWERS", "20"))
+
+# Shared upstream connections for the legacy MJPEG endpoint
+mjpeg_relays = MjpegRelayRegistry(max_viewers=MAX_MJPEG_VIEWERS)
+
+# Open /events and export progress streams per web process; each holds a
+# server thread (see serve.py), further pages poll /api/events instead
+MAX_EVENT_STREAMS = int(os.environ.get("VMS_MAX_EVENT_STREAMS", "100"))
 
-# Store running processes
-running_processes = {}
+# Shared by every /events stream: one watcher thread feeds all open pages
+event_bus = EventBus(max_streams=MAX_EVENT_STREAMS)
+recorder_events = RecorderWatcher(event_bus, RECORDER_STATUS_FILE, recordings_catalog, config_store)
+export_manager.listeners.append(lambda job: event_bus.publish('export', job.to_dict()))
 
-def get_recordings_by_camera():
-    """Get recordings organized by camera and date, excluding snapshot directories"""
+def load_config():
+    """Load camera configuration (cached; reloaded only when config.json changes)"""
+    return config_store.load()
+
+def save_config(config):
+    """Atomically save camera configuration to config.json"""
+    config_store.save(config)
+
+def get_recordings_by_camera(page=1, per_page=RECORDINGS_PER_PAGE):
+    """Get one page of recordings from the catalog, grouped by date"""
     recordings = {}
-    if DASH_VIDEOS_DIR.exists():
-        for camera_dir in DASH_VIDEOS_DIR.iterdir():
-            if camera_dir.is_dir() and not camera_dir.name.endswith('_snapshots'):
-                camera_guid = camera_dir.name
-                recordings[camera_guid] = {}
-                for date_dir in camera_dir.iterdir():
-                    if date_dir.is_dir() and not date_dir.name.endswith('_snapshots'):
-                        date = date_dir.name
-                        recordings[camera_guid][date] = []
-                        for mpd_file in date_dir.glob('manifest.mpd'):
-                            recordings[camera_guid][date].append(mpd_file.name)
+    with catalog_duration.time(query="list_recordings"):
+        rows = recordings_catalog.list_recordings(page=page, per_page=per_page)
+    for row in rows:
+        recordings.setdefault(row['date'], []).append(row)
     return recordings
 
+def redirect_to_node(node_id):
+    """Redirect this request to another recorder node; None when it is served here"""
+    if cluster is None or node_id is None or node_id == NODE_ID:
+        return None
+    url = cluster.node_url(node_id)
+    if not url:
+        return None
+    return redirect(url.rstrip('/') + request.full_path.rstrip('?'), code=307)
+
+def recording_node(camera_guid, date, shard=None, at=None):
+    """Node holding a camera/day (or one shard of it) in multi-node mode"""
+    return cluster.locate(camera_guid, date, shard, at) if cluster else None
+
 def get_camera_name_by_guid(guid):
     """Get camera name from GUID"""
-    config = load_config()
-    for camera in config['cameras']:
-        if camera['guid'] == guid:
-            return camera['name']
-    return guid
+    camera = config_store.get_camera(guid)
+    return camera['name'] if camera else guid
 
 @app.route('/')
 def index():
     """Main page with both live and recorded video players"""
     config = load_config()
-    recordings = get_recordings_by_camera()
+    page = max(request.args.get('page', 1, type=int), 1)
+    recordings = get_recordings_by_camera(page=page)
+    with catalog_duration.time(query="count_recordings"):
+        total = recordings_catalog.count_recordings()
     
+    # Live tiles are offered only for cameras with a lower rendition to play
+    profiles = config.get('profiles', {})
+    low_rendition = {c['guid'] for c in config['cameras'] if len(profiles.get(c.get('profile')) or ()) > 1}
     return render_template('index.html', 
                          recordings=recordings,
                          cameras=config['cameras'],
-                         get_camera_name=get_camera_name_by_guid)
+                         low_rendition=low_rendition,
+                         thumbnail_interval=THUMBNAIL_INTERVAL,
+                         camera_names={c['guid']: c['name'] for c in config['cameras']},
+                         page=page,
+                         has_next=page * RECORDINGS_PER_PAGE < total)
+
+@app.route('/api/recordings')
+def api_recordings():
+    """Paginated JSON listing of recorded camera/days"""
+    page = max(request.args.get('page', 1, type=int), 1)
+    per_page = min(max(request.args.get('per_page', RECORDINGS_PER_PAGE, type=int), 1), 500)
+    camera_guid = request.args.get('camera')
+    with catalog_duration.time(query="count_recordings"):
+        total = recordings_catalog.count_recordings(camera_guid)
+    with catalog_duration.time(query="list_recordings"):
+        recordings = recordings_catalog.list_recordings(page, per_page, camera_guid)
+    return jsonify({
+        'page': page,
+        'per_page': per_page,
+        'total': total,
+        'recordings': recordings,
+    })
 
 @app.route('/live/<int:camera_index>')
 def live(camera_index):
-    """Live MJPEG stream for specific camera"""
+    """Live view of a camera, played from the recorder's low-latency DASH output"""
     config = load_config()
     if 0 <= camera_index < len(config['cameras']):
         camera = config['cameras'][camera_index]
+        # Only the name and guid reach the page; the camera URL and credentials stay here
         return render_template('live.html', 
-                             camera=camera,
-                             camera_url=get_camera_url(camera))
+                             camera_name=camera['name'],
+                             camera_guid=camera['guid'],
+                             camera_index=camera_index)
     return redirect(url_for('index'))
 
+@app.route('/live/<int:camera_index>/mjpeg')
+def live_mjpeg(camera_index):
+    """MJPEG for legacy clients, relayed from one shared upstream connection per camera"""
+    config = load_config()
+    if not 0 <= camera_index < len(config['cameras']):
+        return "Unknown camera", 404
+    if not mjpeg_relays.open_viewer():
+        return "Too many MJPEG viewers", 503, {'Retry-After': '30'}
+    relay = mjpeg_relays.get(config['cameras'][camera_index])
+    response = Response(relay.stream(),
+                        mimetype=f'multipart/x-mixed-replace; boundary={BOUNDARY}',
+                        headers={'Cache-Control': 'no-store', 'X-Accel-Buffering': 'no'})
+    # Runs when the server closes the response, even if no frame was sent
+    response.call_on_close(mjpeg_relays.close_viewer)
+    return response
+
+@app.route('/livedash/<camera_guid>/<path:filename>')
+def serve_live(camera_guid, filename):
+    """Serve the live manifest, its segments (streamed while still being written) and the thumbnail"""
+    if safe_join(str(LIVE_ROOT), camera_guid) is None:
+        return "Unknown camera", 404
+    moved = redirect_to_node(cluster.lease_holder(camera_guid) if cluster else None)
+    if moved:
+        return moved
+    if filename == "thumb.jpg":
+        return send_dash_file(LIVE_ROOT / camera_guid, filename, cache_control="no-cache", offload=False)
+    live_dir = current_live_dir(camera_guid)
+    if live_dir is None:
+        return "Camera is not recording", 404
+    return send_live_file(live_dir, filename, lowest=request.args.get('rendition') == 'lowest')
+
 @app.route('/config')
 def config_page():
     """Camera configuration page"""
     config = load_config()
-    return render_template('config.html', cameras=config['cameras'])
+    return render_template('config.html', cameras=config['cameras'],
+                         profiles=sorted(config.get('profiles', {})))
 
 @app.route('/config/save', methods=['POST'])
 def save_camera():
-    """Save new camera configuration and start streaming"""
-    config = load_config()
+    """Save new camera configuration; the recorder starts streaming it"""
     new_camera = {
         'name': request.form['name'],
         'guid': f"cam_{str(uuid.uuid4())[:8]}",  # Generate unique GUID
         'url': request.form['url'],
         'username': request.form.get('username', ''),
-        'password': request.form.get('password', '')
+        'password': request.form.get('password', ''),
+        'codec_mode': request.form.get('codec_mode', DEFAULT_CODEC_MODE)
     }
-    config['cameras'].append(new_camera)
-    save_config(config)
-    
-    # Start DASH streaming in a separate thread
-    def start_stream():
-        process = start_dash_stream(new_camera)
-        running_processes[new_camera['guid']] = process
-    
-    threading.Thread(target=start_stream).start()
+    if request.form.get('profile'):
+        new_camera['profile'] = request.form['profile']
+    config_store.update(lambda config: config['cameras'].append(new_camera))
+    # The recorder picks up the new camera from config.json and starts ingest
     
     return redirect(url_for('config_page'))
 
 @app.route('/config/delete', methods=['POST'])
 def delete_camera():
-    """Delete camera configuration and stop streaming"""
-    config = load_config()
+    """Delete camera configuration; the recorder stops streaming it"""
     index = int(request.form['index'])
-    if 0 <= index < len(config['cameras']):
-        camera = config['cameras'][index]
-        # Stop the DASH stream if it's running
-        if camera['guid'] in running_processes:
-            process = running_processes[camera['guid']]
-            process.terminate()
-            try:
-                process.wait(timeout=5)
-            except subprocess.TimeoutExpired:
-                process.kill()
-            del running_processes[camera['guid']]
-        config['cameras'].pop(index)
-        save_config(config)
+
+    def remove(config):
+        if 0 <= index < len(config['cameras']):
+            # The recorder notices the removal and stops the camera's ingest
+            config['cameras'].pop(index)
+
+    config_store.update(remove)
     return redirect(url_for('config_page'))
 
+@app.route('/api/cameras')
+def api_cameras():
+    """Configured cameras (without passwords)"""
+    return jsonify({'cameras': [public_camera(c) for c in load_config()['cameras']]})
+
+@app.route('/api/cameras/bulk', methods=['POST'])
+def api_cameras_bulk():
+    """Add, update and delete many cameras in one config.json write.
+
+    Body: {"upsert": [{"guid"?, "name", "url", ...}, ...], "delete": [guid, ...]}.
+    The recorder restarts only the sources whose URL, codec mode, profile or
+    camera set changed, and starts new ones gradually (recorder.start_rate).
+    """
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({'error': 'a JSON object body is required'}), 400
+    upsert, delete = data.get('upsert', []), data.get('delete', [])
+    if not isinstance(upsert, list) or not isinstance(delete, list):
+        return jsonify({'error': 'upsert and delete must be lists'}), 400
+    if not all(isinstance(guid, str) for guid in delete):
+        return jsonify({'error': 'delete must list camera guids'}), 400
+    if len(upsert) + len(delete) > MAX_CAMERA_BATCH:
+        return jsonify({'error': f'at most {MAX_CAMERA_BATCH} entries per batch'}), 400
+    try:
+        summary = config_store.update(lambda config: apply_camera_batch(config, upsert, delete))
+    except CameraBatchError as e:
+        return jsonify({'error': str(e), 'entries': e.errors}), 400
+    log.info("bulk camera update", extra={k: len(v) for k, v in summary.items()})
+    return jsonify(summary)
+
 def modify_mpd_paths(mpd_content):
     """Modify MPD file to use relative paths"""
     # Replace absolute paths with relative paths
@@ -249,124 +333,404 @@ def modify_mpd_paths(mpd_content):
 
 @app.route('/recorded/<camera_guid>/<date>/<path:filename>')
 def recorded(camera_guid, date, filename):
-    """Serve recorded DASH video and create a snapshot of the MPD if requested"""
-    base_dir = Path("E:/bala/version1/dashvideos")
-    source_dir = base_dir / date / camera_guid
-    
-    if filename == "manifest.mpd":
-        # Create manifestsnapshot.mpd in the same location as manifest.mpd
-        source_manifest = source_dir / "manifest.mpd"
-        snapshot_manifest = source_dir / "manifestsnapshot.mpd"
-        
-        # Copy the manifest file if it exists
-        if source_manifest.exists():
-            try:
-                shutil.copy2(source_manifest, snapshot_manifest)
-                print(f"Created snapshot at: {snapshot_manifest}")
-            except Exception as e:
-                print(f"Error creating snapshot: {e}")
-        else:
-            print(f"Warning: Source manifest not found at {source_manifest}")
-    
+    """Play a recorded DASH video; a day's manifest.mpd opens its latest hourly shard"""
+    moved = redirect_to_node(recording_node(camera_guid, date, filename.split("/", 1)[0] if "/" in filename else None))
+    if moved:
+        return moved
+    all_shards = list_shards(recording_dir(camera_guid, date))
+    shards = [s for s in all_shards if s["id"]]
+    if filename == "manifest.mpd" and shards:
+        filename = f"{shards[-1]['id']}/manifest.mpd"
+    current_shard = filename.split("/", 1)[0]
+    current = next((s for s in all_shards if s["id"] in (current_shard, "")), None)
     return render_template('recorded.html', 
-                         video_path=f"{camera_guid}/{date}/{filename}",
+                         video_path=f"{date}/{camera_guid}/{filename}",
+                         camera_guid=camera_guid,
+                         camera_name=get_camera_name_by_guid(camera_guid),
+                         date=date,
+                         shards=shards,
+                         current_shard=current_shard,
+                         # Wall-clock time at player time 0, for the motion timeline
+                         shard_anchor=shard_anchor(current) if current else None,
+                         snapshots=list_snapshots(DASH_ROOT, camera_guid, date))
+
+@app.route('/snapshots/<camera_guid>/<date>/<snapshot_id>')
+def play_snapshot(camera_guid, date, snapshot_id):
+    """Play a frozen snapshot of a recording"""
+    moved = redirect_to_node(recording_node(camera_guid, date))
+    if moved:
+        return moved
+    return render_template('recorded.html',
+                         video_path=f"{date}/{camera_guid}_snapshots/manifest_{snapshot_id}.mpd",
+                         camera_guid=camera_guid,
                          camera_name=get_camera_name_by_guid(camera_guid),
-                         date=date)
+                         date=date,
+                         is_snapshot=True,
+                         snapshots=list_snapshots(DASH_ROOT, camera_guid, date))
 
 @app.route('/download_mp4/<date>/<camera_guid>')
 def download_mp4(date, camera_guid):
-    """Convert DASH video to MP4 and provide download"""
-    base_dir = Path("E:/bala/version1/dashvideos")
-    source_dir = base_dir / date / camera_guid
-    output_mp4 = source_dir / f"{camera_guid}_{date}.mp4"
+    """Start (or reuse) an MP4 export and show its progress until it can be downloaded"""
+    moved = redirect_to_node(recording_node(camera_guid, date))
+    if moved:
+        return moved
+    try:
+        job = submit_export(camera_guid, date)
+    except FileNotFoundError:
+        return "Manifest file not found", 404
+    if job.status == "done":
+        return redirect(url_for('download_export', job_id=job.id))
+    return render_template('export.html',
+                         job=job.to_dict(),
+                         camera_name=get_camera_name_by_guid(camera_guid))
+
+@app.route('/exports', methods=['POST'])
+def create_export():
+    """Queue an export: JSON or form body with camera and date"""
+    data = request.get_json(silent=True) or request.form
+    camera_guid, date = data.get('camera'), data.get('date')
+    if not camera_guid or not date:
+        return jsonify({'error': 'camera and date are required'}), 400
+    moved = redirect_to_node(recording_node(camera_guid, date))
+    if moved:
+        return moved
+    try:
+        job = submit_export(camera_guid, date)
+    except FileNotFoundError as e:
+        return jsonify({'error': str(e)}), 404
+    return jsonify(job.to_dict()), 202, {'Location': url_for('export_status', job_id=job.id)}
+
+@app.route('/exports/<job_id>')
+def export_status(job_id):
+    """Poll an export job"""
+    job = export_manager.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown export'}), 404
+    return jsonify(job.to_dict())
+
+@app.route('/exports/<job_id>/events')
+def export_events(job_id):
+    """Server-Sent Events stream of an export's progress until it finishes"""
+    job = export_manager.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown export'}), 404
+
+    # Subscribe before reading the state so no update in between is missed.
+    # A job another web process runs publishes no events here, only its
+    # state file, so the stream also rereads the state between events.
+    updates = event_bus.listen(kinds={'export'}, timeout=EXPORT_STATE_POLL)
+
+    def stream():
+        if not event_bus.open_stream():
+            updates.close()
+            yield f"data: {json.dumps(job.to_dict())}\n\n"
+            # Too many open streams: the page polls export_status instead
+            yield f"event: poll\ndata: {json.dumps({'interval': POLL_INTERVAL})}\n\n"
+            return
+        try:
+            sent = job.to_dict()
+            sent_at = time.time()
+            yield f"data: {json.dumps(sent)}\n\n"
+            if sent['status'] in ('done', 'failed'):
+                return
+            for event in updates:
+                if event is None or event[1] == 'resync':
+                    state = (export_manager.get(job.id) or job).to_dict()
+                else:
+                    state = event[2] if event[2]['id'] == job.id else sent
+                if state != sent:
+                    sent, sent_at = state, time.time()
+                    yield f"data: {json.dumps(state)}\n\n"
+                    if state['status'] in ('done', 'failed'):
+                        return
+                elif time.time() - sent_at >= KEEPALIVE_INTERVAL:
+                    sent_at = time.time()
+                    yield ": keep-alive\n\n"
+        finally:
+            updates.close()
+            event_bus.close_stream()
+
+    return Response(stream(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/events')
+def events():
+    """Server-Sent Events: camera state, segment ticks, export progress and new recordings.
+
+    ``types`` limits the stream to some of camera, segment, export,
+    recording and config; reconnecting clients resume from Last-Event-ID.
+    """
+    kinds = {k for k in request.args.get('types', '').split(',') if k} or None
+    recorder_events.ensure_running()
+    return Response(event_bus.stream(request.headers.get('Last-Event-ID', type=int), kinds,
+                                     initial=recorder_events.snapshot()),
+                    mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/api/events')
+def api_events():
+    """The /events feed for polling pages: events after ``after`` as JSON, without waiting.
+
+    Without ``after`` the answer carries the current camera states and the
+    id to poll from. ``resync`` is true when events were missed.
+    """
+    kinds = {k for k in request.args.get('types', '').split(',') if k} or None
+    after = request.args.get('after', type=int)
+    recorder_events.ensure_running()
+    last_id, found, lost = event_bus.since(after, kinds)
+    events = [{'id': None, 'kind': kind, 'data': data} for kind, data in recorder_events.snapshot()
+              if after is None and (kinds is None or kind in kinds)]
+    events += [{'id': event_id, 'kind': kind, 'data': data} for event_id, kind, data in found]
+    return jsonify({'last_id': last_id, 'events': events, 'resync': lost,
+                    'interval': POLL_INTERVAL})
+
+@app.route('/exports/<job_id>/download')
+def download_export(job_id):
+    """Download a finished export"""
+    job = export_manager.get(job_id)
+    if job is None or job.status != 'done':
+        return "Export not ready", 404
+    return send_file(
+        job.output_path,
+        as_attachment=True,
+        download_name=job.download_name,
+        mimetype='video/mp4',
+        conditional=True
+    )
+
+def parse_clip_time(value):
+    """Parse a clip boundary: Unix seconds or a local ISO time (2025-05-29T14:05:00)"""
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.fromisoformat(value).timestamp()
+
+@app.route('/export')
+def export_clip():
+    """Stream a time-range clip built from only the chunks covering [from, to].
+
+    With active=1 only the spans with motion (score >= threshold) are kept.
+    """
+    camera_guid = request.args.get('camera')
+    try:
+        start_time = parse_clip_time(request.args['from'])
+        end_time = parse_clip_time(request.args['to'])
+    except (KeyError, ValueError):
+        return "camera, from and to are required (Unix seconds or ISO times)", 400
+    if not camera_guid or end_time <= start_time:
+        return "camera is required and 'to' must be after 'from'", 400
+    
+    start = datetime.fromtimestamp(start_time)
+    date = start.strftime("%Y-%m-%d")
+    if datetime.fromtimestamp(end_time - 0.001).strftime("%Y-%m-%d") != date:
+        return "Clips cannot span midnight; export each day separately", 400
+    moved = redirect_to_node(recording_node(camera_guid, date, at=start_time))
+    if moved:
+        return moved
     
-    # Check if manifest exists
-    manifest_path = source_dir / "manifest.mpd"
-    if not manifest_path.exists():
+    day_dir = recording_dir(camera_guid, date)
+    if not list_shards(day_dir):
         return "Manifest file not found", 404
+    if request.args.get('active') == '1':
+        threshold = request.args.get('threshold', motion.EVENT_THRESHOLD, type=int)
+        scores = motion.read_scores(day_dir)
+        groups, seen = [], set()
+        for span_start, span_end in motion.active_spans(scores, date, start_time, end_time, threshold):
+            for shard_dir, chunks in find_clip_segments(day_dir, span_start, span_end):
+                # Neighbouring spans can share a segment
+                chunks = [c for c in chunks if c not in seen]
+                seen.update(chunks)
+                if chunks:
+                    groups.append((shard_dir, chunks))
+    else:
+        groups = find_clip_segments(day_dir, start_time, end_time)
+    if not groups:
+        return "No recording in the requested range", 404
     
+    end = datetime.fromtimestamp(end_time)
+    download_name = f"{camera_guid}_{start:%Y%m%d_%H%M%S}-{end:%H%M%S}.mp4"
+    headers = {'Content-Disposition': f'attachment; filename="{download_name}"'}
+    if len(groups) == 1:
+        # Within one shard the clip is its init segment plus the chunks, byte for byte
+        shard_dir, chunks = groups[0]
+        init_path = shard_dir / "init.m4s"
+        headers['Content-Length'] = str(init_path.stat().st_size + sum(p.stat().st_size for p in chunks))
+        body = stream_clip(init_path, chunks)
+    else:
+        list_path = EXPORTS_DIR / f"clip_{uuid.uuid4().hex}.txt"
+        body = stream_multi_shard_clip(groups, list_path)
+    return Response(body, mimetype='video/mp4', headers=headers)
+
+@app.route('/api/motion/<camera_guid>/<date>')
+def api_motion(camera_guid, date):
+    """Motion scores of a camera/day (null where nothing was recorded).
+
+    ``bucket`` (seconds, a multiple of the slot length) takes the maximum
+    over coarser buckets, e.g. bucket=60 for a 1440-cell heatmap.
+    """
+    moved = redirect_to_node(recording_node(camera_guid, date))
+    if moved:
+        return moved
+    bucket = max(request.args.get('bucket', motion.SLOT_SECONDS, type=int) // motion.SLOT_SECONDS, 1)
+    scores = motion.read_scores(recording_dir(camera_guid, date))
+    return jsonify({
+        'camera_guid': camera_guid,
+        'date': date,
+        'bucket_seconds': bucket * motion.SLOT_SECONDS,
+        'event_threshold': motion.EVENT_THRESHOLD,
+        'scores': motion.bucket_scores(scores, bucket),
+    })
+
+@app.route('/api/motion/<camera_guid>/<date>/next')
+def api_next_event(camera_guid, date):
+    """The next motion event after ``after`` (Unix seconds or ISO time) and where to play it"""
+    moved = redirect_to_node(recording_node(camera_guid, date))
+    if moved:
+        return moved
     try:
-        # Use ffmpeg to convert DASH to MP4
-        cmd = [
-            "ffmpeg",
-            "-i", str(manifest_path),
-            "-c", "copy",  # Copy streams without re-encoding
-            "-movflags", "+faststart",  # Enable fast start for web playback
-            str(output_mp4)
-        ]
-        
-        # Run the conversion
-        process = subprocess.run(cmd, capture_output=True, text=True)
-        
-        if process.returncode != 0:
-            print(f"Error converting video: {process.stderr}")
-            return "Error converting video", 500
-        
-        # Send the file for download
-        return send_file(
-            output_mp4,
-            as_attachment=True,
-            download_name=f"{camera_guid}_{date}.mp4",
-            mimetype='video/mp4'
-        )
-        
-    except Exception as e:
-        print(f"Error: {str(e)}")
-        return f"Error: {str(e)}", 500
+        after = parse_clip_time(request.args['after'])
+    except (KeyError, ValueError):
+        return jsonify({'error': 'after is required (Unix seconds or ISO time)'}), 400
+    threshold = request.args.get('threshold', motion.EVENT_THRESHOLD, type=int)
+    day_dir = recording_dir(camera_guid, date)
+    event_time = motion.next_event(motion.read_scores(day_dir), date, after, threshold)
+    if event_time is None:
+        return jsonify({'time': None})
+    position = locate(day_dir, event_time)
+    return jsonify({
+        'time': event_time,
+        'shard': position[0] if position else None,
+        'offset': round(position[1], 3) if position else None,
+    })
+
+@app.route('/api/integrity/<camera_guid>/<date>')
+def api_integrity(camera_guid, date):
+    """Verified segment counts, damaged segments and gaps of a camera/day"""
+    moved = redirect_to_node(recording_node(camera_guid, date))
+    if moved:
+        return moved
+    records = integrity.read_index(recording_dir(camera_guid, date))
+    if not records:
+        return jsonify({'error': 'No integrity index for this recording'}), 404
+    return jsonify({'camera_guid': camera_guid, 'date': date, **integrity.summarize(records)})
 
 @app.route('/create_snapshot/<camera_guid>/<date>')
 def create_snapshot(camera_guid, date):
-    """Create a snapshot of the current recording"""
-    base_dir = Path("E:/bala/version1/dashvideos")
-    source_dir = base_dir / date / camera_guid
-    snapshot_dir = base_dir / date / f"{camera_guid}_snapshots"
-    snapshot_dir.mkdir(parents=True, exist_ok=True)
-    
-    # Create a unique snapshot ID
-    snapshot_id = datetime.now().strftime("%Y%m%d_%H%M%S")
-    snapshot_path = snapshot_dir / f"manifest_{snapshot_id}.mpd"
-    
-    # Copy the current MPD file and all associated segments
-    if (source_dir / "manifest.mpd").exists():
-        # Copy the MPD file
-        shutil.copy2(source_dir / "manifest.mpd", snapshot_path)
-        
-        # Copy all segment files
-        for segment in source_dir.glob("*.m4s"):
-            shutil.copy2(segment, snapshot_dir / segment.name)
+    """Create a snapshot of the current recording (frozen manifest + hard links, no copies)"""
+    moved = redirect_to_node(recording_node(camera_guid, date))
+    if moved:
+        return moved
+    cold_root, cold_dir = cold_day(camera_guid, date)
+    if cold_dir:
+        # Snapshots link segments on the recording disk
+        start_fetch_back(cold_root, camera_guid, date, wait=True)
+    if list_shards(DASH_ROOT / date / camera_guid):
+        snapshot = snapshots.create_snapshot(DASH_ROOT, camera_guid, date)
+        if snapshot:
+            log.info("created snapshot", extra={"snapshot": snapshot['id'], "mode": snapshot['mode'],
+                                                "camera": camera_guid, "shards": len(snapshot['shards'])})
     
     # Redirect back to the original recording
     return redirect(url_for('recorded', camera_guid=camera_guid, date=date, filename="manifest.mpd"))
 
+# (camera_guid, date) -> Event set once the copy back from cold storage ends
+fetching_back = {}
+fetching_back_lock = threading.Lock()
+
+def start_fetch_back(cold_root, camera_guid, date, wait=False):
+    """Copy a cold day back to the recording disk in the background, once.
+
+    With ``wait``, block until the copy (this one or one already running)
+    has finished.
+    """
+    key = (camera_guid, date)
+    with fetching_back_lock:
+        done = fetching_back.get(key)
+        started = done is None
+        if started:
+            done = fetching_back[key] = threading.Event()
+
+    def run():
+        try:
+            fetch_back(DASH_ROOT, cold_root, camera_guid, date, catalog)
+        except Exception:
+            log.exception("fetching back from cold storage failed", extra={"camera": camera_guid, "date": date})
+        finally:
+            with fetching_back_lock:
+                fetching_back.pop(key, None)
+            done.set()
+
+    if started:
+        threading.Thread(target=run, daemon=True).start()
+    if wait:
+        done.wait()
+
+def cold_day(camera_guid, date):
+    """(cold root, folder) of a camera/day that is only on the cold tier, else (None, None)"""
+    if (DASH_ROOT / date / camera_guid).exists():
+        return None, None
+    cold_root = load_config().get('storage', {}).get('cold_root')
+    if cold_root and (Path(cold_root) / date / camera_guid).exists():
+        return cold_root, Path(cold_root) / date / camera_guid
+    return None, None
+
+def recording_dir(camera_guid, date):
+    """Folder to read a camera/day from.
+
+    A day retention moved to the cold tier is read there while it is
+    copied back to the recording disk for later requests.
+    """
+    cold_root, cold_dir = cold_day(camera_guid, date)
+    if cold_dir:
+        start_fetch_back(cold_root, camera_guid, date)
+        return cold_dir
+    return DASH_ROOT / date / camera_guid
+
+def submit_export(camera_guid, date):
+    """Queue a full-day export; a cold day is fetched back by the export job first"""
+    cold_root, cold_dir = cold_day(camera_guid, date)
+    if cold_dir:
+        return export_manager.submit(camera_guid, date, source_dir=cold_dir,
+                                     fetch_back=lambda: start_fetch_back(cold_root, camera_guid, date, wait=True))
+    return export_manager.submit(camera_guid, date)
+
 @app.route('/dashvideos/<path:filename>')
 def serve_dash(filename):
-    """Serve DASH video files"""
-    # Handle the full path structure
+    """Serve DASH manifests and segments (date/camera_guid/file, snapshots included)"""
+    # CORS headers come from add_security_headers
+    # ?rendition=lowest serves only the lowest ABR rendition (grid views)
+    lowest = request.args.get('rendition') == 'lowest'
     parts = filename.split('/')
-    if len(parts) >= 3:  # date/camera_guid/filename
-        date = parts[0]
-        camera_guid = parts[1]
-        file = '/'.join(parts[2:])
-        base_dir = Path("E:/bala/version1/dashvideos")
-        
-        # Check if this is a snapshot request
-        if "_snapshots" in camera_guid:
-            # Extract the actual camera GUID by removing _snapshots
-            actual_camera_guid = camera_guid.replace("_snapshots", "")
-            # Serve from the snapshot directory but don't expose it in the URL
-            response = send_from_directory(str(base_dir / date / camera_guid), file)
-        else:
-            response = send_from_directory(str(base_dir / date / camera_guid), file)
-            
-        response.headers.add('Access-Control-Allow-Origin', '*')
-        response.headers.add('Access-Control-Allow-Headers', 'Content-Type')
-        response.headers.add('Access-Control-Allow-Methods', 'GET')
-        return response
-    response = send_from_directory('dashvideos', filename)
-    response.headers.add('Access-Control-Allow-Origin', '*')
-    response.headers.add('Access-Control-Allow-Headers', 'Content-Type')
-    response.headers.add('Access-Control-Allow-Methods', 'GET')
-    return response
+    if cluster and len(parts) >= 3:
+        camera_guid = parts[1].removesuffix('_snapshots')
+        shard = parts[2] if len(parts) >= 4 and camera_guid == parts[1] else None
+        moved = redirect_to_node(recording_node(camera_guid, parts[0], shard))
+        if moved:
+            return moved
+    cold_root = load_config().get('storage', {}).get('cold_root')
+    if cold_root:
+        hot_path = safe_join(str(DASH_ROOT), filename)
+        cold_path = safe_join(cold_root, filename)
+        if hot_path and cold_path and not os.path.exists(hot_path) and os.path.exists(cold_path):
+            # Serve from the cold tier right away and bring the day back for later requests
+            parts = filename.split('/')
+            if len(parts) >= 3:
+                start_fetch_back(cold_root, parts[1], parts[0])
+            return send_dash_file(cold_root, filename, lowest=lowest, sendfile_prefix=COLD_SENDFILE_PREFIX)
+    return send_dash_file(DASH_ROOT, filename, lowest=lowest)
+
+@app.route('/metrics')
+def metrics():
+    """Prometheus metrics: this worker's request/catalog metrics plus per-camera recorder health"""
+    body = REGISTRY.render()
+    try:
+        with open(RECORDER_STATUS_FILE) as f:
+            body += render_recorder_status(json.load(f))
+    except (OSError, ValueError):
+        pass
+    return Response(body, mimetype='text/plain; version=0.0.4')
 
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=5000, debug=True) 
\ No newline at end of file
+    configure_logging()
+    # Development server; use serve.py (or wsgi.py under gunicorn) in production
+    app.run(host='0.0.0.0', port=5000, debug=os.environ.get("VMS_DEBUG") == "1", threaded=True) 
\ No newline at end of file
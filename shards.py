@@ -0,0 +1,73 @@
+"""Hourly recording shards: <date>/<guid>/<HHMMSS>/ plus a small day-level index.json"""
+import json
+import os
+from datetime import datetime, timedelta
+from pathlib import Path
+
+# Default length of one shard; the recorder starts a new manifest at every
+# boundary. Configurable as config["recorder"]["rollover_seconds"].
+SHARD_SECONDS = 3600
+
+INDEX_FILE = "index.json"
+
+def shard_id(started_at):
+    """Shard folder name: the local start time as HHMMSS"""
+    return datetime.fromtimestamp(started_at).strftime("%H%M%S")
+
+def valid_shard_seconds(seconds):
+    """A rollover interval must divide the day so that midnight is always a boundary"""
+    return isinstance(seconds, int) and 0 < seconds <= 86400 and 86400 % seconds == 0
+
+def next_boundary(now, seconds=SHARD_SECONDS):
+    """Next local-time boundary (multiple of ``seconds`` since midnight) after ``now``"""
+    current = datetime.fromtimestamp(now)
+    midnight = current.replace(hour=0, minute=0, second=0, microsecond=0)
+    # Rounded so that a boundary timestamp maps to itself, not to a hair before it
+    elapsed = round((current - midnight).total_seconds(), 3)
+    return (midnight + timedelta(seconds=(elapsed // seconds + 1) * seconds)).timestamp()
+
+def read_index(day_dir):
+    """Day index of a camera: {"shards": [{"id", "start"}, ...]}"""
+    try:
+        with open(Path(day_dir) / INDEX_FILE) as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {"shards": []}
+
+def register_shard(day_dir, shard, started_at):
+    """Add a shard to the day index (atomic rewrite of a file with ~24 entries)"""
+    day_dir = Path(day_dir)
+    index = read_index(day_dir)
+    if not any(s["id"] == shard for s in index["shards"]):
+        index["shards"].append({"id": shard, "start": started_at, "manifest": f"{shard}/manifest.mpd"})
+        index["shards"].sort(key=lambda s: s["start"])
+    tmp_path = day_dir / f".{INDEX_FILE}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(index, f, indent=4)
+    os.replace(tmp_path, day_dir / INDEX_FILE)
+
+def get_shard_dir(root, camera_guid, started_at):
+    """Create and index the shard folder a recorder started at ``started_at`` writes to"""
+    date_str = datetime.fromtimestamp(started_at).strftime("%Y-%m-%d")
+    day_dir = Path(root) / date_str / camera_guid
+    shard = shard_id(started_at)
+    shard_dir = day_dir / shard
+    shard_dir.mkdir(parents=True, exist_ok=True)
+    register_shard(day_dir, shard, started_at)
+    return shard_dir
+
+def list_shards(day_dir):
+    """Shards of a camera/day in order, as dicts with id, start and dir.
+
+    Days recorded before sharding keep their manifest directly in the day
+    folder and come back as a single shard with an empty id.
+    """
+    day_dir = Path(day_dir)
+    if (day_dir / "manifest.mpd").exists():
+        return [{"id": "", "start": None, "dir": day_dir}]
+    shards = []
+    for entry in read_index(day_dir)["shards"]:
+        shard_dir = day_dir / entry["id"]
+        if (shard_dir / "manifest.mpd").exists():
+            shards.append({"id": entry["id"], "start": entry["start"], "dir": shard_dir})
+    return shards
@@ -0,0 +1,170 @@
+"""Metadata-only snapshots of a recording: a frozen manifest plus links, never copies"""
+import json
+import logging
+import os
+import shutil
+import time
+import xml.etree.ElementTree as ET
+from datetime import datetime
+from pathlib import Path
+
+from clips import recorded_segments
+from mpd import NS, mark_gaps
+
+log = logging.getLogger(__name__)
+
+# Attributes that only make sense for a manifest that is still growing
+DYNAMIC_ATTRIBUTES = ("minimumUpdatePeriod", "availabilityStartTime", "publishTime",
+                      "timeShiftBufferDepth", "suggestedPresentationDelay")
+
+ET.register_namespace("", NS["mpd"])
+ET.register_namespace("xsi", "http://www.w3.org/2001/XMLSchema-instance")
+ET.register_namespace("xlink", "http://www.w3.org/1999/xlink")
+
+def get_snapshot_dir(root, camera_guid, date):
+    return Path(root) / date / f"{camera_guid}_snapshots"
+
+def _freeze(manifest_text, last_number, segment_prefix):
+    """Parse and freeze a manifest; returns (root element, duration in seconds)"""
+    root = ET.fromstring(manifest_text)
+    for attribute in DYNAMIC_ATTRIBUTES:
+        root.attrib.pop(attribute, None)
+    root.set("type", "static")
+
+    duration = 0.0
+    for template in root.iter(f"{{{NS['mpd']}}}SegmentTemplate"):
+        timescale = int(template.get("timescale", "1"))
+        number = int(template.get("startNumber", "1"))
+        timeline = template.find("mpd:SegmentTimeline", NS)
+        if timeline is not None:
+            # Drop timeline entries past the frozen range
+            end = 0
+            for s in list(timeline):
+                if s.get("t") is not None:
+                    end = int(s.get("t"))
+                repeat = int(s.get("r", "0"))
+                keep = min(repeat + 1, last_number - number + 1)
+                if keep <= 0:
+                    timeline.remove(s)
+                    continue
+                if keep < repeat + 1:
+                    s.set("r", str(keep - 1))
+                end += int(s.get("d")) * keep
+                number += keep
+            duration = max(duration, end / timescale)
+        for attribute in ("initialization", "media"):
+            value = template.get(attribute)
+            if value:
+                template.set(attribute, segment_prefix + value.replace("\\", "/").rsplit("/", 1)[-1])
+    return root, duration
+
+def freeze_manifest(manifest_text, last_number, segment_prefix):
+    """Turn the recorder's manifest into a static one ending at ``last_number``.
+
+    Segment URLs are rewritten to ``segment_prefix`` (a folder of links, or
+    the live recording folder when linking is not possible).
+    """
+    root, duration = _freeze(manifest_text, last_number, segment_prefix)
+    root.set("mediaPresentationDuration", f"PT{duration:.3f}S")
+    return ET.tostring(root, encoding="unicode", xml_declaration=True)
+
+def freeze_shards(frozen):
+    """Combine per-shard (manifest text, kept numbers, prefix) into one static
+    manifest with a Period per shard, played back to back.
+
+    The timeline ends at the last kept number; numbers before it that were
+    not kept (damaged or missing chunks) are cut out with mark_gaps.
+    """
+    combined, offset = None, 0.0
+    for index, (manifest_text, numbers, prefix) in enumerate(frozen):
+        root, duration = _freeze(manifest_text, numbers[-1], prefix)
+        for period in root.findall("mpd:Period", NS):
+            period.set("id", str(index))
+            period.set("start", f"PT{offset:.3f}S")
+        skipped = set(range(numbers[-1] + 1)) - set(numbers)
+        if skipped:
+            root = ET.fromstring(mark_gaps(ET.tostring(root, encoding="unicode"), skipped))
+        periods = root.findall("mpd:Period", NS)
+        if combined is None:
+            combined = root
+        else:
+            for period in periods:
+                combined.append(period)
+        offset += duration
+    combined.set("mediaPresentationDuration", f"PT{offset:.3f}S")
+    return ET.tostring(combined, encoding="unicode", xml_declaration=True)
+
+def _shard_path(shard):
+    return f"{shard}/" if shard else ""
+
+def _link_segments(source_dir, target_dir, names):
+    """Hard-link segments into target_dir; False if the filesystem cannot"""
+    target_dir.mkdir(parents=True, exist_ok=True)
+    try:
+        for name in names:
+            os.link(source_dir / name, target_dir / name)
+    except OSError as e:
+        log.info("hard links unavailable for snapshot, referencing live segments", extra={"error": str(e)})
+        return False
+    return True
+
+def create_snapshot(root, camera_guid, date):
+    """Freeze the current state of a recording without copying segment data.
+
+    Segments are hard-linked where the filesystem supports it, so the
+    snapshot shares storage with the live recording and survives retention.
+    Otherwise the frozen manifest references the live segments directly and
+    the snapshot's metadata file tells retention to keep them. Every hourly
+    shard of the day becomes one Period of the frozen manifest, ending where
+    the next shard's footage begins.
+    """
+    day_dir = Path(root) / date / camera_guid
+    selected = []
+    for shard, segments in recorded_segments(day_dir):
+        manifest_text = (shard["dir"] / "manifest.mpd").read_text()
+        selected.append((shard, manifest_text, [number for number, _, _ in segments]))
+    if not selected:
+        return None
+
+    snapshot_id = datetime.now().strftime("%Y%m%d_%H%M%S")
+    snapshot_dir = get_snapshot_dir(root, camera_guid, date)
+    mode = "link"
+    for shard, _, numbers in selected:
+        names = ["init.m4s"] + [f"chunk-{n:05d}.m4s" for n in numbers]
+        target_dir = snapshot_dir / snapshot_id / shard["id"] if shard["id"] else snapshot_dir / snapshot_id
+        if not _link_segments(shard["dir"], target_dir, names):
+            shutil.rmtree(snapshot_dir / snapshot_id, ignore_errors=True)
+            mode = "reference"
+            break
+    base = f"{snapshot_id}/" if mode == "link" else f"../{camera_guid}/"
+
+    manifest_path = snapshot_dir / f"manifest_{snapshot_id}.mpd"
+    manifest_path.write_text(freeze_shards(
+        [(text, numbers, base + _shard_path(shard["id"])) for shard, text, numbers in selected]))
+    metadata = {
+        "id": snapshot_id,
+        "camera_guid": camera_guid,
+        "date": date,
+        "shards": [{"id": shard["id"], "first_segment": numbers[0], "last_segment": numbers[-1]}
+                   for shard, _, numbers in selected],
+        "mode": mode,
+        "created_at": time.time(),
+    }
+    with open(snapshot_dir / f"snapshot_{snapshot_id}.json", "w") as f:
+        json.dump(metadata, f, indent=4)
+    return metadata
+
+def snapshot_shards(snapshot):
+    """Per-shard segment ranges of a snapshot; older snapshots cover one flat folder"""
+    if "shards" in snapshot:
+        return snapshot["shards"]
+    return [{"id": "", "first_segment": snapshot["first_segment"], "last_segment": snapshot["last_segment"]}]
+
+def list_snapshots(root, camera_guid, date):
+    """Metadata of every snapshot of a camera/day, oldest first"""
+    snapshot_dir = get_snapshot_dir(root, camera_guid, date)
+    snapshots = []
+    for path in sorted(snapshot_dir.glob("snapshot_*.json")):
+        with open(path) as f:
+            snapshots.append(json.load(f))
+    return snapshots
@@ -0,0 +1,209 @@
+"""Keyframe sprite sheets and WebVTT thumbnail tracks for timeline scrubbing"""
+import logging
+import os
+import queue
+import subprocess
+import threading
+import time
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+from mpd import read_segment_timeline
+
+log = logging.getLogger(__name__)
+
+# One tile per segment, letterboxed to this size
+TILE_WIDTH = 160
+TILE_HEIGHT = 90
+
+# Tiles per sprite sheet (a 10x10 sheet covers 400 s of 4 s segments)
+SHEET_COLUMNS = 10
+SHEET_ROWS = 10
+
+SPRITES_DIR = "sprites"
+THUMBNAILS_VTT = "thumbnails.vtt"
+
+# Tiles of a sheet that is not full yet, kept as the JPEG ffmpeg produced
+TILES_DIR = "tiles"
+
+# A shard with no new segment for this long has closed (rotation, restart);
+# its last partial sheet is built then
+SHEET_IDLE = 60
+
+# Segments waiting for a tile; when the worker falls this far behind, new
+# segments are skipped rather than queued without limit
+QUEUE_SIZE = 1000
+
+def sheet_position(number):
+    """(sheet index, x, y) of segment ``number``'s tile"""
+    index = number - 1
+    per_sheet = SHEET_COLUMNS * SHEET_ROWS
+    slot = index % per_sheet
+    return index // per_sheet, (slot % SHEET_COLUMNS) * TILE_WIDTH, (slot // SHEET_COLUMNS) * TILE_HEIGHT
+
+def sheet_name(sheet):
+    return f"sprite-{sheet:03d}.jpg"
+
+def tile_name(number):
+    return f"tile-{number:05d}.jpg"
+
+def extract_keyframe(init_path, chunk_path):
+    """Decode only the keyframe a segment starts with and return it as tile JPEG bytes"""
+    source = f"concat:{Path(init_path).as_posix()}|{Path(chunk_path).as_posix()}"
+    cmd = [
+        "ffmpeg",
+        "-hide_banner",
+        "-loglevel", "error",
+        # Non-key frames are never decoded
+        "-skip_frame", "nokey",
+        "-i", source,
+        "-frames:v", "1",
+        "-vf", (f"scale={TILE_WIDTH}:{TILE_HEIGHT}:force_original_aspect_ratio=decrease,"
+                f"pad={TILE_WIDTH}:{TILE_HEIGHT}:(ow-iw)/2:(oh-ih)/2"),
+        "-f", "image2pipe",
+        "-c:v", "mjpeg",
+        "pipe:1",
+    ]
+    result = subprocess.run(cmd, capture_output=True, timeout=30)
+    if result.returncode != 0 or not result.stdout:
+        return None
+    return result.stdout
+
+def write_vtt(shard_dir, last_number):
+    """Rewrite a shard's WebVTT track with a cue per tiled segment.
+
+    Segments of a finished sheet point into it; the others at their staged tile.
+    """
+    manifest_path = shard_dir / "manifest.mpd"
+    if not manifest_path.exists():
+        return
+    sprites_dir = shard_dir / SPRITES_DIR
+    sheets = set(os.listdir(sprites_dir)) if sprites_dir.exists() else set()
+    tiles_dir = sprites_dir / TILES_DIR
+    tiles = set(os.listdir(tiles_dir)) if tiles_dir.exists() else set()
+    lines = ["WEBVTT", ""]
+    for number, start, duration in read_segment_timeline(manifest_path.read_text()):
+        if number > last_number:
+            break
+        sheet, x, y = sheet_position(number)
+        if sheet_name(sheet) in sheets:
+            image = f"{SPRITES_DIR}/{sheet_name(sheet)}#xywh={x},{y},{TILE_WIDTH},{TILE_HEIGHT}"
+        elif tile_name(number) in tiles:
+            image = f"{SPRITES_DIR}/{TILES_DIR}/{tile_name(number)}#xywh=0,0,{TILE_WIDTH},{TILE_HEIGHT}"
+        else:
+            continue
+        lines += [f"{format_vtt_time(start)} --> {format_vtt_time(start + duration)}", image, ""]
+    tmp_path = shard_dir / f".{THUMBNAILS_VTT}.tmp"
+    tmp_path.write_text("\n".join(lines))
+    os.replace(tmp_path, shard_dir / THUMBNAILS_VTT)
+
+def format_vtt_time(seconds):
+    hours, rest = divmod(seconds, 3600)
+    minutes, seconds = divmod(rest, 60)
+    return f"{int(hours):02d}:{int(minutes):02d}:{seconds:06.3f}"
+
+def add_tile(shard_dir, number, tile):
+    """Stage a segment's tile JPEG until its sheet is built"""
+    tiles_dir = shard_dir / SPRITES_DIR / TILES_DIR
+    tiles_dir.mkdir(parents=True, exist_ok=True)
+    tmp_path = tiles_dir / f".{tile_name(number)}.tmp"
+    tmp_path.write_bytes(tile)
+    os.replace(tmp_path, tiles_dir / tile_name(number))
+
+def build_sheet(shard_dir, sheet):
+    """Encode a sprite sheet from its staged tiles, once, and drop the tiles"""
+    sprites_dir = shard_dir / SPRITES_DIR
+    tiles_dir = sprites_dir / TILES_DIR
+    per_sheet = SHEET_COLUMNS * SHEET_ROWS
+    image = np.zeros((SHEET_ROWS * TILE_HEIGHT, SHEET_COLUMNS * TILE_WIDTH, 3), np.uint8)
+    staged = []
+    for number in range(sheet * per_sheet + 1, (sheet + 1) * per_sheet + 1):
+        path = tiles_dir / tile_name(number)
+        tile = cv2.imread(str(path)) if path.exists() else None
+        if tile is None:
+            continue
+        _, x, y = sheet_position(number)
+        image[y:y + TILE_HEIGHT, x:x + TILE_WIDTH] = tile[:TILE_HEIGHT, :TILE_WIDTH]
+        staged.append(path)
+    if not staged:
+        return
+    path = sprites_dir / sheet_name(sheet)
+    tmp_path = sprites_dir / f".{path.name}.tmp.jpg"
+    cv2.imwrite(str(tmp_path), image, [cv2.IMWRITE_JPEG_QUALITY, 70])
+    os.replace(tmp_path, path)
+    for tile_path in staged:
+        tile_path.unlink()
+
+class SpriteIndexer:
+    """Segment listener that tiles one keyframe per closed segment in the background.
+
+    The recorder's poll loop only enqueues the path; a worker thread extracts
+    the keyframe, stages it as a tile and rewrites the shard's WebVTT track.
+    Each sheet is encoded once, when its last tile arrives or its shard has
+    gone idle, so scrubbing a finished shard costs one image fetch per sheet.
+    """
+
+    def __init__(self):
+        self.queue = queue.Queue(maxsize=QUEUE_SIZE)
+        self.thread = None
+        # shard folder -> (sheet being filled, last tiled number, time of its tile)
+        self.open_sheets = {}
+
+    def start(self):
+        self.thread = threading.Thread(target=self._loop, name="sprites", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.queue.put(None)
+
+    def on_segment(self, path, overlap=False):
+        try:
+            self.queue.put_nowait(Path(path))
+        except queue.Full:
+            log.warning("sprite indexer is behind, skipping segment", extra={"path": str(path)})
+
+    def _loop(self):
+        while True:
+            try:
+                path = self.queue.get(timeout=SHEET_IDLE)
+            except queue.Empty:
+                path = False
+            if path is None:
+                return
+            try:
+                if path:
+                    self.index_segment(path)
+                self.close_idle_sheets()
+            except Exception:
+                log.exception("sprite indexing failed", extra={"path": str(path)})
+
+    def index_segment(self, path):
+        """Stage one segment's keyframe tile and list it in the thumbnail track"""
+        shard_dir = path.parent
+        number = int(path.stem.rsplit("-", 1)[-1])
+        tile = extract_keyframe(shard_dir / "init.m4s", path)
+        if tile is None:
+            return
+        add_tile(shard_dir, number, tile)
+        sheet, _, _ = sheet_position(number)
+        previous = self.open_sheets.get(shard_dir)
+        if previous and previous[0] < sheet:
+            # Skipped numbers left the previous sheet short of its last tile
+            build_sheet(shard_dir, previous[0])
+        if number % (SHEET_COLUMNS * SHEET_ROWS) == 0:
+            build_sheet(shard_dir, sheet)
+            self.open_sheets.pop(shard_dir, None)
+        else:
+            self.open_sheets[shard_dir] = (sheet, number, time.monotonic())
+        write_vtt(shard_dir, number)
+
+    def close_idle_sheets(self):
+        """Build the partial last sheet of shards that stopped receiving segments"""
+        now = time.monotonic()
+        for shard_dir, (sheet, number, seen) in list(self.open_sheets.items()):
+            if now - seen >= SHEET_IDLE:
+                del self.open_sheets[shard_dir]
+                build_sheet(shard_dir, sheet)
+                write_vtt(shard_dir, number)
@@ -1,85 +1,116 @@
-import subprocess
-import json
-from pathlib import Path
+import logging
+import time
 from datetime import datetime
 
-# Store running processes
-running_processes = []
+from catalog import RecordingCatalog
+from cluster import CLUSTER_DB, NODE_ID, NODE_URL, ClusterNode
+from config_store import ConfigStore
+from ingest import IngestManager, DASH_ROOT, LIVE_ROOT
+from integrity import IntegrityVerifier
+from logs import configure_logging
+from motion import MotionIndexer
+from retention import RetentionService
+from sprites import SpriteIndexer
+
+# Seconds between health checks of the recorder processes
+POLL_INTERVAL = 2
+
+# Seconds between checks of config.json for added or removed cameras
+CONFIG_POLL_INTERVAL = 5
+
+# Per-camera uptime, restart count, fps and speed, refreshed every poll
+STATUS_FILE = "recorder_status.json"
+
+# config.json is only re-parsed when it changes on disk
+config_store = ConfigStore()
+
+# Recordings index, fed with every segment the recorders close
+catalog = RecordingCatalog(root=DASH_ROOT)
+
+# Evicts old days and moves cold ones off the recording disk
+retention = RetentionService(DASH_ROOT, config_store, catalog)
+
+# Keyframe sprite sheets + WebVTT track per shard, for scrubbing previews
+sprites = SpriteIndexer()
+
+# Motion scores from the samples the recorders write, one small array file per camera/day
+motion_index = MotionIndexer(DASH_ROOT, LIVE_ROOT)
+
+# Checks every closed segment's boxes and records it in the day's segments.idx;
+# damaged days are flagged in the catalog right away
+integrity = IntegrityVerifier(DASH_ROOT, on_damaged=lambda guid, date, record: catalog.add_damaged(guid, date))
+
+log = logging.getLogger("recorder")
+
+# Recorder-node mode (see cluster.py): record only the cameras leased to this
+# node and report its shards to the shared catalog
+cluster_node = ClusterNode(CLUSTER_DB, NODE_ID, NODE_URL, DASH_ROOT) if CLUSTER_DB and NODE_ID else None
+
+segment_listeners = [catalog.on_segment, sprites.on_segment, motion_index.on_segment, integrity.on_segment]
+if cluster_node:
+    segment_listeners.append(cluster_node.on_segment)
+
+# Single owner of every camera ingest process
+ingest = IngestManager(status_file=STATUS_FILE, segment_listeners=segment_listeners)
 
 def load_config():
-    with open("config.json") as f:
-        return json.load(f)
-
-def get_dash_output_dir(camera_guid):
-    date_str = datetime.now().strftime("%Y-%m-%d")
-    output_dir = Path("E:/bala/version1/dashvideos") / date_str / camera_guid
-    output_dir.mkdir(parents=True, exist_ok=True)
-    return output_dir
-
-def start_dash_stream(camera):
-    output_dir = get_dash_output_dir(camera['guid'])
-    output_path = output_dir / "manifest.mpd"
-    
-    cmd = [
-        "ffmpeg",
-        "-i", camera["url"],
-        "-c:v", "libx264",
-        "-preset", "fast",
-        "-crf", "22",
-        "-b:v", "2M",
-        "-maxrate", "2M",
-        "-bufsize", "1M",
-        "-g", "48",
-        "-keyint_min", "48",
-        "-c:a", "aac",
-        "-b:a", "128k",
-        "-f", "dash",
-        "-seg_duration", "4",
-        "-frag_duration", "4",
-        "-window_size", "0",
-        "-extra_window_size", "0",
-        "-init_seg_name", f"{output_dir}/init.m4s",
-        "-media_seg_name", f"{output_dir}/chunk-$Number%05d$.m4s",
-        "-use_timeline", "1",
-        "-use_template", "1",
-        "-ldash", "1",
-        "-streaming", "1",
-        "-remove_at_exit", "0",
-        "-write_prft", "1",
-        "-target_latency", "3",
-        "-ignore_io_errors", "1",
-        "-flags", "+global_header",
-        str(output_path)
-    ]
-    print(f"Starting stream for {camera['name']} ({camera['guid']}) -> {output_path}")
-    process = subprocess.Popen(cmd)
-    running_processes.append(process)
-    return process
+    return config_store.load()
 
-def stop_all_streams():
-    for process in running_processes:
-        process.terminate()  # Try to terminate gracefully
+def start_all_streams():
+    config = load_config()
+    ingest.set_rollover(config.get("recorder", {}).get("rollover_seconds"))
+    ingest.set_start_rate(config.get("recorder", {}).get("start_rate"))
+    cameras = config["cameras"]
+    if cluster_node:
         try:
-            process.wait(timeout=5)  # Wait for 5 seconds
-        except subprocess.TimeoutExpired:
-            process.kill()  # Force kill if not terminated
-    running_processes.clear()
-    print("All streams stopped")
+            cameras = cluster_node.claim(cameras)
+        except Exception:
+            # Leases not renewed: keep only the cameras whose last lease is
+            # still safely valid, the others may go to another node meanwhile
+            log.exception("lease renewal failed")
+            cameras = cluster_node.held(cameras)
+    ingest.sync(cameras, profiles=config.get("profiles", {}))
+    if cluster_node:
+        cold_root = config.get("storage", {}).get("cold_root")
+        cluster_node.prune([DASH_ROOT] + ([cold_root] if cold_root else []))
+
+def stop_all_streams():
+    ingest.stop_all()
+    if cluster_node:
+        cluster_node.release_all()
 
 if __name__ == "__main__":
     import sys
-    import time
-    
+
+    configure_logging()
+
     if len(sys.argv) > 1 and sys.argv[1] == "stop":
         stop_all_streams()
     else:
-        config = load_config()
-        for camera in config["cameras"]:
-            start_dash_stream(camera)
-        
-        # Keep running until user presses Ctrl+C
+        # Index folders recorded while the recorder was down; today's folders
+        # are recounted since the recorders are about to write into them
+        backfill_started = time.perf_counter()
+        catalog.backfill(rescan_dates={datetime.now().strftime("%Y-%m-%d")})
+        log.info("catalog backfill done", extra={"seconds": round(time.perf_counter() - backfill_started, 3)})
+        sprites.start()
+        motion_index.start()
+        integrity.start()
+        start_all_streams()
+        retention.start()
+
+        # Keep running until user presses Ctrl+C: restart dead or stalled
+        # recorders and pick up camera changes made through the web UI
+        last_config_check = time.time()
         try:
             while True:
-                time.sleep(1)
+                time.sleep(POLL_INTERVAL)
+                # One failing check must not take every camera's recorder down with it
+                try:
+                    if time.time() - last_config_check >= CONFIG_POLL_INTERVAL:
+                        last_config_check = time.time()
+                        start_all_streams()
+                    ingest.poll()
+                except Exception:
+                    log.exception("recorder poll failed")
         except KeyboardInterrupt:
-            stop_all_streams()
\ No newline at end of file
+            stop_all_streams()
@@ -0,0 +1,368 @@
+"""Supervisor for long-running recorder ffmpeg processes"""
+import json
+import logging
+import os
+import subprocess
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+# Restart delays grow from BACKOFF_INITIAL up to BACKOFF_MAX seconds
+BACKOFF_INITIAL = 2
+BACKOFF_MAX = 300
+
+# A process that ran this long is considered healthy and resets its backoff
+HEALTHY_RUNTIME = 60
+
+# Seconds without a new chunk-*.m4s before a recorder is considered stalled
+STALL_TIMEOUT = 30
+
+# Seconds before a rotation boundary at which the successor process is started,
+# so it is already producing chunks when the boundary passes
+ROTATION_LEAD = 10
+
+# ffmpeg -progress keys kept for status reporting
+PROGRESS_KEYS = ("frame", "fps", "bitrate", "total_size", "out_time_us",
+                 "dup_frames", "drop_frames", "speed")
+
+def stop_process(process, timeout=5):
+    """Terminate a process, killing it if it does not exit in time"""
+    if process.poll() is not None:
+        return
+    process.terminate()
+    try:
+        process.wait(timeout=timeout)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+
+def parse_progress_value(key, value):
+    """Convert one ffmpeg -progress value to a number where possible"""
+    value = value.strip()
+    if key == "speed":
+        value = value.rstrip("x")
+    elif key == "bitrate":
+        value = value.replace("kbits/s", "")
+    try:
+        return float(value)
+    except ValueError:
+        return None
+
+class ChunkWatcher:
+    """Tracks the newest chunk-NNNNN.m4s written to a DASH output directory.
+
+    Instead of listing the directory it only checks whether the next expected
+    chunk exists, so the cost stays constant however many chunks a day holds.
+    A chunk counts as closed once its successor appears (or the process
+    stops), and is then handed to ``on_segment(path, overlap=...)``.
+    ``overlap`` is true for chunks started after ``overlap_from``: footage a
+    rotation successor is recording as well.
+    """
+
+    def __init__(self, directory, since, on_segment=None):
+        self.directory = directory
+        self.since = since
+        self.on_segment = on_segment
+        self.next_number = 1
+        self.last_chunk_at = None
+        # Seconds between the two newest chunks, i.e. how often segments land
+        self.last_interval = None
+        # (path, time the chunk was started) of the chunk being written
+        self.open_chunk = None
+        self.overlap_from = None
+
+    def _close(self, path, started_at):
+        if self.on_segment is None:
+            return
+        overlap = self.overlap_from is not None and started_at >= self.overlap_from
+        try:
+            self.on_segment(path, overlap=overlap)
+        except Exception:
+            log.exception("segment listener failed", extra={"path": path})
+
+    def flush(self):
+        """Report the chunk still being written as closed"""
+        if self.open_chunk:
+            self._close(*self.open_chunk)
+            self.open_chunk = None
+
+    def check(self):
+        """Advance past newly written chunks; return the newest chunk time"""
+        while True:
+            path = os.path.join(self.directory, f"chunk-{self.next_number:05d}.m4s")
+            try:
+                mtime = os.stat(path).st_mtime
+            except OSError:
+                break
+            if mtime < self.since:
+                # Left over from an earlier run that wrote into the same folder
+                break
+            if self.last_chunk_at is not None:
+                self.last_interval = mtime - self.last_chunk_at
+            # A chunk is started when the one before it closes
+            started_at = self.last_chunk_at if self.last_chunk_at is not None else self.since
+            self.last_chunk_at = mtime
+            self.next_number += 1
+            self.flush()
+            self.open_chunk = (path, started_at)
+        return self.last_chunk_at
+
+class SupervisedProcess:
+    """One supervised command plus its restart and health state"""
+
+    def __init__(self, name, build_command, output_dirs, labels=(), on_segment=None,
+                 next_rotation=None):
+        self.name = name
+        self.build_command = build_command
+        self.output_dirs = output_dirs
+        self.labels = tuple(labels)
+        self.on_segment = on_segment
+        self.next_rotation = next_rotation
+        self.rotate_at = None
+        self.successor = None
+        self.process = None
+        self.started_at = None
+        self.period_start = None
+        self.next_start_at = 0
+        self.restart_count = 0
+        self.failures = 0
+        self.last_exit = None
+        self.watchers = []
+        self.progress = {}
+
+    def start(self, period_start=None):
+        """Launch the process and begin reading its -progress output.
+
+        ``period_start`` is the time the outputs belong to; a successor that
+        is started just before a rotation boundary writes to the boundary's
+        folders, not to the ones of the moment it was launched.
+        """
+        self.started_at = time.time()
+        self.period_start = period_start or self.started_at
+        cmd = self.build_command(self.period_start)
+        self.watchers = [ChunkWatcher(d, self.started_at, self.on_segment)
+                         for d in self.output_dirs(self.period_start)]
+        self.rotate_at = self.next_rotation(self.period_start) if self.next_rotation else None
+        self.progress = {}
+        self.process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stdin=subprocess.DEVNULL,
+                                        text=True, bufsize=1)
+        threading.Thread(target=self._read_progress, args=(self.process,), daemon=True).start()
+
+    def _read_progress(self, process):
+        """Parse ffmpeg -progress key=value blocks into self.progress"""
+        block = {}
+        for line in process.stdout:
+            key, sep, value = line.partition("=")
+            if not sep:
+                continue
+            key = key.strip()
+            if key in PROGRESS_KEYS:
+                block[key] = parse_progress_value(key, value)
+            elif key == "progress":
+                block["updated_at"] = time.time()
+                self.progress = block
+                block = {}
+
+    def spawn_successor(self):
+        """Start an identical process writing to the outputs of the next rotation period"""
+        successor = SupervisedProcess(self.name, self.build_command, self.output_dirs,
+                                      self.labels, self.on_segment, self.next_rotation)
+        successor.restart_count = self.restart_count
+        successor.failures = self.failures
+        successor.last_exit = self.last_exit
+        successor.start(period_start=self.rotate_at)
+        self.successor = successor
+        # From here on both processes record the same footage
+        for watcher in self.watchers:
+            watcher.overlap_from = successor.started_at
+        return successor
+
+    def stopped(self):
+        """Close out the chunks the last run was writing"""
+        self.last_chunk_at()
+        for watcher in self.watchers:
+            watcher.flush()
+
+    def last_chunk_at(self):
+        """Newest chunk time across all output directories"""
+        times = [t for t in (w.check() for w in self.watchers) if t is not None]
+        return max(times) if times else None
+
+    def last_segment_interval(self):
+        """Longest recent gap between consecutive chunks across output directories"""
+        intervals = [w.last_interval for w in self.watchers if w.last_interval is not None]
+        return max(intervals) if intervals else None
+
+    def status(self, now):
+        """Health snapshot for reporting"""
+        running = self.process is not None and self.process.poll() is None
+        last_chunk = self.last_chunk_at() if running else None
+        interval = self.last_segment_interval() if running else None
+        return {
+            "name": self.name,
+            "cameras": list(self.labels),
+            "state": "running" if running else "waiting",
+            "pid": self.process.pid if running else None,
+            "uptime": round(now - self.started_at, 1) if running else 0,
+            "restarts": self.restart_count,
+            "last_exit": self.last_exit,
+            "next_start_in": None if running else max(0, round(self.next_start_at - now, 1)),
+            "next_rotation_in": round(self.rotate_at - now, 1) if running and self.rotate_at else None,
+            "handoff": self.successor is not None,
+            "last_segment_age": round(now - last_chunk, 1) if last_chunk else None,
+            "last_segment_interval": round(interval, 2) if interval else None,
+            "fps": self.progress.get("fps"),
+            "speed": self.progress.get("speed"),
+            "bitrate_kbps": self.progress.get("bitrate"),
+            "drop_frames": self.progress.get("drop_frames"),
+            "dup_frames": self.progress.get("dup_frames"),
+        }
+
+class ProcessSupervisor:
+    """Owns recorder processes and restarts them when they exit or stall"""
+
+    def __init__(self, status_file=None, stall_timeout=STALL_TIMEOUT, segment_listeners=()):
+        self.status_file = status_file
+        self.stall_timeout = stall_timeout
+        self.segment_listeners = list(segment_listeners)
+        self.processes = {}
+
+    def _on_segment(self, path, overlap=False):
+        """Fan a closed segment out to every listener"""
+        for listener in self.segment_listeners:
+            listener(path, overlap=overlap)
+
+    def add(self, name, build_command, output_dirs, labels=(), next_rotation=None):
+        """Register and start a process.
+
+        ``build_command`` and ``output_dirs`` are called with the start time on
+        every (re)start, so a restarted recorder writes to a fresh folder.
+        ``next_rotation(period_start)``, if given, returns when the process
+        should move onto new outputs (e.g. the next hourly shard); see
+        ``handoff`` for how that happens without a gap.
+        """
+        supervised = SupervisedProcess(name, build_command, output_dirs, labels,
+                                       on_segment=self._on_segment,
+                                       next_rotation=next_rotation)
+        self.processes[name] = supervised
+        supervised.start()
+        return supervised
+
+    def remove(self, name):
+        """Stop a process and forget it"""
+        supervised = self.processes.pop(name, None)
+        if supervised:
+            self._drop_successor(supervised)
+        if supervised and supervised.process:
+            stop_process(supervised.process)
+            supervised.stopped()
+
+    def _schedule_restart(self, supervised, now, reason):
+        """Record a failure and compute when the process may start again"""
+        ran_for = now - supervised.started_at if supervised.started_at else 0
+        if ran_for >= HEALTHY_RUNTIME:
+            supervised.failures = 0
+        delay = min(BACKOFF_INITIAL * 2 ** supervised.failures, BACKOFF_MAX)
+        supervised.failures += 1
+        supervised.stopped()
+        supervised.last_exit = reason
+        supervised.process = None
+        supervised.next_start_at = now + delay
+        log.warning("recorder restarting", extra={"recorder": supervised.name, "reason": reason,
+                                                  "ran_for": round(ran_for), "delay": delay})
+
+    def poll(self):
+        """Check every process once: restart exited/stalled ones when their backoff expires"""
+        now = time.time()
+        for supervised in list(self.processes.values()):
+            process = supervised.process
+            if process is not None:
+                code = process.poll()
+                if code is not None:
+                    self._drop_successor(supervised)
+                    self._schedule_restart(supervised, now, f"exited with code {code}")
+                elif supervised.rotate_at and now >= supervised.rotate_at - ROTATION_LEAD:
+                    supervised = self.handoff(supervised, now)
+                if supervised.process is not None and supervised.process.poll() is None:
+                    last_chunk = supervised.last_chunk_at() or supervised.started_at
+                    if now - last_chunk > self.stall_timeout:
+                        stop_process(supervised.process)
+                        self._drop_successor(supervised)
+                        self._schedule_restart(supervised, now, "stalled")
+            if supervised.process is None and now >= supervised.next_start_at:
+                supervised.restart_count += 1
+                supervised.start()
+        self.write_status(now)
+
+    def handoff(self, supervised, now):
+        """Move a process onto its next outputs without a gap in the recording.
+
+        A successor is started ROTATION_LEAD seconds before the boundary and
+        writes to the new period's folders while the current process keeps
+        recording. Once the boundary has passed and the successor has written
+        its first chunk, the old process is stopped and the successor takes
+        its place, so the two recordings overlap by a few seconds instead of
+        leaving a hole. If the successor fails, the process is restarted
+        outright. Returns the process now in charge.
+        """
+        successor = supervised.successor
+        if successor is None:
+            log.info("recorder starting successor for the next period", extra={"recorder": supervised.name})
+            supervised.spawn_successor()
+            return supervised
+        if successor.process.poll() is not None:
+            self._drop_successor(supervised)
+            if now >= supervised.rotate_at:
+                log.warning("recorder successor exited, restarting onto the next period",
+                            extra={"recorder": supervised.name})
+                self.rotate(supervised)
+            return supervised
+        if now < supervised.rotate_at:
+            return supervised
+        if successor.last_chunk_at() is None:
+            if now - supervised.rotate_at > self.stall_timeout:
+                log.warning("recorder successor produced no chunks, restarting", extra={"recorder": supervised.name})
+                self._drop_successor(supervised)
+                self.rotate(supervised)
+            return supervised
+        stop_process(supervised.process)
+        supervised.stopped()
+        supervised.successor = None
+        self.processes[supervised.name] = successor
+        return successor
+
+    def _drop_successor(self, supervised):
+        """Stop a successor that will not take over"""
+        if supervised.successor:
+            stop_process(supervised.successor.process)
+            supervised.successor.stopped()
+            supervised.successor = None
+            for watcher in supervised.watchers:
+                watcher.overlap_from = None
+
+    def rotate(self, supervised):
+        """Restart a healthy process onto its next outputs; not counted as a failure"""
+        stop_process(supervised.process)
+        supervised.stopped()
+        supervised.start(period_start=max(time.time(), supervised.rotate_at))
+
+    def status(self, now=None):
+        """Health snapshot of every supervised process"""
+        now = now or time.time()
+        return {name: p.status(now) for name, p in self.processes.items()}
+
+    def write_status(self, now=None):
+        """Write the status snapshot to the status file, if configured"""
+        if not self.status_file:
+            return
+        payload = {"updated_at": now or time.time(), "processes": self.status(now)}
+        tmp_path = f"{self.status_file}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(payload, f, indent=4)
+        os.replace(tmp_path, self.status_file)
+
+    def stop_all(self):
+        """Stop every supervised process"""
+        for name in list(self.processes):
+            self.remove(name)
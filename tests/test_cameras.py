@@ -0,0 +1,56 @@
+import pytest
+
+from cameras import CameraBatchError, apply_camera_batch, camera_entry_errors
+
+PROFILES = {"ladder": [{"height": 480, "bitrate": "600k"}]}
+
+def config():
+    return {"cameras": [{"guid": "gate", "name": "Gate", "url": "rtsp://10.0.0.5/1",
+                         "username": "", "password": "", "codec_mode": "auto"}],
+            "profiles": PROFILES}
+
+def test_valid_new_camera_has_no_errors():
+    entry = {"name": "Yard", "url": "rtsp://10.0.0.6/1", "username": "admin", "password": "secret",
+             "codec_mode": "copy", "profile": "ladder", "retention": {"max_days": 30, "max_gb": 1.5}}
+    assert camera_entry_errors(entry, PROFILES, is_new=True) == []
+
+@pytest.mark.parametrize("entry, error", [
+    ({"name": "Yard"}, "'url' is required"),
+    ({"name": "Yard", "url": 5}, "url must be a string"),
+    ({"name": ["Yard"], "url": "rtsp://x"}, "name must be a string"),
+    ({"name": "Yard", "url": "rtsp://x", "username": 1}, "username must be a string"),
+    ({"name": "Yard", "url": "rtsp://x", "password": None}, "password must be a string"),
+    ({"name": "Yard", "url": "rtsp://x", "profile": ["ladder"]}, "profile must be a string"),
+    ({"name": "Yard", "url": "rtsp://x", "profile": "missing"}, "unknown profile 'missing'"),
+    ({"name": "Yard", "url": "rtsp://x", "codec_mode": "fast"}, "codec_mode must be one of transcode, copy, auto"),
+    ({"name": "Yard", "url": "rtsp://x", "retention": 30}, "retention must be an object"),
+    ({"name": "Yard", "url": "rtsp://x", "retention": {"max_days": "30"}}, "retention.max_days must be a positive number"),
+    ({"name": "Yard", "url": "rtsp://x", "retention": {"max_gb": True}}, "retention.max_gb must be a positive number"),
+    ({"name": "Yard", "url": "rtsp://x", "retention": {"days": 3}}, "unknown retention field 'days'"),
+    ({"name": "Yard", "url": "rtsp://x", "color": "red"}, "unknown field 'color'"),
+    ({"guid": "../etc", "name": "Yard", "url": "rtsp://x"}, "guid may only contain letters, digits, '_' and '-'"),
+])
+def test_invalid_entries_are_reported(entry, error):
+    assert error in camera_entry_errors(entry, PROFILES, is_new=True)
+
+def test_update_needs_only_the_changed_fields():
+    assert camera_entry_errors({"guid": "gate", "codec_mode": "copy"}, PROFILES, is_new=False) == []
+
+def test_invalid_entry_rejects_the_whole_batch():
+    with pytest.raises(CameraBatchError) as error:
+        apply_camera_batch(config(), [{"name": "Yard", "url": "rtsp://10.0.0.6/1"}, {"url": 5}], ["gate"])
+    assert error.value.errors == [{"index": 1, "errors": ["'name' is required", "url must be a string"]}]
+
+def test_batch_creates_updates_and_deletes():
+    current = config()
+    current["cameras"].append({"guid": "dock", "name": "Dock", "url": "rtsp://10.0.0.7/1"})
+    summary = apply_camera_batch(current, [
+        {"guid": "yard", "name": "Yard", "url": "rtsp://10.0.0.6/1", "retention": None},
+        {"guid": "gate", "retention": {"max_days": 7}},
+    ], ["dock", "gone"])
+    assert summary == {"created": ["yard"], "updated": ["gate"], "unchanged": [],
+                       "deleted": ["dock"], "missing": ["gone"]}
+    cameras = {c["guid"]: c for c in current["cameras"]}
+    assert "retention" not in cameras["yard"]
+    assert cameras["gate"]["retention"] == {"max_days": 7}
+    assert set(cameras) == {"gate", "yard"}
@@ -0,0 +1,135 @@
+import struct
+import xml.etree.ElementTree as ET
+from datetime import datetime
+
+import pytest
+
+from catalog import RecordingCatalog
+from clips import find_clip_segments, recorded_segments
+from fmp4 import NTP_UNIX_OFFSET
+from integrity import CORRUPT, OK, Segment, append_records, shard_key
+from mpd import NS
+from shards import register_shard
+from snapshots import create_snapshot
+
+DATE = "2026-10-18"
+T0 = datetime(2026, 10, 18, 10, 0).timestamp()
+SEGMENT = 4
+
+MANIFEST = """<?xml version="1.0" encoding="utf-8"?>
+<MPD xmlns="urn:mpeg:dash:schema:mpd:2011" type="dynamic">
+  <Period id="0" start="PT0S">
+    <AdaptationSet contentType="video">
+      <Representation id="0" bandwidth="1000000">
+        <SegmentTemplate timescale="1000" initialization="init.m4s" media="chunk-$Number%05d$.m4s" startNumber="1">
+          <SegmentTimeline><S t="0" d="{d}" r="{r}" /></SegmentTimeline>
+        </SegmentTemplate>
+      </Representation>
+    </AdaptationSet>
+  </Period>
+</MPD>
+"""
+
+def chunk_bytes(wall_time, media_time):
+    """A prft box anchoring media_time to wall_time, then an empty mdat"""
+    ntp = wall_time + NTP_UNIX_OFFSET
+    seconds = int(ntp)
+    prft = struct.pack(">I4sB3xIIII", 28, b"prft", 0, 1, seconds, int((ntp - seconds) * 2 ** 32), media_time)
+    return prft + struct.pack(">I4s", 8, b"mdat")
+
+def make_shard(day_dir, registered_at, footage_from, count):
+    """Record ``count`` segments from ``footage_from`` into the shard registered at ``registered_at``"""
+    shard = datetime.fromtimestamp(registered_at).strftime("%H%M%S")
+    shard_dir = day_dir / shard
+    shard_dir.mkdir(parents=True)
+    register_shard(day_dir, shard, registered_at)
+    (shard_dir / "manifest.mpd").write_text(MANIFEST.format(d=SEGMENT * 1000, r=count - 1))
+    (shard_dir / "init.m4s").write_bytes(b"")
+    for n in range(1, count + 1):
+        media_time = (n - 1) * SEGMENT * 1000
+        (shard_dir / f"chunk-{n:05d}.m4s").write_bytes(chunk_bytes(footage_from + (n - 1) * SEGMENT, media_time))
+    return shard_dir
+
+@pytest.fixture
+def day_dir(tmp_path):
+    """Two shards around a rotation at T0 + 60: the successor started 10 s early
+    and the old recorder kept going until T0 + 64"""
+    day_dir = tmp_path / DATE / "cam"
+    make_shard(day_dir, T0, T0, 16)
+    make_shard(day_dir, T0 + 60, T0 + 50, 10)
+    return day_dir
+
+def index_day(day_dir, damaged=()):
+    records = []
+    for shard, count, footage_from in (("100000", 16, T0), ("100100", 10, T0 + 50)):
+        for n in range(1, count + 1):
+            status = CORRUPT if (shard, n) in damaged else OK
+            records.append(Segment(shard_key(shard), n, footage_from + (n - 1) * SEGMENT, SEGMENT, 36, 0, status))
+    append_records(day_dir, records)
+
+def numbers(groups):
+    return [(shard["id"], [n for n, _, _ in segments]) for shard, segments in groups]
+
+def test_each_shard_ends_where_the_next_begins(day_dir):
+    groups = recorded_segments(day_dir)
+    assert numbers(groups) == [("100000", list(range(1, 14))), ("100100", list(range(1, 11)))]
+    (_, first), (_, second) = groups
+    assert first[-1][1] < second[0][1] == pytest.approx(T0 + 50)
+
+def test_clip_across_the_rotation_has_no_repeated_footage(day_dir):
+    groups = find_clip_segments(day_dir, T0 + 40, T0 + 70)
+    assert [(shard_dir.name, [p.name for p in chunks]) for shard_dir, chunks in groups] == [
+        ("100000", ["chunk-00011.m4s", "chunk-00012.m4s", "chunk-00013.m4s"]),
+        ("100100", [f"chunk-{n:05d}.m4s" for n in range(1, 6)]),
+    ]
+
+def test_clip_after_the_rotation_reads_only_the_new_shard(day_dir):
+    groups = find_clip_segments(day_dir, T0 + 62, T0 + 70)
+    assert [(shard_dir.name, [p.name for p in chunks]) for shard_dir, chunks in groups] == [
+        ("100100", ["chunk-00004.m4s", "chunk-00005.m4s"]),
+    ]
+
+def test_indexed_day_is_trimmed_and_skips_damaged_segments(day_dir):
+    index_day(day_dir, damaged={("100000", 12)})
+    # The manifests are not needed once the index covers every shard
+    for manifest in day_dir.glob("*/manifest.mpd"):
+        manifest.write_text(MANIFEST.format(d=SEGMENT * 1000, r=0))
+    assert numbers(recorded_segments(day_dir)) == [
+        ("100000", [n for n in range(1, 14) if n != 12]),
+        ("100100", list(range(1, 11))),
+    ]
+
+def test_snapshot_stops_each_shard_at_the_handoff(day_dir):
+    snapshot = create_snapshot(day_dir.parent.parent, "cam", DATE)
+    assert [(s["id"], s["first_segment"], s["last_segment"]) for s in snapshot["shards"]] == [
+        ("100000", 1, 13), ("100100", 1, 10)]
+
+def test_link_snapshot_manifest_skips_damaged_segments(day_dir):
+    index_day(day_dir, damaged={("100000", 12)})
+    snapshot = create_snapshot(day_dir.parent.parent, "cam", DATE)
+    assert snapshot["mode"] == "link"
+    snapshot_dir = day_dir.parent / "cam_snapshots"
+    manifest = ET.fromstring((snapshot_dir / f"manifest_{snapshot['id']}.mpd").read_text())
+    played = []
+    for period in manifest.findall("mpd:Period", NS):
+        template = period.find(".//mpd:SegmentTemplate", NS)
+        first = int(template.get("startNumber"))
+        count = sum(int(s.get("r", "0")) + 1 for s in template.iterfind("mpd:SegmentTimeline/mpd:S", NS))
+        shard = template.get("media").split("/")[1]
+        played += [(shard, n) for n in range(first, first + count)]
+    assert played == [("100000", n) for n in range(1, 14) if n != 12] + [("100100", n) for n in range(1, 11)]
+    for shard, n in played:
+        assert (snapshot_dir / snapshot["id"] / shard / f"chunk-{n:05d}.m4s").exists()
+
+def test_catalog_counts_overlap_bytes_but_not_segments(day_dir, tmp_path):
+    catalog = RecordingCatalog(db_path=str(tmp_path / "recordings.db"), root=tmp_path)
+    catalog.scan_day("cam", DATE, day_dir)
+    row = catalog.list_recordings()[0]
+    assert row["segment_count"] == 23
+    assert row["bytes"] == 26 * 36
+
+    catalog.on_segment(day_dir / "100100" / "chunk-00010.m4s")
+    catalog.on_segment(day_dir / "100000" / "chunk-00016.m4s", overlap=True)
+    row = catalog.list_recordings()[0]
+    assert row["segment_count"] == 24
+    assert row["bytes"] == 28 * 36
@@ -0,0 +1,35 @@
+import sqlite3
+
+import pytest
+
+from cluster import LEASE_MARGIN, LEASE_SECONDS, ClusterNode
+
+CAMERAS = [{"guid": f"cam_{i}"} for i in range(8)]
+
+@pytest.fixture
+def db_path(tmp_path):
+    return str(tmp_path / "cluster.db")
+
+def test_shared_database_uses_the_rollback_journal(db_path, tmp_path):
+    with sqlite3.connect(db_path) as conn:
+        conn.execute("PRAGMA journal_mode=WAL")
+    ClusterNode(db_path, "node-1", "http://127.0.0.1:5101", tmp_path)
+    with sqlite3.connect(db_path) as conn:
+        assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "delete"
+
+def test_cameras_stop_before_an_unrenewed_lease_runs_out(db_path, tmp_path):
+    node = ClusterNode(db_path, "node-1", "http://127.0.0.1:5101", tmp_path)
+    owned = node.claim(CAMERAS, now=1000)
+    assert owned == CAMERAS
+    # Renewals failing: recording goes on while the last lease lasts
+    assert node.held(CAMERAS, now=1000 + LEASE_SECONDS - LEASE_MARGIN - 1) == CAMERAS
+    assert node.held(CAMERAS, now=1000 + LEASE_SECONDS - LEASE_MARGIN) == []
+
+def test_cameras_claimed_by_another_node_are_not_held(db_path, tmp_path):
+    first = ClusterNode(db_path, "node-1", "http://127.0.0.1:5101", tmp_path)
+    second = ClusterNode(db_path, "node-2", "http://127.0.0.1:5102", tmp_path)
+    first.claim(CAMERAS, now=1000)
+    second.heartbeat(1000)
+    kept = first.claim(CAMERAS, now=1001)
+    assert 0 < len(kept) < len(CAMERAS)
+    assert first.held(CAMERAS, now=1002) == kept
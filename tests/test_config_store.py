@@ -0,0 +1,37 @@
+import json
+import multiprocessing
+import os
+import stat
+
+import pytest
+
+from config_store import ConfigStore
+
+@pytest.fixture
+def config_path(tmp_path):
+    path = tmp_path / "config.json"
+    path.write_text(json.dumps({"cameras": []}))
+    return path
+
+def add_cameras(path, prefix, count):
+    store = ConfigStore(str(path))
+    for i in range(count):
+        store.update(lambda config: config["cameras"].append({"guid": f"{prefix}_{i}"}))
+
+@pytest.mark.skipif(os.name == "nt", reason="needs fork")
+def test_updates_from_several_processes_are_all_kept(config_path):
+    context = multiprocessing.get_context("fork")
+    workers = [context.Process(target=add_cameras, args=(config_path, f"p{n}", 25)) for n in range(3)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join(30)
+        assert worker.exitcode == 0
+    guids = {c["guid"] for c in json.loads(config_path.read_text())["cameras"]}
+    assert len(guids) == 75
+
+@pytest.mark.skipif(os.name == "nt", reason="POSIX permissions")
+def test_save_keeps_the_file_mode(config_path):
+    os.chmod(config_path, 0o640)
+    ConfigStore(str(config_path)).update(lambda config: config["cameras"].append({"guid": "gate"}))
+    assert stat.S_IMODE(os.stat(config_path).st_mode) == 0o640
@@ -0,0 +1,41 @@
+from events import POLL_INTERVAL, EventBus, format_event
+
+def test_streams_past_the_limit_are_told_to_poll():
+    bus = EventBus(max_streams=1)
+    first = bus.stream()
+    assert next(first) == "retry: 3000\n\n"
+
+    second = bus.stream()
+    assert list(second) == [format_event(None, "poll", {"interval": POLL_INTERVAL})]
+    assert bus.streams == 1
+
+    first.close()
+    assert bus.streams == 0
+    third = bus.stream()
+    assert next(third) == "retry: 3000\n\n"
+    third.close()
+
+def test_unstarted_stream_holds_no_slot():
+    bus = EventBus(max_streams=1)
+    bus.stream().close()
+    assert bus.streams == 0
+
+def test_since_returns_newer_events_without_waiting():
+    bus = EventBus()
+    assert bus.since() == (0, [], False)
+    bus.publish("camera", {"camera": "gate", "state": "running"})
+    bus.publish("segment", {"camera": "gate", "at": 100})
+    assert bus.since(0) == (2, [(1, "camera", {"camera": "gate", "state": "running"}),
+                                (2, "segment", {"camera": "gate", "at": 100})], False)
+    assert bus.since(1, kinds={"camera"}) == (2, [], False)
+    assert bus.since(2) == (2, [], False)
+
+def test_since_reports_lost_events():
+    bus = EventBus(history_size=2)
+    for at in range(4):
+        bus.publish("segment", {"at": at})
+    last_id, events, lost = bus.since(1)
+    assert (last_id, [e[0] for e in events], lost) == (4, [3, 4], True)
+    assert bus.since(2)[2] is False
+    # The web process restarted and numbers events from 1 again
+    assert bus.since(10)[2] is True
@@ -0,0 +1,79 @@
+import json
+import threading
+import time
+
+import pytest
+
+from exports import ExportManager
+
+DATE = "2026-10-18"
+
+@pytest.fixture
+def root(tmp_path):
+    for guid in ("gate", "yard"):
+        day_dir = tmp_path / "dash" / DATE / guid
+        day_dir.mkdir(parents=True)
+        (day_dir / "manifest.mpd").write_text("<MPD/>")
+    return tmp_path / "dash"
+
+class Worker(ExportManager):
+    """A web process's export manager whose exports run until released"""
+
+    def __init__(self, root, cache_dir, max_workers=2):
+        super().__init__(root, cache_dir, max_workers)
+        self.release = threading.Event()
+        self.exported = []
+
+    def _export(self, job):
+        self.exported.append(job.id)
+        job.status = "running"
+        job.progress = 0.5
+        self._notify(job)
+        self.release.wait(5)
+        job.output_path.write_bytes(b"mp4")
+        job.status = "done"
+        job.progress = 1.0
+        job.finished_at = time.time()
+        self._notify(job)
+
+def wait_for(condition):
+    deadline = time.time() + 5
+    while not condition():
+        assert time.time() < deadline
+        time.sleep(0.01)
+
+def test_a_job_runs_once_and_every_worker_sees_it(root, tmp_path):
+    first, second = Worker(root, tmp_path / "exports"), Worker(root, tmp_path / "exports")
+    job = first.submit("gate", DATE)
+    wait_for(lambda: job.status == "running")
+
+    assert second.get(job.id).to_dict() == job.to_dict()
+    assert second.submit("gate", DATE).status == "running"
+    first.release.set()
+    wait_for(lambda: job.status == "done")
+    assert first.exported == [job.id]
+    assert second.exported == []
+    assert second.get(job.id).status == "done"
+
+def test_export_cap_is_shared_between_workers(root, tmp_path):
+    first = Worker(root, tmp_path / "exports", max_workers=1)
+    second = Worker(root, tmp_path / "exports", max_workers=1)
+    gate = first.submit("gate", DATE)
+    wait_for(lambda: gate.status == "running")
+    yard = second.submit("yard", DATE)
+    time.sleep(0.3)
+    assert yard.status == "queued"
+    assert first.get(yard.id).status == "queued"
+
+    first.release.set()
+    second.release.set()
+    wait_for(lambda: yard.status == "done")
+
+def test_job_of_an_exited_worker_reads_as_failed(root, tmp_path):
+    manager = Worker(root, tmp_path / "exports")
+    job_id = f"gate_{DATE}_0123456789abcdef"
+    (tmp_path / "exports" / f"{job_id}.json").write_text(json.dumps({
+        "id": job_id, "camera_guid": "gate", "date": DATE, "status": "running", "progress": 0.2,
+        "error": None, "created_at": 0, "finished_at": None}))
+    job = manager.get(job_id)
+    assert (job.status, job.error) == ("failed", "export interrupted")
@@ -0,0 +1,83 @@
+import subprocess
+import sys
+import threading
+from pathlib import Path
+
+import pytest
+
+import ingest
+from ingest import IngestManager
+
+URL = "rtsp://10.0.0.5/stream1"
+
+@pytest.fixture
+def manager():
+    manager = IngestManager()
+    yield manager
+    manager.probe_executor.shutdown(wait=True)
+
+def settle(manager):
+    for future in list(manager.probing.values()):
+        future.result(timeout=5)
+
+def test_failed_probe_is_retried_after_the_retry_interval(manager, monkeypatch):
+    answers = [None, "h264"]
+    calls = []
+    monkeypatch.setattr(ingest, "probe_video_codec", lambda url: calls.append(url) or answers[len(calls) - 1])
+    clock = [1000.0]
+    monkeypatch.setattr(ingest.time, "monotonic", lambda: clock[0])
+
+    assert manager.probe(URL) is None
+    settle(manager)
+    clock[0] += ingest.PROBE_RETRY / 2
+    assert manager.probe(URL) is None
+    assert len(calls) == 1
+
+    clock[0] += ingest.PROBE_RETRY
+    assert manager.probe(URL) is None
+    settle(manager)
+    assert manager.probe(URL) == "h264"
+    assert manager.probe(URL) == "h264"
+    assert len(calls) == 2
+
+def test_new_auto_camera_waits_for_its_probe(manager, monkeypatch):
+    answered = threading.Event()
+    monkeypatch.setattr(ingest, "probe_video_codec", lambda url: answered.wait(5) and "h264")
+    started = []
+    monkeypatch.setattr(manager, "start_source", lambda key, cameras: started.append(key))
+    cameras = [{"guid": "cam", "name": "Gate", "url": URL, "codec_mode": "auto"},
+               {"guid": "cam2", "name": "Yard", "url": URL + "0", "codec_mode": "transcode"}]
+
+    # The sync returns while the probe is still running; the other camera starts
+    manager.sync(cameras)
+    assert started == [(URL + "0", "transcode", ())]
+
+    answered.set()
+    settle(manager)
+    manager.sources = {key: ("cam2",) for key in started}
+    manager.sync(cameras)
+    assert started[-1] == (URL, "copy", ())
+
+def test_ingest_command_writes_motion_samples_from_the_same_decode(tmp_path, monkeypatch):
+    monkeypatch.setattr(ingest, "DASH_ROOT", tmp_path / "dash")
+    monkeypatch.setattr(ingest, "LIVE_ROOT", tmp_path / "live")
+    cameras = [{"guid": "gate", "name": "Gate"}, {"guid": "dock", "name": "Dock"}]
+    cmd = ingest.build_ingest_command(URL, cameras, "copy", started_at=1_700_000_000)
+
+    assert cmd.count("-i") == 1
+    vf = cmd.index(f"fps={ingest.MOTION_FPS},scale={ingest.MOTION_WIDTH}:{ingest.MOTION_HEIGHT},format=gray")
+    assert cmd[vf - 3:vf] == ["-map", "0:v", "-vf"]
+    outputs = cmd[-1].split("|")
+    assert [output.rsplit("/", 4)[-4:] for output in outputs] == [
+        ["gate", "motion", "1700000000", "%Y%m%d-%H%M%S.gray"],
+        ["dock", "motion", "1700000000", "%Y%m%d-%H%M%S.gray"],
+    ]
+    assert outputs[0].startswith("[f=segment:segment_format=rawvideo:segment_time=4:segment_atclocktime=1:")
+    assert (tmp_path / "live" / "gate" / "motion" / "1700000000").is_dir()
+
+def test_roots_come_from_the_environment(tmp_path):
+    env = {"VMS_DASH_ROOT": str(tmp_path / "dash"), "VMS_LIVE_ROOT": str(tmp_path / "live")}
+    out = subprocess.run([sys.executable, "-c", "import ingest; print(ingest.DASH_ROOT); print(ingest.LIVE_ROOT)"],
+                         env=env, cwd=Path(ingest.__file__).parent, capture_output=True, text=True,
+                         check=True).stdout.split()
+    assert out == [str(tmp_path / "dash"), str(tmp_path / "live")]
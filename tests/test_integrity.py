@@ -0,0 +1,125 @@
+import struct
+import zlib
+
+import pytest
+
+from fmp4 import NTP_UNIX_OFFSET
+from integrity import (CORRUPT, MISSING, OK, TRUNCATED, IntegrityVerifier, Segment, append_records,
+                       damaged_numbers, read_index, summarize, verify_segment, video_track)
+
+VIDEO, AUDIO = 2, 1
+TIMESCALE = 90000
+WALL = 1792310400.25
+
+def box(box_type, *parts):
+    body = b"".join(parts)
+    return struct.pack(">I4s", 8 + len(body), box_type.encode()) + body
+
+def full_box(box_type, version, flags, *parts):
+    return box(box_type, struct.pack(">I", version << 24 | flags), *parts)
+
+def trak(track_id, timescale, handler):
+    return box("trak",
+               full_box("tkhd", 0, 3, struct.pack(">III", 0, 0, track_id)),
+               box("mdia",
+                   full_box("mdhd", 0, 0, struct.pack(">IIII", 0, 0, timescale, 0)),
+                   full_box("hdlr", 0, 0, struct.pack(">I4s", 0, handler.encode()))))
+
+def init_segment():
+    """Audio track 1 and video track 2 (3000 ticks per frame by default)"""
+    return box("moov", trak(AUDIO, 48000, "soun"), trak(VIDEO, TIMESCALE, "vide"),
+               box("mvex", full_box("trex", 0, 0, struct.pack(">IIII", AUDIO, 1, 1024, 0)),
+                   full_box("trex", 0, 0, struct.pack(">IIII", VIDEO, 1, 3000, 0))))
+
+def traf(track_id, base_time, samples):
+    """A track fragment with a duration and a size per sample"""
+    entries = b"".join(struct.pack(">II", duration, size) for duration, size in samples)
+    return box("traf",
+               full_box("tfhd", 0, 0x020000, struct.pack(">I", track_id)),
+               full_box("tfdt", 1, 0, struct.pack(">Q", base_time)),
+               full_box("trun", 0, 0x300, struct.pack(">I", len(samples)), entries))
+
+def media_segment(base_time=TIMESCALE * 10, frames=120, frame_size=50, mdat_size=None):
+    """4 s of video anchored at WALL by a prft box, plus a few audio samples"""
+    ntp = WALL + NTP_UNIX_OFFSET
+    prft = full_box("prft", 0, 0, struct.pack(">IIII", VIDEO, int(ntp), int((ntp % 1) * 2 ** 32), base_time))
+    video = [(3000, frame_size)] * frames
+    audio = [(1024, 10)] * 4
+    payload = sum(size for _, size in video + audio)
+    moof = box("moof", full_box("mfhd", 0, 0, struct.pack(">I", 1)),
+               traf(VIDEO, base_time, video), traf(AUDIO, 0, audio))
+    return prft + moof + box("mdat", b"\0" * (payload if mdat_size is None else mdat_size))
+
+@pytest.fixture
+def shard_dir(tmp_path):
+    shard_dir = tmp_path / "2026-10-18" / "cam" / "100000"
+    shard_dir.mkdir(parents=True)
+    (shard_dir / "init.m4s").write_bytes(init_segment())
+    return shard_dir
+
+def test_video_track_is_found_by_handler(shard_dir):
+    assert video_track(shard_dir / "init.m4s") == (VIDEO, TIMESCALE, 3000)
+
+def test_complete_segment_is_ok(shard_dir):
+    data = media_segment()
+    path = shard_dir / "chunk-00001.m4s"
+    path.write_bytes(data)
+    start, duration, size, crc, status = verify_segment(path, video_track(shard_dir / "init.m4s"))
+    assert status == OK
+    # Only the video track counts, and the prft anchors its first sample
+    assert duration == pytest.approx(4.0)
+    assert start == pytest.approx(WALL, abs=1e-6)
+    assert (size, crc) == (len(data), zlib.crc32(data))
+
+@pytest.mark.parametrize("data, status", [
+    (media_segment()[:-100], TRUNCATED),
+    (media_segment(mdat_size=100), CORRUPT),
+    (media_segment()[:28], CORRUPT),
+    (b"\0\0\0\x01junk", CORRUPT),
+])
+def test_damaged_segments(shard_dir, data, status):
+    path = shard_dir / "chunk-00001.m4s"
+    path.write_bytes(data)
+    assert verify_segment(path, video_track(shard_dir / "init.m4s"))[4] == status
+
+def test_missing_segment(shard_dir):
+    assert verify_segment(shard_dir / "chunk-00009.m4s", video_track(shard_dir / "init.m4s"))[4] == MISSING
+
+def test_index_keeps_the_newest_record_per_segment(shard_dir):
+    day_dir = shard_dir.parent
+    append_records(day_dir, [Segment(100000, n, WALL + 4 * n, 4.0, 100, 0, OK) for n in (1, 2, 3)])
+    assert damaged_numbers(shard_dir) == set()
+    append_records(day_dir, [Segment(100000, 2, WALL + 8, 0.0, 0, 0, CORRUPT), Segment(-1, 1, WALL, 4.0, 1, 0, OK)])
+    records = read_index(day_dir)
+    assert [(r.shard, r.number, r.status) for r in records] == [(-1, 1, OK), (100000, 1, OK), (100000, 2, CORRUPT),
+                                                                 (100000, 3, OK)]
+    assert damaged_numbers(shard_dir) == {2}
+
+def test_summary_reports_damage_and_holes():
+    records = [Segment(100000, 1, 0.0, 4.0, 10, 0, OK),
+               Segment(100000, 2, 4.0, 0.0, 0, 0, MISSING),
+               Segment(100000, 3, 8.0, 4.0, 10, 0, OK),
+               Segment(100000, 4, 20.0, 4.0, 10, 0, OK)]
+    summary = summarize(records)
+    assert summary["status"] == {"ok": 3, "truncated": 0, "corrupt": 0, "missing": 1}
+    assert (summary["segments"], summary["damaged"], summary["duration"], summary["bytes"]) == (4, 1, 12.0, 30)
+    # A missing segment has no duration of its own, so its footage shows as a hole too
+    assert summary["gaps"] == [{"start": 4.0, "end": 4.0, "reason": "missing"},
+                               {"start": 4.0, "end": 8.0, "reason": "gap"},
+                               {"start": 12.0, "end": 20.0, "reason": "gap"}]
+
+def test_verifier_fills_in_skipped_numbers(shard_dir):
+    root = shard_dir.parents[2]
+    damaged = []
+    verifier = IntegrityVerifier(root, on_damaged=lambda guid, date, record: damaged.append((guid, date, record)))
+    for n in (1, 3):
+        (shard_dir / f"chunk-{n:05d}.m4s").write_bytes(media_segment(base_time=TIMESCALE * 4 * (n - 1)))
+    verifier.verify_path(shard_dir / "chunk-00001.m4s")
+    verifier.verify_path(shard_dir / "chunk-00003.m4s")
+    # Already indexed: no second record
+    verifier.verify_path(shard_dir / "chunk-00001.m4s")
+    records = read_index(shard_dir.parent)
+    assert [(r.number, r.status) for r in records] == [(1, OK), (2, MISSING), (3, OK)]
+    # A missing segment is placed right after the previous one
+    assert records[1].start == pytest.approx(records[0].start + records[0].duration)
+    assert [(guid, date, record.number) for guid, date, record in damaged] == [("cam", "2026-10-18", 2)]
@@ -0,0 +1,27 @@
+from mjpeg_relay import MjpegRelay, MjpegRelayRegistry, split_jpeg_frames
+
+def test_frames_are_cut_out_of_any_multipart_framing():
+    frames, rest = split_jpeg_frames(b"--x\r\n\r\n\xff\xd8one\xff\xd9\r\n--x\r\n\r\n\xff\xd8tw")
+    assert (frames, rest) == ([b"\xff\xd8one\xff\xd9"], b"\xff\xd8tw")
+
+def test_viewers_past_the_cap_are_refused():
+    registry = MjpegRelayRegistry(max_viewers=2)
+    assert registry.open_viewer() and registry.open_viewer()
+    assert not registry.open_viewer()
+    registry.close_viewer()
+    assert registry.open_viewer()
+
+def test_slow_viewer_skips_to_the_newest_frame():
+    relay = MjpegRelay({"guid": "gate", "url": "http://127.0.0.1:9/"})
+    relay._ensure_running = lambda: None
+    viewer = relay.stream()
+    with relay.condition:
+        relay.frames.append(b"a")
+        relay.sequence = 1
+    assert next(viewer).endswith(b"a\r\n")
+    with relay.condition:
+        relay.frames.extend([b"b", b"c"])
+        relay.sequence = 3
+    assert next(viewer).endswith(b"c\r\n")
+    viewer.close()
+    assert relay.viewers == 0
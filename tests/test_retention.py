@@ -0,0 +1,147 @@
+import json
+import sqlite3
+import time
+from datetime import datetime, timedelta
+
+import pytest
+
+from catalog import RecordingCatalog
+from config_store import ConfigStore
+from retention import RetentionService, fetch_back
+from snapshots import get_snapshot_dir
+
+CHUNK = b"\0" * 100
+
+def days_ago(days):
+    return (datetime.now() - timedelta(days=days)).strftime("%Y-%m-%d")
+
+@pytest.fixture
+def node(tmp_path):
+    """A recording root, a cold root, a catalog and a config file to fill in"""
+    hot, cold = tmp_path / "hot", tmp_path / "cold"
+    hot.mkdir()
+    db_path = str(tmp_path / "recordings.db")
+    catalog = RecordingCatalog(db_path=db_path, root=hot)
+    config_path = tmp_path / "config.json"
+
+    def configure(cameras=(), **storage):
+        config_path.write_text(json.dumps({"cameras": list(cameras), "storage": {"cold_root": str(cold), **storage}}))
+
+    def record(guid, date, chunks=3, age=7 * 24 * 3600):
+        """A recorded camera/day whose catalog row was last touched ``age`` seconds ago"""
+        shard_dir = hot / date / guid / "100000"
+        shard_dir.mkdir(parents=True)
+        (shard_dir / "init.m4s").write_bytes(b"")
+        for n in range(1, chunks + 1):
+            (shard_dir / f"chunk-{n:05d}.m4s").write_bytes(CHUNK)
+            catalog.add_segment(guid, date, len(CHUNK), time.time())
+        with sqlite3.connect(db_path) as conn:
+            conn.execute("UPDATE recordings SET updated_at = ? WHERE camera_guid = ? AND date = ?",
+                         (time.time() - age, guid, date))
+
+    configure()
+    service = RetentionService(hot, ConfigStore(str(config_path)), catalog)
+    return service, catalog, hot, cold, configure, record
+
+def rows(catalog):
+    return {(r["camera_guid"], r["date"]): r for r in catalog.list_days()}
+
+def reference_snapshot(root, guid, date, first, last):
+    """Snapshot metadata of a reference-mode snapshot (one that reads the live folder)"""
+    snapshot_dir = get_snapshot_dir(root, guid, date)
+    snapshot_dir.mkdir(parents=True)
+    (snapshot_dir / "snapshot_1.json").write_text(json.dumps({
+        "id": "1", "camera_guid": guid, "date": date, "mode": "reference",
+        "shards": [{"id": "100000", "first_segment": first, "last_segment": last}]}))
+
+def test_old_days_move_to_the_cold_root(node):
+    service, catalog, hot, cold, configure, record = node
+    old, recent = days_ago(10), days_ago(1)
+    record("gate", old)
+    record("gate", recent)
+    configure(cold_after_days=5)
+    service.run_once()
+    assert rows(catalog)[("gate", old)]["tier"] == "cold"
+    assert rows(catalog)[("gate", recent)]["tier"] == "hot"
+    assert (cold / old / "gate" / "100000" / "chunk-00003.m4s").exists()
+    assert not (hot / old).exists()
+    assert (hot / recent / "gate").exists()
+
+def test_fetched_back_day_returns_hot_and_is_held(node):
+    service, catalog, hot, cold, configure, record = node
+    old = days_ago(10)
+    record("gate", old)
+    service.move_to_cold(rows(catalog)[("gate", old)], cold)
+
+    fetch_back(hot, cold, "gate", old, catalog)
+    assert rows(catalog)[("gate", old)]["tier"] == "hot"
+    assert sorted(p.name for p in (hot / old / "gate" / "100000").iterdir()) == [
+        "chunk-00001.m4s", "chunk-00002.m4s", "chunk-00003.m4s", "init.m4s"]
+    assert not (cold / old / "gate").exists()
+
+    # Someone is watching it: the next pass must not send it straight back
+    configure(cold_after_days=5)
+    service.run_once()
+    assert rows(catalog)[("gate", old)]["tier"] == "hot"
+    assert (hot / old / "gate").exists()
+
+def test_evicting_a_cold_day_deletes_it_from_the_cold_root(node):
+    service, catalog, hot, cold, configure, record = node
+    old = days_ago(10)
+    record("gate", old)
+    service.move_to_cold(rows(catalog)[("gate", old)], cold)
+    configure([{"guid": "gate", "retention": {"max_days": 3}}])
+    service.run_once()
+    assert rows(catalog) == {}
+    assert not (cold / old).exists()
+
+def test_eviction_keeps_segments_a_reference_snapshot_reads(node):
+    service, catalog, hot, cold, configure, record = node
+    old = days_ago(10)
+    record("gate", old, chunks=4)
+    reference_snapshot(hot, "gate", old, 2, 3)
+    configure([{"guid": "gate", "retention": {"max_days": 3}}])
+    service.run_once()
+    shard_dir = hot / old / "gate" / "100000"
+    assert sorted(p.name for p in shard_dir.iterdir()) == ["chunk-00002.m4s", "chunk-00003.m4s", "init.m4s"]
+    assert rows(catalog)[("gate", old)]["bytes"] == 2 * len(CHUNK)
+
+def test_referenced_day_stays_on_the_recording_disk(node):
+    service, catalog, hot, cold, configure, record = node
+    old = days_ago(10)
+    record("gate", old)
+    reference_snapshot(hot, "gate", old, 1, 3)
+    configure(cold_after_days=5)
+    service.run_once()
+    assert rows(catalog)[("gate", old)]["tier"] == "hot"
+    assert not (cold / old).exists()
+
+def test_size_limit_evicts_the_oldest_days_first(node):
+    service, catalog, hot, cold, configure, record = node
+    for age in (4, 3, 2):
+        record("gate", days_ago(age))
+    # Room for a little over two days
+    configure([{"guid": "gate", "retention": {"max_gb": 7 * len(CHUNK) / 1024 ** 3}},
+               {"guid": "yard", "retention": "forever"}])
+    service.run_once()
+    assert sorted(date for _, date in rows(catalog)) == [days_ago(3), days_ago(2)]
+    assert not (hot / days_ago(4)).exists()
+
+def test_rescanning_a_cold_day_keeps_its_tier(node):
+    service, catalog, hot, cold, configure, record = node
+    old = days_ago(10)
+    record("gate", old)
+    service.move_to_cold(rows(catalog)[("gate", old)], cold)
+    catalog.scan_day("gate", old, cold / old / "gate")
+    row = rows(catalog)[("gate", old)]
+    assert (row["tier"], row["segment_count"], row["bytes"]) == ("cold", 3, 3 * len(CHUNK))
+
+def test_segments_a_link_snapshot_shares_are_not_counted_as_freed(node):
+    service, catalog, hot, cold, configure, record = node
+    old = days_ago(10)
+    record("gate", old)
+    linked = hot / old / "gate_snapshots" / "1" / "100000"
+    linked.mkdir(parents=True)
+    (linked / "chunk-00001.m4s").hardlink_to(hot / old / "gate" / "100000" / "chunk-00001.m4s")
+    assert service.evict_day(rows(catalog)[("gate", old)]) == (3 * len(CHUNK), 2 * len(CHUNK))
+    assert (linked / "chunk-00001.m4s").read_bytes() == CHUNK
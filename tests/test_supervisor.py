@@ -0,0 +1,127 @@
+import logging
+import os
+import sys
+import time
+
+import pytest
+
+import supervisor
+from logs import LogfmtFormatter
+from supervisor import BACKOFF_INITIAL, ProcessSupervisor, SupervisedProcess
+
+# Stands in for ffmpeg: writes a chunk into its output folder every 50 ms
+WRITER = """
+import os, sys, time
+n = 1
+while True:
+    with open(os.path.join(sys.argv[1], "chunk-%05d.m4s" % n), "wb") as f:
+        f.write(b"x")
+    n += 1
+    time.sleep(0.05)
+"""
+
+@pytest.fixture
+def outputs(tmp_path):
+    def output_dir(started_at):
+        path = tmp_path / f"{started_at:.3f}"
+        path.mkdir(exist_ok=True)
+        return path
+
+    def build_command(started_at):
+        return [sys.executable, "-c", WRITER, str(output_dir(started_at))]
+
+    return build_command, lambda started_at: [output_dir(started_at)]
+
+@pytest.fixture
+def recorders():
+    created = []
+    yield created
+    for owner in created:
+        owner.stop_all()
+
+def wait_until(condition, timeout=10, interval=0.05):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if condition():
+            return True
+        time.sleep(interval)
+    return False
+
+def test_schedule_restart_logs_structured_fields(caplog):
+    caplog.set_level(logging.INFO)
+    owner = ProcessSupervisor()
+    supervised = SupervisedProcess("cam_a", lambda started_at: [], lambda started_at: [])
+    now = time.time()
+    supervised.started_at = now - 5
+
+    owner._schedule_restart(supervised, now, "exited with code 1")
+    owner._schedule_restart(supervised, now, "exited with code 1")
+
+    assert supervised.failures == 2
+    assert supervised.next_start_at == now + BACKOFF_INITIAL * 2
+    record = caplog.records[-1]
+    assert "recorder=cam_a" in LogfmtFormatter().format(record)
+
+def test_exited_process_is_restarted_after_backoff(tmp_path, recorders, monkeypatch, caplog):
+    caplog.set_level(logging.INFO)
+    monkeypatch.setattr(supervisor, "BACKOFF_INITIAL", 0.2)
+    owner = ProcessSupervisor(status_file=str(tmp_path / "status.json"))
+    recorders.append(owner)
+    supervised = owner.add("cam_a", lambda started_at: [sys.executable, "-c", "import sys; sys.exit(3)"],
+                           lambda started_at: [tmp_path])
+    supervised.process.wait()
+
+    owner.poll()
+    assert supervised.process is None
+    assert supervised.last_exit == "exited with code 3"
+
+    assert wait_until(lambda: owner.poll() or supervised.process is not None)
+    assert supervised.restart_count == 1
+
+def test_stalled_process_is_stopped(tmp_path, recorders, caplog):
+    caplog.set_level(logging.INFO)
+    owner = ProcessSupervisor(stall_timeout=0.2)
+    recorders.append(owner)
+    supervised = owner.add("cam_a", lambda started_at: [sys.executable, "-c", "import time; time.sleep(30)"],
+                           lambda started_at: [tmp_path])
+    process = supervised.process
+    time.sleep(0.3)
+
+    owner.poll()
+    assert supervised.last_exit == "stalled"
+    assert process.poll() is not None
+
+def test_rotation_hands_over_to_successor(outputs, recorders, caplog):
+    caplog.set_level(logging.INFO)
+    build_command, output_dirs = outputs
+    segments = []
+    owner = ProcessSupervisor(segment_listeners=[lambda path, **kwargs: segments.append(path)])
+    recorders.append(owner)
+    original = owner.add("cam_a", build_command, output_dirs,
+                         next_rotation=lambda period_start: period_start + 1.0)
+
+    # Within ROTATION_LEAD of the boundary: the successor starts right away
+    owner.poll()
+    successor = original.successor
+    assert successor is not None
+    assert successor.period_start == original.rotate_at
+
+    assert wait_until(lambda: owner.poll() or owner.processes["cam_a"] is successor)
+    assert original.process.poll() is not None
+    assert successor.process.poll() is None
+    assert successor.successor is None
+    folders = {str(output_dirs(original.period_start)[0]), str(output_dirs(successor.period_start)[0])}
+    assert {path.rsplit("chunk-", 1)[0].rstrip("/\\") for path in segments} == folders
+
+def test_chunks_started_after_the_successor_are_flagged_as_overlap(tmp_path):
+    closed = []
+    watcher = supervisor.ChunkWatcher(str(tmp_path), since=100.0,
+                                      on_segment=lambda path, overlap: closed.append((path[-9:], overlap)))
+    watcher.overlap_from = 108.0
+    for n, mtime in enumerate((104.0, 108.0, 112.0), start=1):
+        path = tmp_path / f"chunk-{n:05d}.m4s"
+        path.write_bytes(b"x")
+        os.utime(path, (mtime, mtime))
+    watcher.check()
+    watcher.flush()
+    assert closed == [("00001.m4s", False), ("00002.m4s", False), ("00003.m4s", True)]
@@ -0,0 +1,20 @@
+"""WSGI entry point for production servers.
+
+    waitress-serve --threads=136 --outbuf-high-watermark=524288 wsgi:app
+    gunicorn --workers 1 --worker-class gthread --threads 136 wsgi:app
+
+Run one web process with threads (serve.py explains the thread count), not
+several workers. Some state still lives in the process that serves a request:
+- the /events bus and its watcher, so a page would only hear its own worker;
+- the MJPEG relays, so every worker would open its own camera connection;
+- the config cache, reloaded only when this process notices a change;
+- the stream caps, which would multiply with the workers;
+- the /metrics counters, which a scrape would read from one worker only.
+
+The recorders are owned by start_dash_streams.py, so the web process never
+starts a camera.
+"""
+from logs import configure_logging
+from server import app
+
+configure_logging()